@@ -0,0 +1,329 @@
+'''
+Benchmark of win_dissect and volxlsx on synthetic cases.
+
+Generates a KAPE-shaped target (real EVTX files, placeholder artefacts) and a placeholder memory dump at a given scale, then runs
+win_dissect and volxlsx on them with stand-in tools (stub_tools.py) in place of Eric Zimmerman's tools and vol.exe. Each run happens
+in its own process, which records the wall time and rows per second of every stage and its peak memory. Results can be saved as
+a baseline and later runs compared to it: stages slower than the baseline by more than the tolerance are reported as regressions
+and the benchmark exits with code 1.
+
+python bench\\benchmark.py -s small -o [work folder] --save-baseline bench\\baseline.json
+python bench\\benchmark.py -s small -o [work folder] --baseline bench\\baseline.json
+
+https://github.com/Martendal/DFIR-tools
+'''
+
+import os, sys
+import json
+import ntpath
+import shutil
+import logging
+import argparse
+import platform
+import subprocess
+import time
+
+BENCH_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_FOLDER))
+
+from synthetic import SCALES, channel_names, channel_events, write_evtx
+from stub_tools import BENCH_ENV, TOOL_OUTPUTS
+
+
+STUB_TOOLS = os.path.join(BENCH_FOLDER, 'stub_tools.py')
+STUBBED_TOOLS = set(TOOL_OUTPUTS) | {'evtxecmd.exe', 'vol.exe'}
+
+TARGET_SETTINGS = "bench_target.json"
+RESULTS_NAME = "bench_results.json"
+DUMP_NAME = "memory.raw"
+DUMP_MB = 64
+
+# Stages shorter than this (in seconds, in the baseline) are too noisy to be compared
+MIN_COMPARED_SECONDS = 0.5
+
+
+####### Synthetic target ####
+
+def placeholder(path, size=4096):
+	with open(path, 'wb') as f:
+		f.truncate(size)
+
+
+# KAPE-like tree under [work]\target\C, kept between runs when the scale and the seed did not change
+def make_target(work, scale, seed):
+	target_root = os.path.join(work, "target", "C")
+	settings = {'scale': scale, 'seed': seed}
+	settings_path = os.path.join(work, TARGET_SETTINGS)
+	if os.path.exists(settings_path):
+		with open(settings_path, 'r', encoding='utf-8') as f:
+			if json.load(f) == settings:
+				print("Reusing the synthetic target in "+work)
+				return target_root
+	print("Generating the synthetic target in "+work)
+	if os.path.exists(os.path.join(work, "target")):
+		shutil.rmtree(os.path.join(work, "target"))
+
+	logs = os.path.join(target_root, "Windows", "System32", "winevt", "logs")
+	os.makedirs(logs)
+	for channel in channel_names(scale['channels']):
+		write_evtx(os.path.join(logs, channel+".evtx"), channel, channel_events(channel, scale['events_per_log'], seed))
+	prefetch = os.path.join(target_root, "Windows", "prefetch")
+	os.makedirs(prefetch)
+	for number in range(scale['prefetch_files']):
+		placeholder(os.path.join(prefetch, "BENCH"+str(number)+".EXE-"+format(number, '08X')+".pf"))
+	os.makedirs(os.path.join(target_root, "Windows", "AppCompat", "Programs"))
+	placeholder(os.path.join(target_root, "Windows", "AppCompat", "Programs", "Amcache.hve"), 16 * 1024 * 1024)
+	os.makedirs(os.path.join(target_root, "Windows", "System32", "Config"))
+	for hive in ('SYSTEM', 'SOFTWARE', 'SAM', 'SECURITY'):
+		placeholder(os.path.join(target_root, "Windows", "System32", "Config", hive), 32 * 1024 * 1024)
+	os.makedirs(os.path.join(target_root, "Windows", "System32", "SRU"))
+	placeholder(os.path.join(target_root, "Windows", "System32", "SRU", "SRUDB.dat"), 32 * 1024 * 1024)
+	os.makedirs(os.path.join(target_root, "$Extend"))
+	placeholder(os.path.join(target_root, "$Extend", "$J"), scale['usn_rows'] * 100)
+	recent = os.path.join(target_root, "Users", "bench", "AppData", "Roaming", "Microsoft", "Windows", "Recent")
+	os.makedirs(recent)
+	for number in range(min(scale['lnk_rows'], 1000)):
+		placeholder(os.path.join(recent, "document"+str(number)+".lnk"), 1024)
+	os.makedirs(os.path.join(target_root, "$Recycle.Bin", "S-1-5-21-1004336348-1177238915-682003330-1001"))
+	placeholder(os.path.join(work, DUMP_NAME), DUMP_MB * 1024 * 1024)
+
+	with open(settings_path, 'w', encoding='utf-8') as f:
+		json.dump(settings, f)
+	return target_root
+
+
+####### Measured runs ####
+# Each run is a child process ("--child windissect|volxlsx"), so that its peak memory is its own. Tool commands go through
+# supervisor.tool_command in both scripts (supervisor.run_tool), the child points them to stub_tools.py.
+
+def stub_command(command):
+	command = [str(part) for part in command]
+	if ntpath.basename(command[0]).lower() in STUBBED_TOOLS:
+		command = [sys.executable, STUB_TOOLS] + command
+	return command
+
+
+def stub_popen(command, *args, **kwargs):
+	return REAL_POPEN(stub_command(command), *args, **kwargs)
+
+REAL_POPEN = subprocess.Popen
+
+
+# Peak memory of this process and (POSIX only) of its largest child, in MB
+def peak_memory():
+	if os.name == 'nt':
+		import ctypes
+		from ctypes import wintypes
+
+		class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+			_fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD), ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+				('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t), ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+				('QuotaNonPagedPoolUsage', ctypes.c_size_t), ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+		counters = PROCESS_MEMORY_COUNTERS()
+		counters.cb = ctypes.sizeof(counters)
+		ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+		return counters.PeakWorkingSetSize / 1048576, None
+	import resource
+	unit = 1048576 if sys.platform == 'darwin' else 1024
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit
+
+
+def stage_metrics(seconds, rows):
+	return {'seconds': round(seconds, 3), 'rows': rows, 'rows_per_sec': round(rows / seconds) if rows and seconds else None}
+
+
+def run_windissect(work, target_root, options):
+	import win_dissect
+	logging.basicConfig(filename=os.path.join(work, "windissect_log.log"), format='%(asctime)s %(message)s', filemode='w')
+	output_dir = os.path.join(work, "windissect_output")
+	if os.path.exists(output_dir):
+		shutil.rmtree(output_dir)
+	os.makedirs(output_dir)
+	db_path = os.path.join(output_dir, "bench.db")
+	manifest = win_dissect.load_manifest(output_dir)
+	start = time.perf_counter()
+
+	prefetch = {'sheets': win_dissect.load_report_sheets(), 'scans': {}}
+	timings = win_dissect.convert_target(target_root, output_dir, db_path, options['jobs'], options['ingest_workers'], manifest, (), None, options['evtx_engine'], None, prefetch)
+	stages = {}
+	for name, seconds in timings.items():
+		if name == 'database':
+			rows = sum(entry.get('rows') or 0 for stage, entry in manifest['stages'].items() if stage.startswith('table:'))
+		else:
+			rows = sum(output.get('lines', 0) for output in manifest['stages'].get(name, {}).get('outputs', {}).values())
+		stages[name] = stage_metrics(seconds or 0, rows) if seconds is not None else {'seconds': None, 'rows': 0, 'rows_per_sec': None, 'failed': True}
+	if options['search_index']:
+		stage_start = time.perf_counter()
+		win_dissect.create_search_stage(db_path, manifest, ())
+		stages['search'] = stage_metrics(time.perf_counter() - stage_start, sum(entry.get('loaded_rows') or 0 for stage, entry in manifest['stages'].items() if stage.startswith('search:')))
+	if options['timeline']:
+		stage_start = time.perf_counter()
+		win_dissect.create_timeline_stage(db_path, output_dir, 'bench', manifest, (), False)
+		stages['timeline'] = stage_metrics(time.perf_counter() - stage_start, manifest['stages']['timeline'].get('rows'))
+	stage_start = time.perf_counter()
+	win_dissect.create_report_stage(db_path, os.path.join(output_dir, "bench.xlsx"), manifest, (), None, prefetch['scans'], options['report_workers'])
+	stages['report'] = stage_metrics(time.perf_counter() - stage_start, None)
+	return stages, time.perf_counter() - start
+
+
+def run_volxlsx(work, options):
+	import volxlsx
+	output = os.path.join(work, "bench_volxlsx.xlsx")
+	start = time.perf_counter()
+	log = open(os.path.join(work, "volxlsx_log.txt"), 'w', encoding='utf-8')
+	stdout = sys.stdout
+	sys.stdout = log
+	try:
+		summary = volxlsx.create_xlsx_report(os.path.join(work, DUMP_NAME), output, options['vol_jobs'], None, "vol")
+	finally:
+		sys.stdout = stdout
+		log.close()
+	stages = {}
+	for name, status, rows, seconds in summary:
+		stages[name] = stage_metrics(seconds, rows)
+		if status not in ('ok', 'cached'):
+			stages[name]['failed'] = True
+	return stages, time.perf_counter() - start
+
+
+def run_child(kind, work, options):
+	import supervisor
+	subprocess.Popen = stub_popen
+	supervisor.tool_command = stub_command
+	os.environ[BENCH_ENV] = json.dumps({'scale': options['scale'], 'seed': options['seed'], 'rate': options['rate']})
+	if kind == 'windissect':
+		stages, total = run_windissect(work, os.path.join(work, "target", "C"), options)
+	else:
+		stages, total = run_volxlsx(work, options)
+	own, children = peak_memory()
+	result = {'total_seconds': round(total, 3), 'stages': stages, 'peak_rss_mb': round(own, 1), 'children_peak_rss_mb': round(children, 1) if children is not None else None}
+	with open(os.path.join(work, kind+"_metrics.json"), 'w', encoding='utf-8') as f:
+		json.dump(result, f, indent=1)
+
+
+# Runs a measured child "repeat" times and keeps the fastest run
+def measure(kind, work, options, repeat):
+	best = None
+	for number in range(repeat):
+		print("Running "+kind+" ("+str(number + 1)+"/"+str(repeat)+")")
+		code = subprocess.call([sys.executable, os.path.abspath(__file__), '--child', kind, '-o', work, '--options', json.dumps(options)])
+		if code:
+			raise RuntimeError(kind+" benchmark exited with code "+str(code))
+		with open(os.path.join(work, kind+"_metrics.json"), 'r', encoding='utf-8') as f:
+			result = json.load(f)
+		if best is None or result['total_seconds'] < best['total_seconds']:
+			best = result
+	return best
+
+
+####### Baseline ####
+
+# Stages (and totals, and peak memory) worse than the baseline by more than "tolerance" (0.2 = 20%)
+def regressions(results, baseline, tolerance):
+	found = []
+	if baseline.get('scale') != results['scale']:
+		print("Warning: the baseline was recorded at another scale, comparisons are meaningless.")
+	for kind, result in results['runs'].items():
+		reference = baseline.get('runs', {}).get(kind)
+		if reference is None:
+			continue
+		compared = [('total', result['total_seconds'], reference['total_seconds'])]
+		for name, stage in result['stages'].items():
+			if name in reference['stages']:
+				compared.append((name, stage['seconds'], reference['stages'][name]['seconds']))
+		for name, seconds, reference_seconds in compared:
+			if seconds is not None and reference_seconds and reference_seconds >= MIN_COMPARED_SECONDS and seconds > reference_seconds * (1 + tolerance):
+				found.append(kind+" "+name+": "+"%.2f" % seconds+"s, baseline "+"%.2f" % reference_seconds+"s (+"+"%.0f" % ((seconds / reference_seconds - 1) * 100)+"%)")
+		if reference.get('peak_rss_mb') and result['peak_rss_mb'] > reference['peak_rss_mb'] * (1 + tolerance):
+			found.append(kind+" peak memory: "+str(result['peak_rss_mb'])+" MB, baseline "+str(reference['peak_rss_mb'])+" MB")
+	return found
+
+
+def print_results(results, baseline):
+	for kind, result in results['runs'].items():
+		reference = (baseline or {}).get('runs', {}).get(kind, {'stages': {}})
+		print(kind+": "+"%.2f" % result['total_seconds']+"s, peak memory "+str(result['peak_rss_mb'])+" MB"+
+			(" (children "+str(result['children_peak_rss_mb'])+" MB)" if result['children_peak_rss_mb'] is not None else ""))
+		for name, stage in result['stages'].items():
+			line = "\t"+name.ljust(16)+("%.2f" % stage['seconds']+"s" if stage['seconds'] is not None else "failed").rjust(10)
+			line += (str(stage['rows_per_sec'])+" rows/s" if stage['rows_per_sec'] else "").rjust(18)
+			previous = reference['stages'].get(name)
+			if previous and previous['seconds'] and stage['seconds'] is not None:
+				line += ("%+.0f" % ((stage['seconds'] / previous['seconds'] - 1) * 100)+"% vs baseline").rjust(20)
+			print(line)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark of win_dissect and volxlsx on synthetic cases, with stand-in tools.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument("-s", "--scale", required=False, help="Size of the synthetic case.", default="small", choices=list(SCALES))
+	parser.add_argument("-o", "--output", required=False, help="Work folder (synthetic target, outputs and results).", default=os.path.join(os.getcwd(), "bench_work"))
+	parser.add_argument("--channels", required=False, help="Number of EVTX logs (overrides the scale).", default=None, type=int)
+	parser.add_argument("--events", required=False, help="Events per EVTX log (overrides the scale).", default=None, type=int)
+	parser.add_argument("--usn-rows", required=False, help="USN journal rows (overrides the scale).", default=None, type=int)
+	parser.add_argument("--registry-rows", required=False, help="Registry rows (overrides the scale).", default=None, type=int)
+	parser.add_argument("--plugin-rows", required=False, help="Rows per Volatility plugin (overrides the scale).", default=None, type=int)
+	parser.add_argument("--seed", required=False, help="Seed of the synthetic data.", default=1, type=int)
+	parser.add_argument("--rate", required=False, help="Rows per second written by each stand-in tool (0: as fast as possible).", default=0, type=int)
+	parser.add_argument("--only", required=False, help="Only benchmark one of the scripts.", default=None, choices=['windissect', 'volxlsx'])
+	parser.add_argument("-j", "--jobs", required=False, help="win_dissect -j.", default=os.cpu_count() or 1, type=int)
+	parser.add_argument("-w", "--ingest-workers", required=False, help="win_dissect -w.", default=os.cpu_count() or 1, type=int)
+	parser.add_argument("--report-workers", required=False, help="win_dissect --report-workers.", default=os.cpu_count() or 1, type=int)
+	parser.add_argument("--evtx-engine", required=False, help="win_dissect --evtx-engine.", default="evtxecmd", choices=['evtxecmd', 'native'])
+	parser.add_argument("-T", "--timeline", required=False, help="Also time win_dissect -T.", action="store_true")
+	parser.add_argument("-S", "--search-index", required=False, help="Also time win_dissect -S.", action="store_true")
+	parser.add_argument("--vol-jobs", required=False, help="volxlsx -j.", default=2, type=int)
+	parser.add_argument("-r", "--repeat", required=False, help="Runs of each script, the fastest one is kept.", default=1, type=int)
+	parser.add_argument("--baseline", required=False, help="Results to compare to (JSON written by --save-baseline).", default=None)
+	parser.add_argument("--save-baseline", required=False, help="Write the results as a baseline to this path.", default=None)
+	parser.add_argument("--tolerance", required=False, help="Slowdown accepted before a stage counts as a regression (0.2 = 20%%).", default=0.2, type=float)
+	parser.add_argument("--child", required=False, help=argparse.SUPPRESS, default=None, choices=['windissect', 'volxlsx'])
+	parser.add_argument("--options", required=False, help=argparse.SUPPRESS, default=None)
+	config = vars(parser.parse_args())
+	work = config['output']
+	# win_dissect and volxlsx join their paths with "\\": elsewhere the tools would write files the scripts never find, and the
+	# timings would be meaningless
+	if os.name != 'nt':
+		parser.error("the benchmark only runs on Windows, as win_dissect and volxlsx do.")
+
+	if config['child']:
+		run_child(config['child'], work, json.loads(config['options']))
+		return
+
+	scale = dict(SCALES[config['scale']])
+	for option, key in (('channels', 'channels'), ('events', 'events_per_log'), ('usn_rows', 'usn_rows'), ('registry_rows', 'registry_rows'), ('plugin_rows', 'plugin_rows')):
+		if config[option] is not None:
+			scale[key] = config[option]
+	if not os.path.exists(work):
+		os.makedirs(work)
+	make_target(work, scale, config['seed'])
+
+	options = {'scale': scale, 'seed': config['seed'], 'rate': config['rate'], 'jobs': config['jobs'], 'ingest_workers': config['ingest_workers'],
+		'report_workers': config['report_workers'], 'evtx_engine': config['evtx_engine'], 'timeline': config['timeline'], 'search_index': config['search_index'], 'vol_jobs': config['vol_jobs']}
+	results = {'scale': scale, 'options': options, 'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+		'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'runs': {}}
+	for kind in ('windissect', 'volxlsx'):
+		if config['only'] in (None, kind):
+			results['runs'][kind] = measure(kind, work, options, config['repeat'])
+	with open(os.path.join(work, RESULTS_NAME), 'w', encoding='utf-8') as f:
+		json.dump(results, f, indent=1)
+
+	baseline = None
+	if config['baseline']:
+		with open(config['baseline'], 'r', encoding='utf-8') as f:
+			baseline = json.load(f)
+	print_results(results, baseline)
+	if config['save_baseline']:
+		with open(config['save_baseline'], 'w', encoding='utf-8') as f:
+			json.dump(results, f, indent=1)
+		print("Baseline saved to "+config['save_baseline'])
+	if baseline is not None:
+		found = regressions(results, baseline, config['tolerance'])
+		for line in found:
+			print("REGRESSION "+line)
+		if found:
+			sys.exit(1)
+		print("No regression against the baseline.")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,178 @@
+'''
+Stand-in executables for the benchmark: Eric Zimmerman's tools and Volatility's vol.exe.
+
+The benchmark runs them instead of the real tools, as "python stub_tools.py [tool executable] [tool arguments]". Each one writes
+the CSV files the real tool would (same names and columns) with synthetic rows, so win_dissect and volxlsx do their usual work
+on them. The scale, seed and rate (rows per second and per tool, 0 for as fast as possible) come from the WINDISSECT_BENCH
+environment variable, as JSON.
+
+https://github.com/Martendal/DFIR-tools
+'''
+
+import os
+import sys
+import csv
+import json
+import ntpath
+import random
+import time
+from datetime import timedelta
+
+from synthetic import channel_names, channel_events, event_csv_row, tool_rows, START_TIME, TIME_SPAN, EVTX_COLUMNS
+
+
+BENCH_ENV = "WINDISSECT_BENCH"
+
+# Version reported by the stand-in vol.exe
+VOL_VERSION = "2.7.0"
+
+PREFETCH_COLUMNS = [('Note', 's'), ('SourceFilename', 'p'), ('SourceCreated', 't'), ('SourceModified', 't'), ('SourceAccessed', 't'), ('ExecutableName', 'l'), ('Hash', 's'),
+	('Size', 'i'), ('Version', 'l'), ('RunCount', 'i'), ('LastRun', 't')] + [('PreviousRun'+str(i), 't') for i in range(7)] + [('Volume0Name', 'l'), ('Volume0Serial', 'l'),
+	('Volume0Created', 't'), ('Volume1Name', 's'), ('Volume1Serial', 's'), ('Volume1Created', 's'), ('Directories', 'p'), ('FilesLoaded', 'p'), ('ParsingError', 's')]
+PREFETCH_TIMELINE_COLUMNS = [('RunTime', 't'), ('ExecutableName', 'p')]
+AMCACHE_COLUMNS = [('ApplicationName', 'l'), ('ProgramId', 'l'), ('FileKeyLastWriteTimestamp', 't'), ('SHA1', 's'), ('IsOsComponent', 'l'), ('FullPath', 'p'), ('Name', 's'),
+	('FileExtension', 'l'), ('LinkDate', 't'), ('ProductName', 'l'), ('Size', 'i'), ('Version', 'l'), ('ProductVersion', 'l'), ('LongPathHash', 's'), ('BinaryType', 'l'),
+	('IsPeFile', 'l'), ('BinFileVersion', 'i'), ('BinProductVersion', 'l'), ('Usn', 'i'), ('Language', 'l'), ('Description', 's')]
+APPCOMPATCACHE_COLUMNS = [('ControlSet', 'i'), ('CacheEntryPosition', 'i'), ('Path', 'p'), ('LastModifiedTimeUTC', 't'), ('Executed', 'l'), ('Duplicate', 'l'), ('SourceFile', 'l')]
+USN_COLUMNS = [('Name', 's'), ('Extension', 'l'), ('EntryNumber', 'i'), ('SequenceNumber', 'i'), ('ParentEntryNumber', 'i'), ('ParentSequenceNumber', 'i'), ('ParentPath', 'p'),
+	('UpdateSequenceNumber', 'i'), ('UpdateTimestamp', 't'), ('UpdateReasons', 'l'), ('FileAttributes', 'l'), ('OffsetToData', 'i'), ('SourceFile', 'l')]
+REGISTRY_COLUMNS = [('HivePath', 'l'), ('HiveType', 'l'), ('Description', 'l'), ('Category', 'l'), ('KeyPath', 'p'), ('ValueName', 's'), ('ValueType', 'l'), ('ValueData', 's'),
+	('ValueData2', 's'), ('ValueData3', 's'), ('Comment', 's'), ('Recursive', 'l'), ('Deleted', 'l'), ('LastWriteTimestamp', 't'), ('PluginDetailFile', 'l')]
+SRUM_COLUMNS = [('Id', 'i'), ('Timestamp', 't'), ('ExeInfo', 'l'), ('ExeInfoDescription', 'l'), ('ExeTimestamp', 't'), ('SidType', 'l'), ('Sid', 'l'), ('UserName', 'l'),
+	('UserId', 'i'), ('AppId', 'i'), ('BytesReceived', 'i'), ('BytesSent', 'i'), ('InterfaceLuid', 'i'), ('InterfaceType', 'l'), ('L2ProfileFlags', 'i'), ('L2ProfileId', 'i'), ('ProfileName', 'l')]
+LNK_COLUMNS = [('SourceFile', 'p'), ('SourceCreated', 't'), ('SourceModified', 't'), ('SourceAccessed', 't'), ('TargetCreated', 't'), ('TargetModified', 't'), ('TargetAccessed', 't'),
+	('FileSize', 'i'), ('RelativePath', 'p'), ('WorkingDirectory', 'p'), ('FileAttributes', 'l'), ('HeaderFlags', 'i'), ('DriveType', 'l'), ('VolumeSerialNumber', 'l'),
+	('VolumeLabel', 'l'), ('LocalPath', 'p'), ('NetworkPath', 's'), ('CommonPath', 's'), ('Arguments', 's'), ('TargetIDAbsolutePath', 'p'), ('TargetMFTEntryNumber', 'i'),
+	('TargetMFTSequenceNumber', 'i'), ('MachineID', 'l'), ('MachineMACAddress', 'l'), ('MACVendor', 'l'), ('TrackerCreatedOn', 't'), ('ExtraBlocksPresent', 's')]
+RECYCLEBIN_COLUMNS = [('SourceName', 'p'), ('FileType', 'l'), ('FileName', 'p'), ('FileSize', 'i'), ('DeletedOn', 't')]
+
+# Files each tool writes: (CSV name, or None for the --csvf name, timestamp prefix like the real tool, columns, scale entry)
+TOOL_OUTPUTS = {
+	'pecmd.exe': [(None, False, PREFETCH_COLUMNS, 'prefetch_files'), ('_Timeline', False, PREFETCH_TIMELINE_COLUMNS, 'prefetch_files')],
+	'amcacheparser.exe': [('Amcache_UnassociatedFileEntries.csv', True, AMCACHE_COLUMNS, 'amcache_rows')],
+	'appcompatcacheparser.exe': [(None, False, APPCOMPATCACHE_COLUMNS, 'appcompatcache_rows')],
+	'mftecmd.exe': [(None, False, USN_COLUMNS, 'usn_rows')],
+	'recmd.exe': [(None, False, REGISTRY_COLUMNS, 'registry_rows')],
+	'srumecmd.exe': [('SrumECmd_NetworkUsages_Output.csv', True, SRUM_COLUMNS, 'srum_rows')],
+	'lecmd.exe': [(None, False, LNK_COLUMNS, 'lnk_rows')],
+	'rbcmd.exe': [(None, False, RECYCLEBIN_COLUMNS, 'recyclebin_rows')],
+}
+
+# Columns of the Volatility plugins (after TreeDepth), d marks dates. Timeliner gets four times more rows than the others.
+PLUGIN_COLUMNS = {
+	'windows.pslist.PsList': [('PID', 'i'), ('PPID', 'i'), ('ImageFileName', 'l'), ('Offset(V)', 'h'), ('Threads', 'i'), ('Handles', 'i'), ('SessionId', 'i'), ('Wow64', 'b'), ('CreateTime', 'd'), ('ExitTime', 'd'), ('File output', 'l')],
+	'windows.psscan.PsScan': [('PID', 'i'), ('PPID', 'i'), ('ImageFileName', 'l'), ('Offset(V)', 'h'), ('Threads', 'i'), ('Handles', 'i'), ('SessionId', 'i'), ('Wow64', 'b'), ('CreateTime', 'd'), ('ExitTime', 'd'), ('File output', 'l')],
+	'windows.netscan.NetScan': [('Offset', 'h'), ('Proto', 'l'), ('LocalAddr', 'l'), ('LocalPort', 'i'), ('ForeignAddr', 'l'), ('ForeignPort', 'i'), ('State', 'l'), ('PID', 'i'), ('Owner', 'l'), ('Created', 'd')],
+	'windows.cmdline.CmdLine': [('PID', 'i'), ('Process', 'l'), ('Args', 's')],
+	'windows.getsids.GetSIDs': [('PID', 'i'), ('Process', 'l'), ('SID', 'l'), ('Name', 'l')],
+	'windows.privileges.Privs': [('PID', 'i'), ('Process', 'l'), ('Value', 'i'), ('Privilege', 'l'), ('Attributes', 'l'), ('Description', 'l')],
+	'windows.ssdt.SSDT': [('Index', 'i'), ('Address', 'h'), ('Module', 'l'), ('Symbol', 's')],
+	'windows.mutantscan.MutantScan': [('Offset', 'h'), ('Name', 's')],
+	'windows.driverscan.DriverScan': [('Offset', 'h'), ('Start', 'h'), ('Size', 'h'), ('Service Key', 'l'), ('Driver Name', 'l'), ('Name', 'l')],
+	'windows.driverirp.DriverIrp': [('Offset', 'h'), ('Driver Name', 'l'), ('IRP', 'l'), ('Address', 'h'), ('Module', 'l'), ('Symbol', 's')],
+	'windows.dlllist.DllList': [('PID', 'i'), ('Process', 'l'), ('Base', 'h'), ('Size', 'h'), ('Name', 'l'), ('Path', 's'), ('LoadTime', 'd'), ('File output', 'l')],
+	'timeliner.Timeliner': [('Plugin', 'l'), ('Description', 's'), ('Created Date', 'd'), ('Modified Date', 'd'), ('Accessed Date', 'd'), ('Changed Date', 'd')],
+}
+
+
+# Yields the rows, sleeping as needed to stay at "rate" rows per second
+def throttled(rows, rate):
+	start = time.perf_counter()
+	for number, row in enumerate(rows, 1):
+		yield row
+		if rate and number % 1000 == 0:
+			delay = number / rate - (time.perf_counter() - start)
+			if delay > 0:
+				time.sleep(delay)
+
+
+def write_csv(path, columns, rows, rate, stream=None):
+	handle = stream or open(path, 'w', newline='', encoding='utf-8')
+	try:
+		writer = csv.writer(handle)
+		writer.writerow(columns)
+		writer.writerows(throttled(rows, rate))
+	finally:
+		if stream is None:
+			handle.close()
+
+
+def option(args, name):
+	if name in args and args.index(name) + 1 < len(args):
+		return args[args.index(name) + 1]
+	return None
+
+
+def evtxecmd(args, settings):
+	evtx_folder = option(args, '-d')
+	scale = settings['scale']
+
+	def rows():
+		for channel in channel_names(scale['channels']):
+			source_file = os.path.join(evtx_folder, channel+".evtx")
+			for event in channel_events(channel, scale['events_per_log'], settings['seed']):
+				yield event_csv_row(source_file, channel, event)
+	write_csv(os.path.join(option(args, '--csv'), ntpath.basename(option(args, '--csvf'))), EVTX_COLUMNS, rows(), settings['rate'])
+
+
+def ez_tool(tool, args, settings):
+	path = option(args, '--csv')
+	csvf = option(args, '--csvf')
+	prefix = time.strftime('%Y%m%d%H%M%S')+"_"
+	for name, timestamped, columns, count in TOOL_OUTPUTS[tool]:
+		if name is None:
+			name = csvf
+		elif name.startswith('_'):
+			name = csvf[:-4]+name+".csv"
+		rows = tool_rows(columns, settings['scale'][count], settings['seed'])
+		write_csv(os.path.join(path, (prefix if timestamped else "")+name), [column for column, kind in columns], rows, settings['rate'])
+
+
+def plugin_value(kind, name, rng):
+	if kind == 'd':
+		return (START_TIME + timedelta(seconds=rng.random() * TIME_SPAN)).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+	if kind == 'i':
+		return str(rng.randrange(70000))
+	if kind == 'h':
+		return hex(rng.randrange(2 ** 48))
+	if kind == 'b':
+		return rng.choice(['True', 'False'])
+	if kind == 'l':
+		return name+'_'+str(rng.randrange(40))
+	return name+' '+str(rng.randrange(10 ** 6))
+
+
+def vol(args, settings):
+	if '-h' in args:
+		print("Volatility 3 Framework "+VOL_VERSION)
+		return
+	plugin = args[-1]
+	columns = PLUGIN_COLUMNS.get(plugin)
+	if columns is None:
+		sys.stderr.write("Unknown plugin "+plugin+"\n")
+		sys.exit(1)
+	count = settings['scale']['plugin_rows'] * (4 if plugin == 'timeliner.Timeliner' else 1)
+	rng = random.Random(str(settings['seed'])+plugin)
+	rows = (['0'] + [plugin_value(kind, name, rng) for name, kind in columns] for number in range(count))
+	stdout = open(sys.stdout.fileno(), 'w', newline='', encoding='utf-8', closefd=False)
+	write_csv(None, ['TreeDepth'] + [name for name, kind in columns], rows, settings['rate'], stdout)
+	stdout.flush()
+
+
+def main():
+	tool = ntpath.basename(sys.argv[1]).lower()
+	args = sys.argv[2:]
+	settings = json.loads(os.environ[BENCH_ENV])
+	if tool == 'vol.exe':
+		vol(args, settings)
+	elif tool == 'evtxecmd.exe':
+		evtxecmd(args, settings)
+	elif tool in TOOL_OUTPUTS:
+		ez_tool(tool, args, settings)
+	else:
+		sys.stderr.write("No stand-in for "+tool+"\n")
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,295 @@
+'''
+Synthetic case data for the benchmark: event logs and the rows of the CSV files the stand-in tools write.
+
+Everything is derived from a seed and a scale, so two runs with the same settings work on the same data. Events are generated
+once per channel and written either as real EVTX files (in the synthetic target, for --evtx-engine native) or as EvtxECmd CSV
+rows (by the stand-in EvtxECmd), so both EVTX engines see the same events.
+
+https://github.com/Martendal/DFIR-tools
+'''
+
+import os
+import sys
+import json
+import random
+import struct
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evtx_native import EVTX_COLUMNS, EVENT_MAPS, LEVELS, MissingEmpty, FILE_HEADER_SIZE, CHUNK_SIZE, CHUNK_RECORDS_START
+
+
+# Scales of the benchmark, --scale picks one and the other options override its values
+SCALES = OrderedDict([
+	('small', {'channels': 8, 'events_per_log': 2000, 'prefetch_files': 200, 'amcache_rows': 2000, 'appcompatcache_rows': 1000, 'usn_rows': 50000, 'registry_rows': 20000, 'srum_rows': 10000, 'lnk_rows': 500, 'recyclebin_rows': 200, 'plugin_rows': 500}),
+	('medium', {'channels': 40, 'events_per_log': 20000, 'prefetch_files': 1000, 'amcache_rows': 20000, 'appcompatcache_rows': 5000, 'usn_rows': 1000000, 'registry_rows': 200000, 'srum_rows': 100000, 'lnk_rows': 5000, 'recyclebin_rows': 2000, 'plugin_rows': 5000}),
+	('large', {'channels': 150, 'events_per_log': 100000, 'prefetch_files': 1024, 'amcache_rows': 100000, 'appcompatcache_rows': 20000, 'usn_rows': 10000000, 'registry_rows': 1000000, 'srum_rows': 500000, 'lnk_rows': 20000, 'recyclebin_rows': 10000, 'plugin_rows': 50000}),
+])
+
+START_TIME = datetime(2024, 1, 1)
+# Synthetic events and rows are spread over this many seconds after START_TIME
+TIME_SPAN = 30 * 86400
+
+
+####### Events ####
+
+# Channels, as their EVTX file names, with the event IDs they cycle through (the ones the report sheets read come first)
+CHANNEL_EVENTS = OrderedDict([
+	('Security', [4624, 4624, 4624, 4625, 4634, 4648, 4672, 4688, 4689, 4697, 4720, 4732, 4798, 5140, 5145, 1102]),
+	('System', [7036, 7036, 7036, 7045, 7034, 7040, 1001, 102]),
+	('Application', [1000, 1001, 1033, 11707, 1002]),
+	('Microsoft-Windows-PowerShell%4Operational', [4104, 4103]),
+	('Microsoft-Windows-TaskScheduler%4Operational', [106, 140, 200, 201]),
+	('Microsoft-Windows-WMI-Activity%4Operational', [5857, 5858, 5861]),
+	('Microsoft-Windows-TerminalServices-RemoteConnectionManager%4Operational', [1149]),
+	('Microsoft-Windows-Sysmon%4Operational', [1, 3, 11, 13]),
+])
+
+EVENT_DATA = {
+	4624: ['SubjectUserSid', 'TargetUserName', 'TargetDomainName', 'TargetLogonId', 'LogonType', 'LogonProcessName', 'WorkstationName', 'IpAddress', 'ProcessName'],
+	4625: ['SubjectUserSid', 'TargetUserName', 'TargetDomainName', 'Status', 'SubStatus', 'LogonType', 'WorkstationName', 'IpAddress', 'ProcessName'],
+	4648: ['SubjectUserName', 'SubjectDomainName', 'TargetUserName', 'TargetDomainName', 'TargetServerName', 'IpAddress', 'ProcessName'],
+	4688: ['SubjectUserName', 'SubjectDomainName', 'NewProcessId', 'NewProcessName', 'CommandLine', 'ParentProcessName'],
+	4697: ['SubjectUserName', 'SubjectDomainName', 'ServiceName', 'ServiceFileName', 'ServiceType', 'ServiceStartType'],
+	7045: ['ServiceName', 'ImagePath', 'ServiceType', 'StartType', 'AccountName'],
+	4104: ['MessageNumber', 'MessageTotal', 'ScriptBlockText', 'ScriptBlockId', 'Path'],
+	1: ['UtcTime', 'ProcessGuid', 'ProcessId', 'Image', 'CommandLine', 'User', 'Hashes', 'ParentImage'],
+}
+DEFAULT_EVENT_DATA = ['Param1', 'Param2', 'Param3']
+
+USERS = ['alice', 'bob', 'carol', 'dave', 'svc_backup', 'administrator', 'SYSTEM']
+PROGRAMS = ['C:\\Windows\\System32\\svchost.exe', 'C:\\Windows\\explorer.exe', 'C:\\Windows\\System32\\cmd.exe', 'C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe',
+	'C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe', 'C:\\Users\\bob\\AppData\\Local\\Temp\\update.exe']
+
+
+def channel_names(count):
+	names = list(CHANNEL_EVENTS)[:count]
+	for number in range(len(names), count):
+		names.append('Microsoft-Windows-Bench'+str(number)+'%4Operational')
+	return names
+
+
+def field_value(field, rng):
+	if field == 'LogonType':
+		return rng.choice(['2', '3', '3', '5', '10'])
+	if field in ('TargetUserName', 'SubjectUserName', 'AccountName', 'User'):
+		return rng.choice(USERS)
+	if field in ('TargetDomainName', 'SubjectDomainName'):
+		return 'CORP'
+	if field == 'IpAddress':
+		return '10.0.'+str(rng.randrange(4))+'.'+str(rng.randrange(1, 255))
+	if field in ('WorkstationName', 'TargetServerName'):
+		return 'WS'+str(rng.randrange(100)).rjust(3, '0')
+	if field in ('ProcessName', 'NewProcessName', 'ParentProcessName', 'Image', 'ParentImage', 'ImagePath', 'ServiceFileName'):
+		return rng.choice(PROGRAMS)
+	if field == 'CommandLine':
+		return rng.choice(PROGRAMS)+' -k '+str(rng.randrange(10000))
+	if field == 'ScriptBlockText':
+		return 'Get-ChildItem -Path C:\\Users -Recurse | Where-Object { $_.Length -gt '+str(rng.randrange(10 ** 6))+' } | Export-Csv out.csv'
+	if field.endswith('Sid'):
+		return 'S-1-5-21-1004336348-1177238915-682003330-'+str(1000 + rng.randrange(20))
+	return field+'_'+str(rng.randrange(1000))
+
+
+# Events of a channel: (record id, time, event id, event data), in record order
+def channel_events(channel, count, seed):
+	rng = random.Random(str(seed)+channel)
+	event_ids = CHANNEL_EVENTS.get(channel, [1, 2, 3])
+	step = TIME_SPAN / max(count, 1)
+	for number in range(count):
+		event_id = event_ids[number % len(event_ids)]
+		data = OrderedDict((field, field_value(field, rng)) for field in EVENT_DATA.get(event_id, DEFAULT_EVENT_DATA))
+		yield number + 1, START_TIME + timedelta(seconds=number * step + rng.random()), event_id, data
+
+
+def channel_level(event_id):
+	return '2' if event_id in (1000, 1001, 7034) else '0' if event_id in (4624, 4625, 4688) else '4'
+
+
+# The event as an EvtxECmd CSV row, with the same maps as evtx_native
+def event_csv_row(source_file, channel, event):
+	record_id, time, event_id, data = event
+	row = dict.fromkeys(EVTX_COLUMNS, '')
+	row.update({'RecordNumber': record_id, 'EventRecordId': record_id, 'TimeCreated': time.strftime('%Y-%m-%d %H:%M:%S.%f')+'0', 'EventId': event_id,
+		'Level': LEVELS[channel_level(event_id)], 'Provider': 'Microsoft-Windows-'+channel.split('%4')[0].replace('Microsoft-Windows-', ''),
+		'Channel': channel.replace('%4', '/'), 'ProcessId': 4, 'ThreadId': 100 + record_id % 50, 'Computer': 'HOST1.corp.local', 'ChunkNumber': 0,
+		'HiddenRecord': 'False', 'SourceFile': source_file, 'Keywords': '0x8020000000000000', 'ExtraDataOffset': 0,
+		'Payload': json.dumps({'EventData': data}, ensure_ascii=False)})
+	mapping = EVENT_MAPS.get((row['Channel'], str(event_id)))
+	if mapping is not None:
+		values = MissingEmpty(data)
+		for column, layout in mapping.items():
+			row[column] = layout.format_map(values)
+	else:
+		for i, (name, value) in enumerate(list(data.items())[:6]):
+			row['PayloadData'+str(i + 1)] = name+": "+value
+	return [row[column] for column in EVTX_COLUMNS]
+
+
+####### EVTX writer ####
+# Writes valid logs: each chunk holds its string and template tables, records use one template per event data layout. Checksums
+# are computed, so other parsers accept the files too.
+
+def filetime(time):
+	delta = time - datetime(1601, 1, 1)
+	return (delta.days * 86400 + delta.seconds) * 10000000 + delta.microseconds * 10
+
+
+def new_chunk():
+	return {'buffer': bytearray(CHUNK_SIZE), 'pos': CHUNK_RECORDS_START, 'names': {}, 'templates': {}}
+
+
+def put(chunk, data):
+	chunk['buffer'][chunk['pos']:chunk['pos'] + len(data)] = data
+	chunk['pos'] += len(data)
+
+
+# Name offset, followed by the name itself the first time it is used in the chunk
+def put_name(chunk, name):
+	if name in chunk['names']:
+		put(chunk, struct.pack('<I', chunk['names'][name]))
+	else:
+		chunk['names'][name] = chunk['pos'] + 4
+		put(chunk, struct.pack('<I', chunk['pos'] + 4))
+		put(chunk, struct.pack('<IHH', 0, 0, len(name))+name.encode('utf-16le')+b'\x00\x00')
+
+
+# Template nodes: ('element', name, [(attribute, node)], [children]), ('text', value) or ('substitution', index, type, optional)
+def put_node(chunk, node):
+	if node[0] == 'element':
+		put(chunk, struct.pack('<BHI', 0x41 if node[2] else 0x01, 0xffff, 0))
+		put_name(chunk, node[1])
+		if node[2]:
+			put(chunk, struct.pack('<I', 0))
+			for name, value in node[2]:
+				put(chunk, b'\x06')
+				put_name(chunk, name)
+				put_node(chunk, value)
+		if node[3]:
+			put(chunk, b'\x02')
+			for child in node[3]:
+				put_node(chunk, child)
+			put(chunk, b'\x04')
+		else:
+			put(chunk, b'\x03')
+	elif node[0] == 'text':
+		put(chunk, struct.pack('<BBH', 0x05, 0x01, len(node[1]))+node[1].encode('utf-16le'))
+	else:
+		put(chunk, struct.pack('<BHB', 0x0e if node[3] else 0x0d, node[1], node[2]))
+
+
+def event_template(fields):
+	system = ('element', 'System', [], [
+		('element', 'Provider', [('Name', ('substitution', 0, 0x01, False))], []),
+		('element', 'EventID', [], [('substitution', 1, 0x06, False)]),
+		('element', 'Level', [], [('substitution', 2, 0x04, False)]),
+		('element', 'Keywords', [], [('substitution', 3, 0x15, False)]),
+		('element', 'TimeCreated', [('SystemTime', ('substitution', 4, 0x11, False))], []),
+		('element', 'EventRecordID', [], [('substitution', 5, 0x0a, False)]),
+		('element', 'Execution', [('ProcessID', ('substitution', 6, 0x08, False)), ('ThreadID', ('substitution', 7, 0x08, False))], []),
+		('element', 'Channel', [], [('substitution', 8, 0x01, False)]),
+		('element', 'Computer', [], [('substitution', 9, 0x01, False)]),
+		('element', 'Security', [], []),
+	])
+	data = ('element', 'EventData', [], [('element', 'Data', [('Name', ('text', field))], [('substitution', 10 + i, 0x01, True)]) for i, field in enumerate(fields)])
+	return ('element', 'Event', [('xmlns', ('text', 'http://schemas.microsoft.com/win/2004/08/events/event'))], [system, data])
+
+
+def put_record(chunk, channel, event):
+	record_id, time, event_id, data = event
+	start = chunk['pos']
+	put(chunk, b'\x2a\x2a\x00\x00'+struct.pack('<IQQ', 0, record_id, filetime(time)))
+	put(chunk, b'\x0f\x01\x01\x00')
+	layout = tuple(data)
+	if layout in chunk['templates']:
+		put(chunk, struct.pack('<BBII', 0x0c, 0x01, 0, chunk['templates'][layout]))
+	else:
+		definition = chunk['pos'] + 10
+		chunk['templates'][layout] = definition
+		put(chunk, struct.pack('<BBII', 0x0c, 0x01, 0, definition))
+		put(chunk, struct.pack('<I', 0)+bytes(16)+struct.pack('<I', 0))
+		body = chunk['pos']
+		put(chunk, b'\x0f\x01\x01\x00')
+		put_node(chunk, event_template(layout))
+		put(chunk, b'\x00')
+		struct.pack_into('<I', chunk['buffer'], definition + 20, chunk['pos'] - body)
+	values = [(0x01, ('Microsoft-Windows-'+channel.split('%4')[0].replace('Microsoft-Windows-', '')).encode('utf-16le')),
+		(0x06, struct.pack('<H', event_id)), (0x04, struct.pack('<B', int(channel_level(event_id)))), (0x15, struct.pack('<Q', 0x8020000000000000)),
+		(0x11, struct.pack('<Q', filetime(time))), (0x0a, struct.pack('<Q', record_id)), (0x08, struct.pack('<I', 4)),
+		(0x08, struct.pack('<I', 100 + record_id % 50)), (0x01, channel.replace('%4', '/').encode('utf-16le')), (0x01, 'HOST1.corp.local'.encode('utf-16le'))]
+	values += [(0x01, value.encode('utf-16le')) for value in data.values()]
+	put(chunk, struct.pack('<I', len(values)))
+	for kind, value in values:
+		put(chunk, struct.pack('<HBB', len(value), kind, 0))
+	for kind, value in values:
+		put(chunk, value)
+	put(chunk, b'\x00')
+	size = chunk['pos'] - start + 4
+	put(chunk, struct.pack('<I', size))
+	struct.pack_into('<I', chunk['buffer'], start + 4, size)
+	return start
+
+
+# Chunk header: record numbers and ids, header size, last record and free space offsets, then the checksums
+def close_chunk(chunk, first, last, last_offset):
+	buffer = chunk['buffer']
+	buffer[0:8] = b'ElfChnk\x00'
+	struct.pack_into('<QQQQIII', buffer, 8, first, last, first, last, 128, last_offset, chunk['pos'])
+	struct.pack_into('<I', buffer, 52, zlib.crc32(bytes(buffer[CHUNK_RECORDS_START:chunk['pos']])))
+	struct.pack_into('<I', buffer, 124, zlib.crc32(bytes(buffer[0:120])+bytes(buffer[128:CHUNK_RECORDS_START])))
+	return bytes(buffer)
+
+
+def write_evtx(path, channel, events):
+	chunks = []
+	chunk = new_chunk()
+	first = last = None
+	last_offset = 0
+	for event in events:
+		state = (chunk['pos'], dict(chunk['names']), dict(chunk['templates']))
+		offset = put_record(chunk, channel, event)
+		if chunk['pos'] > CHUNK_SIZE:
+			chunk['pos'], chunk['names'], chunk['templates'] = state
+			del chunk['buffer'][CHUNK_SIZE:]
+			chunk['buffer'][chunk['pos']:] = bytes(CHUNK_SIZE - chunk['pos'])
+			chunks.append(close_chunk(chunk, first, last, last_offset))
+			chunk = new_chunk()
+			first = None
+			offset = put_record(chunk, channel, event)
+		first = event[0] if first is None else first
+		last = event[0]
+		last_offset = offset
+	if first is not None:
+		chunks.append(close_chunk(chunk, first, last, last_offset))
+	header = bytearray(FILE_HEADER_SIZE)
+	header[0:8] = b'ElfFile\x00'
+	struct.pack_into('<QQQIHHHH', header, 8, 0, max(len(chunks) - 1, 0), (last or 0) + 1, 128, 1, 3, FILE_HEADER_SIZE, len(chunks))
+	struct.pack_into('<I', header, 124, zlib.crc32(bytes(header[0:120])))
+	with open(path, 'wb') as f:
+		f.write(header)
+		for data in chunks:
+			f.write(data)
+
+
+####### Tool rows ####
+# Columns of the stand-in tools' CSV files as (name, kind): t timestamp (EZ format), i integer, l repetitive string, p path,
+# s other string
+
+def column_value(kind, name, rng, number):
+	if kind == 't':
+		return (START_TIME + timedelta(seconds=rng.random() * TIME_SPAN)).strftime('%Y-%m-%d %H:%M:%S.%f')+'0'
+	if kind == 'i':
+		return str(rng.randrange(10 ** rng.randrange(1, 9)))
+	if kind == 'l':
+		return name+'_'+str(rng.randrange(8))
+	if kind == 'p':
+		return 'C:\\Users\\'+rng.choice(USERS)+'\\AppData\\Local\\Temp\\'+name.lower()+'_'+str(number % 5000)+'.tmp'
+	return name+'_'+str(rng.randrange(100000))
+
+
+def tool_rows(columns, count, seed):
+	rng = random.Random(str(seed)+columns[0][0]+str(count))
+	for number in range(count):
+		yield [column_value(kind, name, rng, number) for name, kind in columns]
@@ -0,0 +1,479 @@
+'''
+Native EVTX parser for win_dissect ("--evtx-engine native").
+
+An EVTX file is a 4 KB file header followed by independent 64 KB chunks. Each chunk holds its own string and template tables and
+its event records, whose content is binary XML: a template instance (an XML skeleton defined once per chunk) and the values
+substituted in it. Chunks are parsed in a process pool, each worker memory-maps the log and parses a range of chunks, and the
+events are written per log in the columns EvtxECmd writes (the ones win_dissect relies on).
+
+https://github.com/Martendal/DFIR-tools
+'''
+
+import os
+import csv
+import json
+import mmap
+import struct
+import multiprocessing
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from uuid import UUID
+
+
+FILE_SIGNATURE = b'ElfFile\x00'
+CHUNK_SIGNATURE = b'ElfChnk\x00'
+RECORD_SIGNATURE = b'\x2a\x2a\x00\x00'
+FILE_HEADER_SIZE = 4096
+CHUNK_SIZE = 65536
+# Event records start after the chunk header (128 bytes), its string table (64 offsets) and its template table (32 offsets)
+CHUNK_RECORDS_START = 512
+
+# Chunks parsed per task sent to the pool
+TASK_CHUNKS = 32
+
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+U64 = struct.Struct('<Q')
+
+FILETIME_EPOCH = datetime(1601, 1, 1)
+
+# Columns of EvtxECmd's CSV output
+EVTX_COLUMNS = ['RecordNumber', 'EventRecordId', 'TimeCreated', 'EventId', 'Level', 'Provider', 'Channel', 'ProcessId', 'ThreadId', 'Computer',
+	'ChunkNumber', 'UserId', 'MapDescription', 'UserName', 'RemoteHost', 'PayloadData1', 'PayloadData2', 'PayloadData3', 'PayloadData4',
+	'PayloadData5', 'PayloadData6', 'ExecutableInfo', 'HiddenRecord', 'SourceFile', 'Keywords', 'ExtraDataOffset', 'Payload']
+
+LEVELS = {'0': 'LogAlways', '1': 'Critical', '2': 'Error', '3': 'Warning', '4': 'Info', '5': 'Verbose'}
+
+ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+# Event maps, as EvtxECmd's: (channel, event id) -> {column: format using the EventData names}. The other events get their first
+# EventData values in PayloadData1-6.
+EVENT_MAPS = {
+	('Security', '4624'): {'MapDescription': 'Successful logon', 'UserName': '{TargetDomainName}\\{TargetUserName}', 'RemoteHost': '{WorkstationName} ({IpAddress})',
+		'PayloadData1': 'LogonId: {TargetLogonId}', 'PayloadData2': 'LogonType {LogonType}', 'PayloadData3': 'LogonProcessName: {LogonProcessName}', 'ExecutableInfo': '{ProcessName}'},
+	('Security', '4625'): {'MapDescription': 'Failed logon', 'UserName': '{TargetDomainName}\\{TargetUserName}', 'RemoteHost': '{WorkstationName} ({IpAddress})',
+		'PayloadData1': 'SubStatus: {SubStatus}', 'PayloadData2': 'LogonType {LogonType}', 'ExecutableInfo': '{ProcessName}'},
+	('Security', '4648'): {'MapDescription': 'A logon was attempted using explicit credentials', 'UserName': '{SubjectDomainName}\\{SubjectUserName}',
+		'RemoteHost': '{TargetServerName} ({IpAddress})', 'PayloadData1': 'Target: {TargetDomainName}\\{TargetUserName}', 'ExecutableInfo': '{ProcessName}'},
+	('Security', '4688'): {'MapDescription': 'A new process has been created', 'UserName': '{SubjectDomainName}\\{SubjectUserName}',
+		'PayloadData1': 'ParentProcess: {ParentProcessName}', 'ExecutableInfo': '{CommandLine}'},
+	('Security', '4697'): {'MapDescription': 'A service was installed in the system', 'UserName': '{SubjectDomainName}\\{SubjectUserName}',
+		'PayloadData1': 'Name: {ServiceName}', 'ExecutableInfo': '{ServiceFileName}'},
+	('System', '7045'): {'MapDescription': 'A service was installed in the system', 'PayloadData1': 'Name: {ServiceName}', 'PayloadData2': 'StartType: {StartType}',
+		'PayloadData3': 'Account: {AccountName}', 'ExecutableInfo': '{ImagePath}'},
+	('Security', '1102'): {'MapDescription': 'The audit log was cleared', 'UserName': '{SubjectDomainName}\\{SubjectUserName}'},
+	('Security', '4634'): {'MapDescription': 'An account was logged off', 'UserName': '{TargetDomainName}\\{TargetUserName}', 'PayloadData1': 'LogonId: {TargetLogonId}',
+		'PayloadData2': 'LogonType {LogonType}'},
+	('Security', '4672'): {'MapDescription': 'Special privileges assigned to new logon', 'UserName': '{SubjectDomainName}\\{SubjectUserName}',
+		'PayloadData1': 'LogonId: {SubjectLogonId}', 'PayloadData2': 'PrivilegeList: {PrivilegeList}'},
+	('Security', '4698'): {'MapDescription': 'A scheduled task was created', 'UserName': '{SubjectDomainName}\\{SubjectUserName}', 'PayloadData1': 'Task: {TaskName}'},
+	('Security', '4720'): {'MapDescription': 'A user account was created', 'UserName': '{SubjectDomainName}\\{SubjectUserName}',
+		'PayloadData1': 'Target: {TargetDomainName}\\{TargetUserName}'},
+	('Security', '4726'): {'MapDescription': 'A user account was deleted', 'UserName': '{SubjectDomainName}\\{SubjectUserName}',
+		'PayloadData1': 'Target: {TargetDomainName}\\{TargetUserName}'},
+	('Security', '4732'): {'MapDescription': 'A member was added to a security-enabled local group', 'UserName': '{SubjectDomainName}\\{SubjectUserName}',
+		'PayloadData1': 'Group: {TargetDomainName}\\{TargetUserName}', 'PayloadData2': 'Member: {MemberSid}'},
+	('Security', '4776'): {'MapDescription': 'The computer attempted to validate the credentials for an account', 'UserName': '{TargetUserName}',
+		'RemoteHost': '{Workstation}', 'PayloadData1': 'Status: {Status}'},
+	('Security', '4778'): {'MapDescription': 'A session was reconnected to a Window Station', 'UserName': '{AccountDomain}\\{AccountName}',
+		'RemoteHost': '{ClientName} ({ClientAddress})', 'PayloadData1': 'LogonId: {LogonID}', 'PayloadData2': 'Session: {SessionName}'},
+	('Security', '4779'): {'MapDescription': 'A session was disconnected from a Window Station', 'UserName': '{AccountDomain}\\{AccountName}',
+		'RemoteHost': '{ClientName} ({ClientAddress})', 'PayloadData1': 'LogonId: {LogonID}', 'PayloadData2': 'Session: {SessionName}'},
+	('Security', '5140'): {'MapDescription': 'A network share object was accessed', 'UserName': '{SubjectDomainName}\\{SubjectUserName}',
+		'RemoteHost': '{IpAddress}', 'PayloadData1': 'Share: {ShareName}', 'PayloadData2': 'Path: {ShareLocalPath}'},
+	('Security', '5145'): {'MapDescription': 'A network share object was checked to see whether client can be granted desired access',
+		'UserName': '{SubjectDomainName}\\{SubjectUserName}', 'RemoteHost': '{IpAddress}', 'PayloadData1': 'Share: {ShareName}', 'PayloadData2': 'Target: {RelativeTargetName}'},
+	('System', '7036'): {'MapDescription': 'Service state changed', 'PayloadData1': 'Name: {param1}', 'PayloadData2': 'Status: {param2}'},
+	('System', '7040'): {'MapDescription': 'Service start type changed', 'PayloadData1': 'Name: {param1}', 'PayloadData2': 'From: {param2}', 'PayloadData3': 'To: {param3}'},
+	('Microsoft-Windows-PowerShell/Operational', '4104'): {'MapDescription': 'Script block logging', 'PayloadData1': 'Path: {Path}',
+		'PayloadData2': 'ScriptBlockId: {ScriptBlockId}', 'ExecutableInfo': '{ScriptBlockText}'},
+}
+
+
+# True when an event is mapped to the columns EvtxECmd's map would fill, not only given generic "Name: value" payload columns
+def has_event_map(channel, event_id):
+	return (channel, str(event_id)) in EVENT_MAPS
+
+
+class MissingEmpty(dict):
+	def __missing__(self, key):
+		return ''
+
+
+####### Binary XML ####
+# Elements are lists [name, [(attribute name, parts)], children], text parts are strings, and a substitution slot of a template is
+# a ("sub", index) tuple until the template is instantiated with the values of a record.
+
+def filetime(value):
+	seconds, rest = divmod(value, 10000000)
+	return (FILETIME_EPOCH + timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')+"."+str(rest).rjust(7, '0')
+
+
+# Names are stored once per chunk: next offset (4), hash (2), number of characters (2), UTF-16 characters and a null character
+def read_name(data, offset, chunk):
+	name = chunk['names'].get(offset)
+	if name is None:
+		count = U16.unpack_from(data, offset + 6)[0]
+		name = data[offset + 8:offset + 8 + count * 2].decode('utf-16le', errors='replace')
+		chunk['names'][offset] = name
+	return name
+
+
+def name_size(data, offset):
+	return 10 + U16.unpack_from(data, offset + 6)[0] * 2
+
+
+def sid(value):
+	count = value[1]
+	result = "S-"+str(value[0])+"-"+str(int.from_bytes(value[2:8], 'big'))
+	for i in range(count):
+		result += "-"+str(U32.unpack_from(value, 8 + i * 4)[0])
+	return result
+
+
+FIXED_SIZES = {0x03: 1, 0x04: 1, 0x05: 2, 0x06: 2, 0x07: 4, 0x08: 4, 0x09: 8, 0x0a: 8, 0x0b: 4, 0x0c: 8, 0x0d: 4, 0x0f: 16, 0x11: 8, 0x12: 16, 0x14: 4, 0x15: 8}
+SCALAR_FORMATS = {0x03: '<b', 0x04: '<B', 0x05: '<h', 0x06: '<H', 0x07: '<i', 0x08: '<I', 0x09: '<q', 0x0a: '<Q', 0x0b: '<f', 0x0c: '<d'}
+
+
+# A substitution value as text, or as a list of elements for embedded binary XML (0x21)
+def variant(data, pos, size, kind, chunk):
+	value = data[pos:pos + size]
+	if kind == 0x00:
+		return None
+	if kind == 0x01:
+		return value.decode('utf-16le', errors='replace').rstrip('\x00')
+	if kind == 0x02:
+		return value.decode('latin-1').rstrip('\x00')
+	if kind in SCALAR_FORMATS:
+		return str(struct.unpack_from(SCALAR_FORMATS[kind], value)[0])
+	if kind == 0x0d:
+		return "True" if U32.unpack_from(value)[0] else "False"
+	if kind == 0x0e:
+		return value.hex().upper()
+	if kind == 0x0f:
+		return "{"+str(UUID(bytes_le=bytes(value))).upper()+"}"
+	if kind == 0x10:
+		return "0x"+format(int.from_bytes(value, 'little'), 'x')
+	if kind == 0x11:
+		return filetime(U64.unpack_from(value)[0])
+	if kind == 0x12:
+		year, month, weekday, day, hour, minute, second, milliseconds = struct.unpack_from('<8H', value)
+		return "%04d-%02d-%02d %02d:%02d:%02d.%03d" % (year, month, day, hour, minute, second, milliseconds)
+	if kind == 0x13:
+		return sid(value)
+	if kind == 0x14 or kind == 0x15:
+		return hex(int.from_bytes(value, 'little'))
+	if kind == 0x21:
+		return parse_fragment(data, pos, chunk)[0]
+	if kind == 0x81:
+		return ", ".join(item for item in value.decode('utf-16le', errors='replace').split('\x00') if item)
+	if kind & 0x80 and (kind & 0x7f) in FIXED_SIZES:
+		item = FIXED_SIZES[kind & 0x7f]
+		return ", ".join(variant(data, pos + i, item, kind & 0x7f, chunk) for i in range(0, size - item + 1, item))
+	return value.hex().upper()
+
+
+# Substitution array: number of values (4), then size (2) and type (1, plus 1 padding byte) of each value, then the values
+def substitution_values(data, pos, chunk):
+	count = U32.unpack_from(data, pos)[0]
+	pos += 4
+	declarations = [(U16.unpack_from(data, pos + i * 4)[0], data[pos + i * 4 + 2]) for i in range(count)]
+	pos += count * 4
+	values = []
+	for size, kind in declarations:
+		values.append(variant(data, pos, size, kind, chunk))
+		pos += size
+	return values, pos
+
+
+def instantiate(nodes, values):
+	result = []
+	for node in nodes:
+		if type(node) is tuple:
+			value = values[node[1]] if node[1] < len(values) else None
+			if isinstance(value, list):
+				result.extend(value)
+			elif value is not None:
+				result.append(value)
+		elif type(node) is list:
+			result.append([node[0], [(name, instantiate(parts, values)) for name, parts in node[1]], instantiate(node[2], values)])
+		else:
+			result.append(node)
+	return result
+
+
+# Template instance: token (1), unknown (1), template id (4), template offset (4). A template defined right there (first use in the
+# chunk) is followed by its definition: next offset (4), GUID (16), data size (4), binary XML. The substitution array comes next.
+def template_instance(data, pos, chunk):
+	start = pos
+	offset = U32.unpack_from(data, pos + 6)[0]
+	pos += 10
+	template = chunk['templates'].get(offset)
+	if template is None:
+		template = parse_fragment(data, offset + 24, chunk)[0]
+		chunk['templates'][offset] = template
+	if offset > start:
+		pos = offset + 24 + U32.unpack_from(data, offset + 20)[0]
+	values, pos = substitution_values(data, pos, chunk)
+	return instantiate(template, values), pos
+
+
+# Parses binary XML from pos until the end of stream token, or until the template instance of a fragment holding one (its values
+# end the fragment). Returns the top level nodes and the position after them.
+def parse_fragment(data, pos, chunk):
+	root = []
+	stack = []
+	target = root
+	while True:
+		token = data[pos]
+		kind = token & 0x0f
+		if kind == 0x00:
+			return root, pos + 1
+		elif kind == 0x0f:
+			pos += 4
+		elif kind == 0x0c:
+			elements, pos = template_instance(data, pos, chunk)
+			target.extend(elements)
+			if not stack:
+				return root, pos
+		elif kind == 0x01:
+			start = pos
+			offset = U32.unpack_from(data, pos + 7)[0]
+			pos += 11
+			if offset > start:
+				pos += name_size(data, offset)
+			if token & 0x40:
+				pos += 4
+			element = [read_name(data, offset, chunk), [], []]
+			(stack[-1][2] if stack else root).append(element)
+			stack.append(element)
+			target = element[2]
+		elif kind == 0x06:
+			start = pos
+			offset = U32.unpack_from(data, pos + 1)[0]
+			pos += 5
+			if offset > start:
+				pos += name_size(data, offset)
+			parts = []
+			stack[-1][1].append((read_name(data, offset, chunk), parts))
+			target = parts
+		elif kind == 0x02:
+			target = stack[-1][2]
+			pos += 1
+		elif kind == 0x03 or kind == 0x04:
+			stack.pop()
+			target = stack[-1][2] if stack else root
+			pos += 1
+		elif kind == 0x05:
+			count = U16.unpack_from(data, pos + 2)[0]
+			target.append(data[pos + 4:pos + 4 + count * 2].decode('utf-16le', errors='replace'))
+			pos += 4 + count * 2
+		elif kind == 0x07:
+			count = U16.unpack_from(data, pos + 1)[0]
+			target.append(data[pos + 3:pos + 3 + count * 2].decode('utf-16le', errors='replace'))
+			pos += 3 + count * 2
+		elif kind == 0x08:
+			target.append(chr(U16.unpack_from(data, pos + 1)[0]))
+			pos += 3
+		elif kind == 0x09:
+			start = pos
+			offset = U32.unpack_from(data, pos + 1)[0]
+			pos += 5
+			if offset > start:
+				pos += name_size(data, offset)
+			name = read_name(data, offset, chunk)
+			target.append(ENTITIES.get(name, "&"+name+";"))
+		elif kind == 0x0a:
+			start = pos
+			offset = U32.unpack_from(data, pos + 1)[0]
+			pos += 5
+			if offset > start:
+				pos += name_size(data, offset)
+		elif kind == 0x0b:
+			pos += 3 + U16.unpack_from(data, pos + 1)[0] * 2
+		elif kind == 0x0d or kind == 0x0e:
+			target.append(('sub', U16.unpack_from(data, pos + 1)[0]))
+			pos += 4
+		else:
+			raise ValueError("Unknown binary XML token "+hex(token)+" at chunk offset "+str(pos))
+
+
+####### Events ####
+
+def element_text(element):
+	return "".join(child if isinstance(child, str) else element_text(child) for child in element[2])
+
+
+def attribute(element, name):
+	for attribute_name, parts in element[1]:
+		if attribute_name == name:
+			return "".join(part if isinstance(part, str) else element_text(part) for part in parts)
+	return None
+
+
+def child_elements(element):
+	return [child for child in element[2] if isinstance(child, list)]
+
+
+# System values and event data (EventData "Data" elements by Name, or the leaves of UserData) of an Event element
+def event_values(event):
+	system = {}
+	data = OrderedDict()
+	for section in child_elements(event):
+		if section[0] == 'System':
+			for item in child_elements(section):
+				system[item[0]] = item
+		elif section[0] == 'EventData':
+			for i, item in enumerate(child_elements(section)):
+				name = attribute(item, 'Name') or item[0]+str(i)
+				data[name] = element_text(item)
+		elif section[0] == 'UserData':
+			for container in child_elements(section):
+				for item in child_elements(container):
+					data[item[0]] = element_text(item)
+	return system, data
+
+
+def system_attribute(system, element, name):
+	return attribute(system[element], name) if element in system else None
+
+
+def system_text(system, element):
+	return element_text(system[element]) if element in system else None
+
+
+def event_row(root, record_id, written, chunk_number, source_file):
+	events = [node for node in root if isinstance(node, list)]
+	if not events:
+		return None
+	system, data = event_values(events[0])
+	event_id = system_text(system, 'EventID')
+	channel = system_text(system, 'Channel')
+	row = dict.fromkeys(EVTX_COLUMNS)
+	row.update({
+		'RecordNumber': str(record_id),
+		'EventRecordId': system_text(system, 'EventRecordID') or str(record_id),
+		'TimeCreated': system_attribute(system, 'TimeCreated', 'SystemTime') or filetime(written),
+		'EventId': event_id,
+		'Level': LEVELS.get(system_text(system, 'Level'), system_text(system, 'Level')),
+		'Provider': system_attribute(system, 'Provider', 'Name'),
+		'Channel': channel,
+		'ProcessId': system_attribute(system, 'Execution', 'ProcessID'),
+		'ThreadId': system_attribute(system, 'Execution', 'ThreadID'),
+		'Computer': system_text(system, 'Computer'),
+		'ChunkNumber': str(chunk_number),
+		'UserId': system_attribute(system, 'Security', 'UserID'),
+		'HiddenRecord': 'False',
+		'SourceFile': source_file,
+		'Keywords': system_text(system, 'Keywords'),
+		'ExtraDataOffset': '0',
+		'Payload': json.dumps({'EventData': data}, ensure_ascii=False) if data else None,
+	})
+	mapping = EVENT_MAPS.get((channel, event_id))
+	if mapping is not None:
+		values = MissingEmpty(data)
+		for column, layout in mapping.items():
+			row[column] = layout.format_map(values)
+	else:
+		for i, (name, value) in enumerate(list(data.items())[:6]):
+			row['PayloadData'+str(i + 1)] = name+": "+value
+	return [row[column] for column in EVTX_COLUMNS]
+
+
+# Parses the records of a chunk, returns (rows, number of records that could not be parsed)
+def parse_chunk(data, chunk_number, source_file):
+	chunk = {'names': {}, 'templates': {}}
+	rows = []
+	errors = 0
+	end = min(U32.unpack_from(data, 48)[0], CHUNK_SIZE)
+	pos = CHUNK_RECORDS_START
+	while pos + 28 <= end and data[pos:pos + 4] == RECORD_SIGNATURE:
+		size = U32.unpack_from(data, pos + 4)[0]
+		if size < 28 or pos + size > CHUNK_SIZE:
+			break
+		try:
+			root = parse_fragment(data, pos + 24, chunk)[0]
+			row = event_row(root, U64.unpack_from(data, pos + 8)[0], U64.unpack_from(data, pos + 16)[0], chunk_number, source_file)
+			if row is not None:
+				rows.append(row)
+		except (ValueError, IndexError, KeyError, struct.error, UnicodeError, RecursionError):
+			errors += 1
+		pos += size
+	return rows, errors
+
+
+# Worker side: parses chunks [first, last) of a log, returns (path, rows, errors)
+def parse_chunk_range(task):
+	path, first, last = task
+	rows = []
+	errors = 0
+	with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+		for number in range(first, last):
+			offset = FILE_HEADER_SIZE + number * CHUNK_SIZE
+			data = view[offset:offset + CHUNK_SIZE]
+			if len(data) < CHUNK_SIZE or data[:8] != CHUNK_SIGNATURE:
+				continue
+			chunk_rows, chunk_errors = parse_chunk(data, number, path)
+			rows.extend(chunk_rows)
+			errors += chunk_errors
+	return path, rows, errors
+
+
+# Chunks are counted from the file size: the header of a log that was not closed properly can be behind
+def chunk_count(path):
+	size = os.path.getsize(path)
+	if size < FILE_HEADER_SIZE + CHUNK_SIZE:
+		return 0
+	with open(path, 'rb') as f:
+		if f.read(8) != FILE_SIGNATURE:
+			return 0
+	return (size - FILE_HEADER_SIZE) // CHUNK_SIZE
+
+
+# CSV file of a log: [log name].csv for the logs directly in the folder, prefixed by the subfolders of the others
+# (Archive_Security.evtx.csv), so that logs of the same name in different folders never write the same file
+def csv_name(evtx_folder, path):
+	return "_".join(Path(path).relative_to(evtx_folder).parts)+".csv"
+
+
+# Converts every log under evtx_folder to its csv_name in output, with "workers" parsing processes. Returns {CSV name: events}.
+def convert_folder(evtx_folder, output, workers=None, logger=None):
+	tasks = []
+	remaining = {}
+	names = {}
+	for path in sorted(str(p) for p in Path(evtx_folder).rglob('*.evtx')):
+		name = csv_name(evtx_folder, path)
+		other = next((other for other, other_name in names.items() if other_name.lower() == name.lower()), None)
+		if other is not None:
+			raise ValueError(other+" and "+path+" would both be written to "+name)
+		names[path] = name
+		count = chunk_count(path)
+		for first in range(0, count, TASK_CHUNKS):
+			tasks.append((path, first, min(first + TASK_CHUNKS, count)))
+			remaining[path] = remaining.get(path, 0) + 1
+	counts = {}
+	handles = {}
+	errors = {}
+	try:
+		with multiprocessing.Pool(workers or os.cpu_count() or 1) as pool:
+			for path, rows, failed in pool.imap(parse_chunk_range, tasks):
+				name = names[path]
+				if rows:
+					if path not in handles:
+						handle = open(os.path.join(output, name), 'w', newline='', encoding='utf-8')
+						handles[path] = (handle, csv.writer(handle))
+						handles[path][1].writerow(EVTX_COLUMNS)
+					handles[path][1].writerows(rows)
+					counts[name] = counts.get(name, 0) + len(rows)
+				errors[name] = errors.get(name, 0) + failed
+				remaining[path] -= 1
+				if remaining[path] == 0 and path in handles:
+					handles.pop(path)[0].close()
+	finally:
+		for handle, writer in handles.values():
+			handle.close()
+	if logger is not None:
+		for name, count in counts.items():
+			logger.info(name+": "+str(count)+" events"+(", "+str(errors[name])+" unreadable records." if errors.get(name) else "."))
+	return counts
@@ -0,0 +1,203 @@
+'''
+Stage metrics shared by win_dissect and volxlsx.
+
+Each measured stage (a tool run, a table load, a report sheet, a Volatility plugin...) appends one JSON line to a metrics file:
+wall and CPU time, rows, bytes read and written, and peak memory. Tool processes are measured on their own, their CPU time and
+peak memory are those of the process. The slowest stages are summarised at the end of the run. When profiling is on, the Python
+side of the main stages runs under cProfile: statistics are saved as .prof files (pstats format, sortable with pstats or
+snakeviz), with a text listing sorted by cumulative time next to them.
+
+https://github.com/Martendal/DFIR-tools
+'''
+
+import os, sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+METRICS = {'handle': None, 'run': None, 'records': [], 'lock': threading.Lock()}
+
+# Folder and profiling settings of the current thread (metrics_scope), and the stage being measured (measure_stage)
+CONTEXT = threading.local()
+
+# cProfile only profiles one stage at a time: a stage starting while another one is profiled runs unprofiled
+PROFILE_LOCK = threading.Lock()
+
+# Lines of the summary
+SUMMARY_STAGES = 15
+
+
+# Opens the JSON-lines file, records are appended to it (each run has its own "run" value)
+def open_metrics(path):
+	METRICS['handle'] = open(path, 'a', encoding='utf-8')
+	METRICS['run'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+	METRICS['records'] = []
+
+
+def close_metrics():
+	if METRICS['handle'] is not None:
+		METRICS['handle'].close()
+		METRICS['handle'] = None
+
+
+def record_metrics(kind, stage, values):
+	record = {'run': METRICS['run'], 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'kind': kind, 'stage': stage}
+	output = getattr(CONTEXT, 'output', None)
+	if output is not None:
+		record['output'] = output
+	record.update(values)
+	with METRICS['lock']:
+		METRICS['records'].append(record)
+		if METRICS['handle'] is not None:
+			METRICS['handle'].write(json.dumps(record)+"\n")
+			METRICS['handle'].flush()
+
+
+# Output folder recorded with the metrics of this thread, and folder of the profiles (None: no profiling)
+@contextmanager
+def metrics_scope(output, profile_dir=None):
+	previous = (getattr(CONTEXT, 'output', None), getattr(CONTEXT, 'profile_dir', None))
+	CONTEXT.output, CONTEXT.profile_dir = output, profile_dir
+	try:
+		yield
+	finally:
+		CONTEXT.output, CONTEXT.profile_dir = previous
+
+
+# Wraps a function so that it runs in the metrics scope of the calling thread, for work handed to a thread pool
+def in_scope(function):
+	output, profile_dir = getattr(CONTEXT, 'output', None), getattr(CONTEXT, 'profile_dir', None)
+
+	def scoped(*args, **kwargs):
+		with metrics_scope(output, profile_dir):
+			return function(*args, **kwargs)
+	return scoped
+
+
+# Peak working set of a Windows process handle, in MB
+def windows_peak_memory(handle):
+	import ctypes
+	from ctypes import wintypes
+
+	class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+		_fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD), ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+			('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t), ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+			('QuotaNonPagedPoolUsage', ctypes.c_size_t), ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+	counters = PROCESS_MEMORY_COUNTERS()
+	counters.cb = ctypes.sizeof(counters)
+	ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb)
+	return round(counters.PeakWorkingSetSize / 1048576, 1)
+
+
+# ru_maxrss is in KB on Linux, in bytes on macOS
+def rusage_mb(value):
+	return round(value / (1048576 if sys.platform == 'darwin' else 1024), 1)
+
+
+# Peak memory of this process in MB
+def peak_memory_mb():
+	if os.name == 'nt':
+		import ctypes
+		return windows_peak_memory(ctypes.windll.kernel32.GetCurrentProcess())
+	import resource
+	return rusage_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+# Waits for a process and returns (exit code, CPU seconds, peak memory in MB) of that process only (supervisor.run_tool)
+def wait_process(process):
+	if os.name == 'nt':
+		import ctypes
+		from ctypes import wintypes
+		code = process.wait()
+		creation, exited, kernel, user = (wintypes.FILETIME() for i in range(4))
+		ctypes.windll.kernel32.GetProcessTimes(int(process._handle), ctypes.byref(creation), ctypes.byref(exited), ctypes.byref(kernel), ctypes.byref(user))
+		cpu = sum((t.dwHighDateTime << 32 | t.dwLowDateTime) for t in (kernel, user)) / 10000000
+		return code, cpu, windows_peak_memory(int(process._handle))
+	pid, status, usage = os.wait4(process.pid, 0)
+	process.returncode = os.waitstatus_to_exitcode(status)
+	return process.returncode, usage.ru_utime + usage.ru_stime, rusage_mb(usage.ru_maxrss)
+
+
+def profile_name(name):
+	return "".join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+
+
+# Runs the block under cProfile when profiling is on in this thread (metrics_scope) and no other stage is being profiled
+@contextmanager
+def profiled(name):
+	profile_dir = getattr(CONTEXT, 'profile_dir', None)
+	if profile_dir is None or not PROFILE_LOCK.acquire(blocking=False):
+		yield
+		return
+	import io, cProfile, pstats
+	profiler = cProfile.Profile()
+	try:
+		profiler.enable()
+		try:
+			yield
+		finally:
+			profiler.disable()
+			os.makedirs(profile_dir, exist_ok=True)
+			path = os.path.join(profile_dir, profile_name(name))
+			profiler.dump_stats(path+".prof")
+			listing = io.StringIO()
+			pstats.Stats(profiler, stream=listing).sort_stats('cumulative').print_stats(60)
+			with open(path+".txt", 'w', encoding='utf-8') as f:
+				f.write(listing.getvalue())
+	finally:
+		PROFILE_LOCK.release()
+
+
+# Measures a stage run in this thread and records it. The block can add values (rows, bytes_in, bytes_out...) to the yielded
+# dict. CPU time is the one of this thread plus the tool processes it ran (run_tool), peak memory is the one of this process.
+@contextmanager
+def measure_stage(kind, name, profile=False):
+	values = {}
+	previous = getattr(CONTEXT, 'stage', None)
+	CONTEXT.stage = {'name': name, 'processes': []}
+	start = time.perf_counter()
+	cpu_start = time.thread_time()
+	try:
+		if profile:
+			with profiled(kind+"_"+name):
+				yield values
+		else:
+			yield values
+	except BaseException as e:
+		values['error'] = repr(e)
+		raise
+	finally:
+		processes = CONTEXT.stage['processes']
+		CONTEXT.stage = previous
+		python_cpu = time.thread_time() - cpu_start
+		tool_cpu = sum(process['cpu_seconds'] for process in processes)
+		values.update({'wall_seconds': round(time.perf_counter() - start, 3), 'cpu_seconds': round(python_cpu + tool_cpu, 3), 'python_cpu_seconds': round(python_cpu, 3),
+			'peak_rss_mb': peak_memory_mb()})
+		if processes:
+			values.update({'processes': len(processes), 'tool_cpu_seconds': round(tool_cpu, 3), 'tool_peak_rss_mb': max(process['peak_rss_mb'] for process in processes)})
+		if values.get('rows') and values['wall_seconds']:
+			values['rows_per_second'] = round(values['rows'] / values['wall_seconds'])
+		record_metrics(kind, name, values)
+
+
+def megabytes(value):
+	return "%.1f" % (value / 1048576) if value else ""
+
+
+# Lines summarising the stages measured in this run (measure_stage), slowest first (tool processes are part of their stage)
+def metrics_summary():
+	stages = [record for record in METRICS['records'] if record['kind'] != 'process' and 'cpu_seconds' in record]
+	stages.sort(key=lambda record: record['wall_seconds'], reverse=True)
+	lines = ["Slowest stages: wall, CPU, rows, rows/s, MB in, MB out, peak MB (this process / tools)"]
+	for record in stages[:SUMMARY_STAGES]:
+		name = record['kind']+" "+record['stage']
+		if 'output' in record:
+			name += " ("+os.path.basename(os.path.normpath(record['output']))+")"
+		lines.append("\t"+name[:48].ljust(50)+("%.1f" % record['wall_seconds']+"s").rjust(9)+("%.1f" % record['cpu_seconds']+"s").rjust(9)+
+			str(record.get('rows', '')).rjust(11)+str(record.get('rows_per_second', '')).rjust(9)+megabytes(record.get('bytes_in')).rjust(9)+
+			megabytes(record.get('bytes_out')).rjust(9)+(str(record['peak_rss_mb'])+(" / "+str(record['tool_peak_rss_mb']) if 'tool_peak_rss_mb' in record else "")).rjust(16))
+	total_cpu = sum(record['cpu_seconds'] for record in METRICS['records'] if record['kind'] == 'process')
+	lines.append("Tool processes: "+str(sum(1 for record in METRICS['records'] if record['kind'] == 'process'))+", "+"%.1f" % total_cpu+"s CPU.")
+	return lines
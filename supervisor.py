@@ -0,0 +1,251 @@
+'''
+Tool process supervisor shared by win_dissect and volxlsx.
+
+Every tool process (Eric Zimmerman's tools, vol.exe) is run by one asyncio event loop, in a background thread. What a tool prints
+is read as it comes and written to a log file per tool, so a chatty tool never blocks on a full pipe and the console stays readable.
+A tool can be given a wall-clock timeout and an idle timeout (nothing printed for that long), none by default: a tool over either one
+is killed with the processes it started, and started again up to "retries" times. The caller gets the exit code, the duration and the
+number of runs.
+
+https://github.com/Martendal/DFIR-tools
+'''
+
+import os
+import time
+import ntpath
+import signal
+import tempfile
+import asyncio
+import logging
+import argparse
+import threading
+import subprocess
+from collections import namedtuple
+from metrics import CONTEXT, record_metrics, wait_process, profile_name
+
+
+# Result of run_tool: exit code of the last run, wall time of all the runs, number of runs, why the last run was killed (None,
+# "timeout" or "idle timeout") and the log file
+ToolResult = namedtuple('ToolResult', ['code', 'seconds', 'attempts', 'killed', 'log'])
+
+# Limits of a tool run, in seconds (None: no limit). "default" applies to every tool, "tools" overrides it for a tool (lowercase name
+# of its executable without extension: "recmd", "mftecmd", "vol"...). A killed run is started again "retries" times. Nothing is
+# limited by default: timelines, scans of a large dump or big hives can keep a tool quiet for a long time while it works.
+TOOL_LIMITS = {'default': {'timeout': None, 'idle_timeout': None, 'retries': 0}, 'tools': {}}
+
+# Logs go to this subfolder of the output folder being measured (metrics_scope), or of the temporary folder outside of any scope.
+# A log is overwritten by the first run of its tool in this process, the next runs (retries, other files of the same stage) are appended.
+TOOL_LOGS = {'folder': "tool_logs", 'opened': set(), 'lock': threading.Lock()}
+
+# Seconds between two checks of the timeouts, and seconds left to the pipes to be read to the end once the tool exited
+WATCH_INTERVAL = 1
+PIPE_GRACE = 5
+
+SUPERVISOR = {'loop': None, 'lock': threading.Lock()}
+
+Logger = logging.getLogger()
+
+
+####### Command line ####
+
+# "[minutes]" for every tool or "[tool]=[minutes]" for one tool, 0 being no limit. Returns (tool or None, seconds or None).
+def tool_limit(string):
+	tool, separator, minutes = string.rpartition('=')
+	try:
+		value = float(minutes)
+	except ValueError:
+		value = -1
+	if value < 0:
+		raise argparse.ArgumentTypeError(string+" is not [minutes] or [tool]=[minutes]")
+	return os.path.splitext(tool)[0].lower() or None, value * 60 if value else None
+
+
+def add_tool_arguments(parser):
+	parser.add_argument("--tool-timeout", required=False, help="Kill a tool running for longer than this, in minutes (0: no limit, the default). \"[tool]=[minutes]\" sets the limit of one tool (RECmd=120). Can be repeated.", action='append', default=[], type=tool_limit)
+	parser.add_argument("--idle-timeout", required=False, help="Kill a tool that printed nothing for this long, in minutes (0: no limit, the default). \"[tool]=[minutes]\" sets the limit of one tool. Can be repeated.", action='append', default=[], type=tool_limit)
+	parser.add_argument("--tool-retries", required=False, help="Number of times a tool killed by a timeout is started again (0 by default).", default=TOOL_LIMITS['default']['retries'], type=int)
+
+
+# Applies the options of add_tool_arguments, tool logs going to the "log_folder" subfolder of the output
+def configure_tools(config, log_folder):
+	for option, key in (('tool_timeout', 'timeout'), ('idle_timeout', 'idle_timeout')):
+		for tool, seconds in config[option]:
+			if tool is None:
+				TOOL_LIMITS['default'][key] = seconds
+			else:
+				TOOL_LIMITS['tools'].setdefault(tool, {})[key] = seconds
+	TOOL_LIMITS['default']['retries'] = max(config['tool_retries'], 0)
+	TOOL_LOGS['folder'] = log_folder
+
+
+def tool_name(command):
+	return os.path.splitext(ntpath.basename(str(command[0])))[0].lower()
+
+
+def tool_limits(name):
+	return dict(TOOL_LIMITS['default'], **TOOL_LIMITS['tools'].get(name, {}))
+
+
+# Command actually started for a tool (the benchmark points the tools to its stubs)
+def tool_command(command):
+	return [str(part) for part in command]
+
+
+####### Event loop ####
+
+# The loop running the tools of this Python process, started with the first tool
+def supervisor_loop():
+	with SUPERVISOR['lock']:
+		if SUPERVISOR['loop'] is None:
+			loop = asyncio.ProactorEventLoop() if os.name == 'nt' else asyncio.new_event_loop()
+			threading.Thread(target=loop.run_forever, name="tool-supervisor", daemon=True).start()
+			SUPERVISOR['loop'] = loop
+	return SUPERVISOR['loop']
+
+
+# Writes what a tool prints to its log, or its standard output to "stdout" when given, and remembers when it last printed something
+class ToolOutput(asyncio.SubprocessProtocol):
+	def __init__(self, loop, log, stdout=None):
+		self.log = log
+		self.stdout = stdout
+		self.last_output = time.monotonic()
+		self.open_pipes = {1, 2}
+		self.drained = loop.create_future()
+
+	def pipe_data_received(self, fd, data):
+		self.last_output = time.monotonic()
+		(self.stdout if fd == 1 and self.stdout is not None else self.log).write(data)
+
+	def pipe_connection_lost(self, fd, exc):
+		self.open_pipes.discard(fd)
+		if not self.open_pipes and not self.drained.done():
+			self.drained.set_result(None)
+
+
+# One pipe of a POSIX tool, read by the loop (connect_read_pipe) for its ToolOutput
+class ToolPipe(asyncio.Protocol):
+	def __init__(self, output, fd):
+		self.output = output
+		self.fd = fd
+
+	def data_received(self, data):
+		self.output.pipe_data_received(self.fd, data)
+
+	def connection_lost(self, exc):
+		self.output.pipe_connection_lost(self.fd, exc)
+
+
+# Returns the process (a subprocess.Popen, waited with metrics.wait_process for its CPU time and peak memory) and the transports of
+# its pipes. On Windows the loop creates the process, its pipes have to be overlapped; on POSIX the tool gets its own process group.
+async def start_tool(loop, command, output):
+	if os.name == 'nt':
+		transport, protocol = await loop.subprocess_exec(lambda: output, *command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		return transport.get_extra_info('subprocess'), [transport]
+	process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+	transports = []
+	for fd, pipe in ((1, process.stdout), (2, process.stderr)):
+		transport, protocol = await loop.connect_read_pipe(lambda fd=fd: ToolPipe(output, fd), pipe)
+		transports.append(transport)
+	return process, transports
+
+
+# Kills a tool with the processes it started (vol.exe is a launcher running Volatility in a child process)
+async def kill_tool(loop, process):
+	if os.name == 'nt':
+		await loop.run_in_executor(None, lambda: subprocess.call(['taskkill', '/F', '/T', '/PID', str(process.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+		try:
+			process.kill()
+		except OSError:
+			pass
+	else:
+		try:
+			os.killpg(process.pid, signal.SIGKILL)
+		except OSError:
+			pass
+
+
+# One run of a tool. Returns (exit code, CPU seconds, peak memory in MB, None or why it was killed).
+async def supervise_tool(command, log, stdout, limits):
+	loop = asyncio.get_running_loop()
+	output = ToolOutput(loop, log, stdout)
+	process, transports = await start_tool(loop, command, output)
+	exited = loop.run_in_executor(None, wait_process, process)
+	start = time.monotonic()
+	killed = None
+	try:
+		while not exited.done():
+			await asyncio.wait([exited], timeout=WATCH_INTERVAL)
+			if exited.done():
+				break
+			now = time.monotonic()
+			if limits['timeout'] is not None and now - start > limits['timeout']:
+				killed = "timeout"
+			elif limits['idle_timeout'] is not None and now - output.last_output > limits['idle_timeout']:
+				killed = "idle timeout"
+			if killed:
+				await kill_tool(loop, process)
+				break
+		code, cpu, peak = await exited
+		await asyncio.wait([output.drained], timeout=PIPE_GRACE)
+	except asyncio.CancelledError:
+		await kill_tool(loop, process)
+		raise
+	finally:
+		for transport in transports:
+			transport.close()
+	return code, cpu, peak, killed
+
+
+####### Tool runs ####
+
+def open_tool_log(name):
+	stage = getattr(CONTEXT, 'stage', None)
+	folder = os.path.join(getattr(CONTEXT, 'output', None) or tempfile.gettempdir(), TOOL_LOGS['folder'])
+	os.makedirs(folder, exist_ok=True)
+	path = os.path.abspath(os.path.join(folder, profile_name((stage['name']+"_" if stage is not None else "")+name)+".log"))
+	with TOOL_LOGS['lock']:
+		mode = 'ab' if path in TOOL_LOGS['opened'] else 'wb'
+		TOOL_LOGS['opened'].add(path)
+	return path, open(path, mode)
+
+
+# Runs a tool under the supervisor and waits for it: its output goes to its log (or its standard output to the binary file "stdout",
+# emptied before each run), and it is killed past its limits (TOOL_LIMITS) and started again up to "retries" times. Each run is
+# recorded in the metrics (kind "process") and added to the stage being measured in this thread, if any. Returns a ToolResult.
+def run_tool(command, stdout=None):
+	name = tool_name(command)
+	limits = tool_limits(name)
+	command = tool_command(command)
+	loop = supervisor_loop()
+	stage = getattr(CONTEXT, 'stage', None)
+	log_path, log = open_tool_log(name)
+	start = time.perf_counter()
+	try:
+		for attempt in range(1, limits['retries'] + 2):
+			if stdout is not None:
+				stdout.seek(0)
+				stdout.truncate()
+			log.write(("#### "+time.strftime('%Y-%m-%d %H:%M:%S')+" run "+str(attempt)+": "+subprocess.list2cmdline(command)+"\n").encode('utf-8', 'replace'))
+			log.flush()
+			run_start = time.perf_counter()
+			future = asyncio.run_coroutine_threadsafe(supervise_tool(command, log, stdout, limits), loop)
+			try:
+				code, cpu, peak, killed = future.result()
+			except BaseException:
+				future.cancel()
+				raise
+			values = {'command': ntpath.basename(command[0]), 'exit_code': code, 'wall_seconds': round(time.perf_counter() - run_start, 3), 'cpu_seconds': round(cpu, 3), 'peak_rss_mb': peak, 'log': log_path}
+			if attempt > 1:
+				values['attempt'] = attempt
+			if killed:
+				values['killed'] = killed
+			if stage is not None:
+				stage['processes'].append(values)
+			record_metrics('process', stage['name'] if stage is not None else values['command'], values)
+			log.write(("\n#### "+("killed ("+killed+")" if killed else "exit code "+str(code))+" after "+"%.1f" % values['wall_seconds']+"s\n").encode())
+			if not killed:
+				break
+			Logger.warning(name+" killed ("+killed+") after "+"%.1f" % values['wall_seconds']+"s, run "+str(attempt)+" of "+str(limits['retries'] + 1)+", see "+log_path)
+	finally:
+		log.close()
+	return ToolResult(code, time.perf_counter() - start, attempt, killed, log_path)
@@ -0,0 +1,34 @@
+import sqlite3
+import win_dissect
+
+
+def write_log(path, header, rows):
+	with open(path, 'w', newline='', encoding='utf-8') as f:
+		f.write(",".join(header)+"\n")
+		for row in rows:
+			f.write(",".join(row)+"\n")
+	return str(path), path.name
+
+
+# Logs converted separately do not have the same columns
+def test_global_view_over_logs_with_other_columns(tmp_path):
+	files = [
+		write_log(tmp_path / "Security.evtx.csv", ["TimeCreated", "EventId", "Channel", "PayloadData1"],
+			[["2024-01-02 10:00:00", "4624", "Security", "Target: a"], ["2024-01-02 11:00:00", "4625", "Security", "Target: b"]]),
+		write_log(tmp_path / "System.evtx.csv", ["TimeCreated", "EventId", "Computer", "ExecutableInfo"],
+			[["2024-01-03 09:00:00", "7045", "host", "svc.exe"]]),
+	]
+	db_path = str(tmp_path / "case.db")
+	win_dissect.create_database_bulk(None, db_path, files)
+	con = sqlite3.connect(db_path)
+	try:
+		columns = [row[1] for row in con.execute("PRAGMA table_info(\"global.csv\")")]
+		assert columns == ["index", "TimeCreated", "EventId", "Channel", "PayloadData1", "Computer", "ExecutableInfo", "source_table"]
+		rows = con.execute("SELECT source_table, \"index\", EventId, Channel, Computer, ExecutableInfo FROM \"global.csv\" ORDER BY source_table, \"index\"").fetchall()
+	finally:
+		con.close()
+	assert rows == [
+		("Security.evtx.csv", 1, 4624, "Security", None, None),
+		("Security.evtx.csv", 2, 4625, "Security", None, None),
+		("System.evtx.csv", 1, 7045, None, "host", "svc.exe"),
+	]
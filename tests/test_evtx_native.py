@@ -0,0 +1,162 @@
+import csv
+import struct
+from datetime import datetime
+import pytest
+import evtx_native
+
+
+# Hand-built EVTX: a file header and one chunk of records, each an instance of the same template (defined in the first record)
+
+def filetime(text):
+	delta = datetime.strptime(text, '%Y-%m-%d %H:%M:%S') - datetime(1601, 1, 1)
+	return (delta.days * 86400 + delta.seconds) * 10000000
+
+
+def name(text):
+	return struct.pack('<IHH', 0, 0, len(text)) + text.encode('utf-16le') + b'\0\0'
+
+
+class Xml:
+	def __init__(self, base):
+		self.base = base
+		self.data = bytearray()
+
+	def position(self):
+		return self.base + len(self.data)
+
+	# attributes: (name, text or substitution index)
+	def open(self, tag, attributes=()):
+		start = self.position()
+		self.data += bytes([0x41 if attributes else 0x01]) + struct.pack('<HII', 0xffff, 0, start + 11) + name(tag)
+		if attributes:
+			self.data += struct.pack('<I', 0)
+		for attribute, value in attributes:
+			start = self.position()
+			self.data += bytes([0x06]) + struct.pack('<I', start + 5) + name(attribute)
+			if isinstance(value, int):
+				self.data += bytes([0x0d]) + struct.pack('<HB', value, 0)
+			else:
+				self.data += bytes([0x05, 0x01]) + struct.pack('<H', len(value)) + value.encode('utf-16le')
+		self.data += bytes([0x02])
+
+	def close(self):
+		self.data += bytes([0x04])
+
+	def substitution(self, index):
+		self.data += bytes([0x0d]) + struct.pack('<HB', index, 0)
+
+	def element(self, tag, index, attributes=()):
+		self.open(tag, attributes)
+		self.substitution(index)
+		self.close()
+
+
+# Event skeleton, values: EventID, Channel, SystemTime, Computer, then the EventData values
+DATA_NAMES = ['TargetUserName', 'TargetDomainName', 'LogonType', 'IpAddress']
+
+def template_body(base):
+	xml = Xml(base)
+	xml.data += bytes([0x0f, 0x01, 0x01, 0x00])
+	xml.open('Event', [('xmlns', "http://schemas.microsoft.com/win/2004/08/events/event")])
+	xml.open('System')
+	xml.element('EventID', 0)
+	xml.element('Channel', 1)
+	xml.open('TimeCreated', [('SystemTime', 2)])
+	xml.close()
+	xml.element('Computer', 3)
+	xml.close()
+	xml.open('EventData')
+	for i, data_name in enumerate(DATA_NAMES):
+		xml.element('Data', 4 + i, [('Name', data_name)])
+	xml.close()
+	xml.close()
+	xml.data += bytes([0x00])
+	return bytes(xml.data)
+
+
+def substitutions(event_id, channel, time, computer, data):
+	values = [struct.pack('<H', event_id), channel.encode('utf-16le'), struct.pack('<Q', filetime(time)), computer.encode('utf-16le')]
+	values += [value.encode('utf-16le') for value in data]
+	kinds = [0x06, 0x01, 0x11, 0x01] + [0x01] * len(data)
+	return struct.pack('<I', len(values)) + b''.join(struct.pack('<HBB', len(value), kind, 0) for value, kind in zip(values, kinds)) + b''.join(values)
+
+
+def build_chunk(events):
+	chunk = bytearray(evtx_native.CHUNK_SIZE)
+	chunk[:8] = evtx_native.CHUNK_SIGNATURE
+	pos = evtx_native.CHUNK_RECORDS_START
+	template = None
+	for number, event in enumerate(events, 1):
+		record = bytearray(b'\x2a\x2a\x00\x00' + struct.pack('<IQQ', 0, number, filetime(event[2])))
+		record += bytes([0x0f, 0x01, 0x01, 0x00])
+		start = pos + len(record)
+		if template is None:
+			template = start + 10
+			body = template_body(template + 24)
+			record += bytes([0x0c, 0x01]) + struct.pack('<II', 1, template) + struct.pack('<I', 0) + bytes(16) + struct.pack('<I', len(body)) + body
+		else:
+			record += bytes([0x0c, 0x01]) + struct.pack('<II', 1, template)
+		record += substitutions(*event)
+		record += bytes(-(len(record) + 4) % 8)
+		struct.pack_into('<I', record, 4, len(record) + 4)
+		record += struct.pack('<I', len(record) + 4)
+		chunk[pos:pos + len(record)] = record
+		pos += len(record)
+	struct.pack_into('<I', chunk, 48, pos)
+	return bytes(chunk)
+
+
+def write_log(path, events):
+	path.parent.mkdir(parents=True, exist_ok=True)
+	header = bytearray(evtx_native.FILE_HEADER_SIZE)
+	header[:8] = evtx_native.FILE_SIGNATURE
+	path.write_bytes(bytes(header) + build_chunk(events))
+
+
+def read_csv(path):
+	with open(path, newline='', encoding='utf-8') as f:
+		return list(csv.DictReader(f))
+
+
+EVENTS = [
+	(4624, 'Security', '2024-01-02 10:00:00', 'HOST', ['alice', 'DOM', '10', '10.0.0.5']),
+	(4634, 'Security', '2024-01-02 11:30:00', 'HOST', ['alice', 'DOM', '10', '-']),
+	(4999, 'Security', '2024-01-02 12:00:00', 'HOST', ['bob', 'DOM', '3', '-']),
+]
+
+
+def test_chunk_records(tmp_path):
+	rows, errors = evtx_native.parse_chunk(build_chunk(EVENTS), 0, "Security.evtx")
+	assert errors == 0
+	assert [(row[3], row[6], row[2], row[9]) for row in rows] == [
+		('4624', 'Security', '2024-01-02 10:00:00.0000000', 'HOST'),
+		('4634', 'Security', '2024-01-02 11:30:00.0000000', 'HOST'),
+		('4999', 'Security', '2024-01-02 12:00:00.0000000', 'HOST')]
+	rows = [dict(zip(evtx_native.EVTX_COLUMNS, row)) for row in rows]
+	assert rows[0]['MapDescription'] == 'Successful logon'
+	assert rows[0]['UserName'] == 'DOM\\alice'
+	assert rows[0]['RemoteHost'] == ' (10.0.0.5)'
+	assert rows[0]['PayloadData2'] == 'LogonType 10'
+	assert rows[1]['MapDescription'] == 'An account was logged off'
+	# No map: the first EventData values
+	assert rows[2]['MapDescription'] is None
+	assert rows[2]['PayloadData1'] == 'TargetUserName: bob'
+	assert rows[2]['PayloadData3'] == 'LogonType: 3'
+
+
+def test_logs_of_the_same_name_in_subfolders(tmp_path):
+	write_log(tmp_path / "Logs" / "Security.evtx", EVENTS[:1])
+	write_log(tmp_path / "Logs" / "Archive" / "Security.evtx", EVENTS[1:])
+	output = tmp_path / "out"
+	output.mkdir()
+	counts = evtx_native.convert_folder(str(tmp_path / "Logs"), str(output), 1)
+	assert counts == {'Security.evtx.csv': 1, 'Archive_Security.evtx.csv': 2}
+	assert [row['EventId'] for row in read_csv(output / "Security.evtx.csv")] == ['4624']
+	assert [row['EventId'] for row in read_csv(output / "Archive_Security.evtx.csv")] == ['4634', '4999']
+
+
+def test_colliding_csv_names(tmp_path):
+	write_log(tmp_path / "Logs" / "A_B" / "x.evtx", EVENTS[:1])
+	write_log(tmp_path / "Logs" / "A" / "B_x.evtx", EVENTS[:1])
+	with pytest.raises(ValueError):
+		evtx_native.convert_folder(str(tmp_path / "Logs"), str(tmp_path), 1)
@@ -0,0 +1,68 @@
+import sys
+import pytest
+import sqlite3
+import win_dissect
+
+
+def write_indicators(tmp_path, lines):
+	path = tmp_path / "iocs.txt"
+	path.write_text("\n".join(lines)+"\n", encoding='utf-8')
+	return win_dissect.load_indicators(str(path))
+
+
+def sweep(tmp_path, rows, lines):
+	db_path = str(tmp_path / "case.db")
+	con = sqlite3.connect(db_path)
+	con.execute("CREATE TABLE \"events.csv\" (\"index\" INTEGER PRIMARY KEY, first TEXT, second TEXT)")
+	con.executemany("INSERT INTO \"events.csv\" (first, second) VALUES (?, ?)", rows)
+	con.commit()
+	con.close()
+	win_dissect.sweep_database(db_path, ["events.csv"], write_indicators(tmp_path, lines))
+	con = sqlite3.connect(db_path)
+	try:
+		return con.execute("SELECT indicator, source_index, \"column\", value FROM ioc_hits ORDER BY \"index\"").fetchall()
+	finally:
+		con.close()
+
+
+# "İ" lowers to 2 characters: the hit must still point to the cell it is in
+def test_sweep_cell_longer_once_lowered(tmp_path):
+	hits = sweep(tmp_path, [("İ" * 20, "run evil.exe"), ("EVIL.EXE", None)], ["evil.exe"])
+	assert hits == [("evil.exe", 1, "second", "run evil.exe"), ("evil.exe", 2, "first", "EVIL.EXE")]
+
+
+def test_sweep_exact_and_substring(tmp_path):
+	sha1 = "a" * 40
+	hits = sweep(tmp_path, [("0000"+sha1.upper(), "10.0.0.1"), ("110.0.0.12", "nothing")], [sha1, "10.0.0.1", "0.0.1"])
+	assert sorted(hits) == [("0.0.1", 1, "second", "10.0.0.1"), ("0.0.1", 2, "first", "110.0.0.12"), ("10.0.0.1", 1, "second", "10.0.0.1"), (sha1, 1, "first", "0000"+sha1.upper())]
+
+
+WORDS = {"abc", "abcd", "bcd", "cde", "aaa", "aaaa", "evil.exe", "il.ex", "ab\\c", "a.c", "(x)"}
+TEXTS = ["abcde", "aaaaaa", "xabcdabcdex", "c:\\evil.exe\0evil.exe", "ab\\cde a.c abc (x)", "", "nothing here"]
+
+
+def find_all(words, text):
+	found = set()
+	for word in words:
+		start = text.find(word)
+		while start != -1:
+			found.add((start, word))
+			start = text.find(word, start + 1)
+	return found
+
+
+# The trie expression finds every occurrence, overlapping ones and indicators starting at the same position included
+def test_trie_matcher_finds_what_find_does(monkeypatch):
+	monkeypatch.setitem(sys.modules, 'ahocorasick', None)
+	find, engine = win_dissect.substring_matcher(WORDS)
+	assert engine == "trie expression"
+	for text in TEXTS:
+		assert set(find(text)) == find_all(WORDS, text)
+
+
+def test_aho_corasick_matcher_finds_what_find_does():
+	pytest.importorskip('ahocorasick')
+	find, engine = win_dissect.substring_matcher(WORDS)
+	assert engine == "Aho-Corasick"
+	for text in TEXTS:
+		assert set(find(text)) == find_all(WORDS, text)
@@ -0,0 +1,47 @@
+import os
+import sqlite3
+import win_dissect
+
+
+def write_csv(path, rows):
+	with open(path, 'w', newline='', encoding='utf-8') as f:
+		f.write("Name,Value\n")
+		for i in range(rows):
+			f.write("name"+str(i)+",\"value "+str(i)+"\nsecond line\"\n")
+	return str(path)
+
+
+def table_rows(db_path, table_name):
+	con = sqlite3.connect(db_path)
+	try:
+		if not con.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table_name,)).fetchone():
+			return None
+		return con.execute("SELECT * FROM \""+table_name+"\" ORDER BY \"index\"").fetchall()
+	finally:
+		con.close()
+
+
+# Killed like by the out of memory killer while parsing the second part of b.csv
+def crash_part(table_name, part, *args):
+	if table_name == "b.csv" and part == 1:
+		os._exit(1)
+	return win_dissect.parse_csv_part(table_name, part, *args)
+
+
+def test_parallel_rows_in_file_order(tmp_path, monkeypatch):
+	monkeypatch.setattr(win_dissect, 'PARALLEL_PART_BYTES', 4096)
+	monkeypatch.setattr(win_dissect, 'PARALLEL_BATCH_ROWS', 50)
+	files = [(write_csv(tmp_path / "a.csv", 2000), "a.csv"), (write_csv(tmp_path / "b.csv", 700), "b.csv")]
+	win_dissect.create_database_bulk(None, str(tmp_path / "serial.db"), files)
+	win_dissect.create_database_parallel(None, str(tmp_path / "parallel.db"), 3, files)
+	for table_name in ("a.csv", "b.csv"):
+		assert table_rows(str(tmp_path / "parallel.db"), table_name) == table_rows(str(tmp_path / "serial.db"), table_name)
+
+
+def test_parallel_lost_process_fails_its_table(tmp_path, monkeypatch):
+	monkeypatch.setattr(win_dissect, 'PARALLEL_PART_BYTES', 4096)
+	monkeypatch.setattr(win_dissect, 'parse_csv_part', crash_part)
+	files = [(write_csv(tmp_path / "b.csv", 700), "b.csv")]
+	stats = win_dissect.create_database_parallel(None, str(tmp_path / "case.db"), 2, files)
+	assert stats == {}
+	assert table_rows(str(tmp_path / "case.db"), "b.csv") is None
@@ -0,0 +1,59 @@
+from datetime import datetime
+import timestamps
+
+
+def epoch(*fields):
+	return timestamps.epoch_from_datetime(datetime(*fields))
+
+
+def test_formats():
+	days = {}
+	assert timestamps.ez_epoch("2024-01-02 10:00:00", days) == epoch(2024, 1, 2, 10)
+	assert timestamps.ez_epoch("2024-01-02 10:00:00.1234567", days) == epoch(2024, 1, 2, 10, 0, 0, 123456)
+	assert timestamps.ez_epoch("2024-01-02T10:00:00.5", days) == epoch(2024, 1, 2, 10, 0, 0, 500000)
+	assert timestamps.ez_epoch("2024-01-02 10:00:00Z", days) is None
+	assert timestamps.iso_epoch("2024-01-02T12:30:00+02:30", days) == epoch(2024, 1, 2, 10)
+	assert timestamps.iso_epoch("2024-01-02 10:00:00.25 UTC", days) == epoch(2024, 1, 2, 10, 0, 0, 250000)
+	assert timestamps.iso_epoch("2024-01-02T05:00:00-0500", days) == epoch(2024, 1, 2, 10)
+	assert timestamps.us_epoch("01/02/2024 10:00:00 PM", days) == epoch(2024, 1, 2, 22)
+	assert timestamps.us_epoch("01/02/2024 22:00:00", days) == epoch(2024, 1, 2, 22)
+	assert timestamps.us_epoch("2024-01-02 22:00:00", days) is None
+	assert days == {(2024, 1, 2): (datetime(2024, 1, 2) - timestamps.EPOCH).days}
+
+
+def test_normaliser_keeps_what_it_cannot_parse():
+	normalise = timestamps.timestamp_normaliser('ez')
+	assert normalise("2024-01-02 10:00:00") == epoch(2024, 1, 2, 10)
+	assert normalise("not a date") == "not a date"
+	assert normalise("") == ""
+	assert normalise(None) is None
+	assert normalise(12) == 12
+
+
+# The format that matched is tried first for the next values of the column
+def test_normaliser_remembers_the_detected_format(monkeypatch):
+	calls = []
+
+	def counted(name, parser):
+		def parse(value, days):
+			calls.append(name)
+			return parser(value, days)
+		return parse
+	monkeypatch.setattr(timestamps, 'TIMESTAMP_FORMATS', {name: counted(name, parser) for name, parser in timestamps.TIMESTAMP_FORMATS.items()})
+	normalise = timestamps.timestamp_normaliser('ez')
+	assert normalise("01/02/2024 10:00:00 AM") == epoch(2024, 1, 2, 10)
+	assert calls == ['ez', 'iso', 'us']
+	del calls[:]
+	assert normalise("01/03/2024 10:00:00 AM") == epoch(2024, 1, 3, 10)
+	assert calls == ['us']
+	del calls[:]
+	assert normalise("2024-01-04 10:00:00") == epoch(2024, 1, 4, 10)
+	assert calls == ['us', 'ez']
+	del calls[:]
+	assert normalise("2024-01-05 10:00:00") == epoch(2024, 1, 5, 10)
+	assert calls == ['ez']
+
+
+def test_round_trip():
+	value = timestamps.parse_timestamp("2024-01-02T10:00:00.123456Z")
+	assert timestamps.datetime_from_epoch(timestamps.epoch_from_datetime(value)) == value
@@ -0,0 +1,178 @@
+import sys
+import types
+import importlib
+from datetime import datetime, timedelta, timezone
+import pytest
+
+
+# Stand-in for the parts of the volatility3 framework vol_library uses: a configuration tree, requirements, TreeGrids and plugins
+# whose construction "finds the kernel" (counted) unless the kernel requirement is already set
+
+class Config(dict):
+	def branch(self, path):
+		return {key[len(path) + 1:]: value for key, value in self.items() if key.startswith(path+".")}
+
+	def splice(self, path, branch):
+		for key, value in branch.items():
+			self[path+"."+key] = value
+
+
+class Requirement:
+	def __init__(self, name):
+		self.name = name
+
+
+class ModuleRequirement(Requirement):
+	pass
+
+
+class TranslationLayerRequirement(Requirement):
+	pass
+
+
+class SymbolTableRequirement(Requirement):
+	pass
+
+
+class BaseAbsentValue:
+	pass
+
+
+class Hex(int):
+	pass
+
+
+class Column:
+	def __init__(self, name):
+		self.name = name
+
+
+class Node:
+	def __init__(self, values):
+		self.values = values
+
+
+class TreeGrid:
+	def __init__(self, columns, rows, error=None):
+		self.columns = [Column(column) for column in columns]
+		self.rows = rows
+		self.error = error
+
+	def populate(self, visit, accumulator):
+		for row in self.rows:
+			accumulator = visit(Node(row), accumulator)
+		if self.error is not None:
+			raise self.error
+
+
+def path_join(*parts):
+	return ".".join(parts)
+
+
+class Plugin:
+	rows = []
+	error = None
+
+	def __init__(self, config, config_path):
+		self.config = config
+		self.config_path = config_path
+
+	@classmethod
+	def get_requirements(cls):
+		return [ModuleRequirement('kernel'), Requirement('pid')]
+
+	def run(self):
+		return TreeGrid(['PID', 'Offset', 'Name', 'CreateTime'], self.rows, self.error)
+
+
+class PsList(Plugin):
+	rows = [[4, Hex(0x1f), "System", datetime(2024, 1, 2, 11, 0, tzinfo=timezone(timedelta(hours=1)))], [5, BaseAbsentValue(), "smss.exe", None]]
+
+
+class NetScan(Plugin):
+	rows = [[10 ** 16, Hex(255), b'\x7f\x00\x00\x01', True]]
+	error = ValueError("page not present")
+
+
+FOUND = {'kernel': 0}
+
+
+def construct_plugin(context, automagics, plugin_class, base_path, progress, open_method):
+	config_path = path_join(base_path, plugin_class.__name__)
+	kernel = path_join(config_path, 'kernel')
+	if context.config.get(kernel) is None:
+		FOUND['kernel'] += 1
+		context.config[kernel] = "kernel"
+		context.config[path_join(kernel, 'layer_name')] = "layer"
+		context.config[path_join(kernel, 'symbol_table_name')] = "symbols"
+	return plugin_class(context.config, config_path)
+
+
+@pytest.fixture
+def vol_library(monkeypatch):
+	FOUND['kernel'] = 0
+	requirements = types.SimpleNamespace(ModuleRequirement=ModuleRequirement, TranslationLayerRequirement=TranslationLayerRequirement,
+		SymbolTableRequirement=SymbolTableRequirement)
+	interfaces = types.SimpleNamespace(renderers=types.SimpleNamespace(BaseAbsentValue=BaseAbsentValue), configuration=types.SimpleNamespace(path_join=path_join))
+	framework = types.ModuleType('volatility3.framework')
+	framework.require_interface_version = lambda *version: None
+	framework.import_files = lambda package, ignore_errors: None
+	framework.list_plugins = lambda: {'windows.pslist.PsList': PsList, 'windows.netscan.NetScan': NetScan}
+	framework.automagic = types.SimpleNamespace(available=lambda context: ['stacker'], choose_automagic=lambda automagics, plugin_class: automagics)
+	framework.constants = types.SimpleNamespace(PACKAGE_VERSION="2.7.0")
+	framework.contexts = types.SimpleNamespace(Context=lambda: types.SimpleNamespace(config=Config()))
+	framework.interfaces = interfaces
+	framework.plugins = types.SimpleNamespace(construct_plugin=construct_plugin)
+	volatility3 = types.ModuleType('volatility3')
+	volatility3.framework = framework
+	volatility3.plugins = types.ModuleType('volatility3.plugins')
+	modules = {
+		'volatility3': volatility3,
+		'volatility3.plugins': volatility3.plugins,
+		'volatility3.framework': framework,
+		'volatility3.framework.configuration': types.SimpleNamespace(requirements=requirements),
+		'volatility3.framework.configuration.requirements': requirements,
+		'volatility3.framework.renderers': types.SimpleNamespace(format_hints=types.SimpleNamespace(Hex=Hex)),
+	}
+	for name, module in modules.items():
+		monkeypatch.setitem(sys.modules, name, module)
+	monkeypatch.delitem(sys.modules, 'vol_library', raising=False)
+	module = importlib.import_module('vol_library')
+	yield module
+	sys.modules.pop('vol_library', None)
+
+
+def test_plugin_values(vol_library):
+	assert vol_library.plugin_value(None) is None
+	assert vol_library.plugin_value(BaseAbsentValue()) is None
+	assert vol_library.plugin_value(Hex(31)) == "0x1f"
+	assert vol_library.plugin_value(True) == "True"
+	assert vol_library.plugin_value(12) == 12
+	assert vol_library.plugin_value(10 ** 15) == "1000000000000000"
+	assert vol_library.plugin_value(datetime(2024, 1, 2, 11, 0, tzinfo=timezone(timedelta(hours=1)))) == datetime(2024, 1, 2, 10, 0)
+	assert vol_library.plugin_value(b'\x01\xff') == "01ff"
+	assert vol_library.plugin_value(1.5) == 1.5
+	assert vol_library.plugin_value(["a"]) == "['a']"
+
+
+# The kernel is found by the first plugin only, the next ones get it from the shared configuration
+def test_plugins_share_the_kernel(vol_library, tmp_path):
+	dump = tmp_path / "memory.raw"
+	dump.write_bytes(b'')
+	engine = vol_library.open_engine(str(dump))
+	assert engine['context'].config['automagic.LayerStacker.single_location'] == dump.resolve().as_uri()
+
+	columns, rows, error = vol_library.run_plugin(engine, 'windows.pslist.PsList')
+	assert columns == ['PID', 'Offset', 'Name', 'CreateTime']
+	assert [list(row) for row in rows] == [[4, "0x1f", "System", datetime(2024, 1, 2, 10, 0)], [5, None, "smss.exe", None]]
+	assert error is None
+
+	columns, rows, error = vol_library.run_plugin(engine, 'windows.netscan.NetScan')
+	assert FOUND['kernel'] == 1
+	config = engine['context'].config
+	assert config['plugins.NetScan.kernel'] == "kernel"
+	assert config['plugins.NetScan.kernel.layer_name'] == "layer"
+	assert 'pid' not in engine['shared']
+	# Rows read before the error are kept
+	assert [list(row) for row in rows] == [["10000000000000000", "0xff", "7f000001", "True"]]
+	assert isinstance(error, ValueError)
@@ -0,0 +1,122 @@
+'''
+Timestamp normalisation shared by win_dissect and volxlsx.
+
+Timestamp columns of known tools are converted once, when they are read, to UTC epoch microseconds. Each tool has an explicit
+format, parsed by slicing the string. A value it does not match goes through the other known formats, and the one that works
+becomes the format tried first for the next values of the column.
+
+https://github.com/Martendal/DFIR-tools
+'''
+
+import re
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+
+TIMESTAMP = re.compile(r'\s*(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?\s*(Z|UTC|[+-]\d{2}:?\d{2})?\s*$')
+
+
+# Parses "YYYY-MM-DD hh:mm:ss[.fraction][Z|UTC|+hh:mm]" to a naive UTC datetime, None when the value is not a timestamp
+def parse_timestamp(value):
+	if isinstance(value, datetime):
+		return value
+	if not isinstance(value, str):
+		return None
+	match = TIMESTAMP.match(value)
+	if not match:
+		return None
+	year, month, day, hour, minute, second, fraction, zone = match.groups()
+	try:
+		result = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), int((fraction or '0')[:6].ljust(6, '0')))
+	except ValueError:
+		return None
+	if zone and zone not in ('Z', 'UTC'):
+		sign = 1 if zone[0] == '+' else -1
+		digits = zone[1:].replace(':', '')
+		offset = sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+		result = result - timedelta(seconds=offset)
+	return result
+
+
+def epoch_from_datetime(value):
+	if value.tzinfo is not None:
+		value = value.astimezone(timezone.utc).replace(tzinfo=None)
+	delta = value - EPOCH
+	return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def datetime_from_epoch(value):
+	return EPOCH + timedelta(microseconds=value)
+
+
+####### Formats ####
+# A format parses a string to epoch microseconds, or returns None. "days" caches the day number of the dates already seen in the
+# column, timestamps of a table mostly share a few days.
+
+def day_number(days, year, month, day):
+	key = (year, month, day)
+	number = days.get(key)
+	if number is None:
+		number = date(year, month, day).toordinal() - EPOCH_ORDINAL
+		days[key] = number
+	return number
+
+
+# "YYYY-MM-DD hh:mm:ss[.fffffff]" in UTC, what Eric Zimmerman's tools write by default (fractions are cut to microseconds)
+def ez_epoch(value, days):
+	if len(value) < 19 or value[4] != '-' or value[7] != '-' or value[13] != ':' or value[16] != ':' or value[10] not in ' T':
+		return None
+	fraction = 0
+	if len(value) > 19:
+		if value[19] != '.' or not value[20:].isdigit():
+			return None
+		fraction = int(value[20:26].ljust(6, '0'))
+	try:
+		seconds = day_number(days, int(value[0:4]), int(value[5:7]), int(value[8:10])) * 86400 + int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+	except ValueError:
+		return None
+	return seconds * 1000000 + fraction
+
+
+# ISO 8601 with an optional time zone, what Volatility 3 writes ("2023-01-01T10:00:00+00:00")
+def iso_epoch(value, days):
+	result = parse_timestamp(value)
+	return epoch_from_datetime(result) if result is not None else None
+
+
+# "MM/DD/YYYY hh:mm:ss[ AM|PM]", from tools following the US locale
+def us_epoch(value, days):
+	for layout in ('%m/%d/%Y %I:%M:%S %p', '%m/%d/%Y %H:%M:%S'):
+		try:
+			return epoch_from_datetime(datetime.strptime(value.strip(), layout))
+		except ValueError:
+			continue
+	return None
+
+
+TIMESTAMP_FORMATS = OrderedDict([('ez', ez_epoch), ('iso', iso_epoch), ('us', us_epoch)])
+
+
+# Returns a function converting the values of one column to epoch microseconds, starting with the given format. Values that are
+# not strings, or that no format matches, are returned unchanged.
+def timestamp_normaliser(format_name):
+	days = {}
+	current = [TIMESTAMP_FORMATS[format_name]]
+
+	def normalise(value):
+		if not isinstance(value, str):
+			return value
+		result = current[0](value, days)
+		if result is not None:
+			return result
+		for parser in TIMESTAMP_FORMATS.values():
+			if parser is not current[0]:
+				result = parser(value, days)
+				if result is not None:
+					current[0] = parser
+					return result
+		return value
+	return normalise
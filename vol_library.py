@@ -0,0 +1,100 @@
+'''
+In-process Volatility 3 engine for volxlsx ("-e library").
+
+The first plugin opens the dump, stacks its translation layers and finds the kernel. The following plugins are handed the same
+configuration, so they start right away instead of redoing it all in a new vol.exe process. TreeGrid rows are converted to
+columns directly, without going through the CSV renderer.
+
+https://github.com/Martendal/DFIR-tools
+'''
+
+from datetime import datetime, timezone
+from pathlib import Path
+import volatility3.plugins
+from volatility3 import framework
+from volatility3.framework import automagic, constants, contexts, interfaces, plugins
+from volatility3.framework.configuration import requirements
+from volatility3.framework.renderers import format_hints
+
+framework.require_interface_version(2, 0, 0)
+
+VERSION = constants.PACKAGE_VERSION
+
+# Requirements that are built once for the dump (kernel module, or layer and symbols for older plugins) and shared by all plugins
+SHARED_REQUIREMENTS = tuple(getattr(requirements, name) for name in ('ModuleRequirement', 'TranslationLayerRequirement', 'SymbolTableRequirement') if hasattr(requirements, name))
+
+# Same rule as volxlsx's CSV parsing: integers above 15 digits are kept as text, Excel would round them
+MAX_EXACT_INTEGER = 10 ** 15
+
+
+def open_engine(target):
+	framework.import_files(volatility3.plugins, True)
+	context = contexts.Context()
+	context.config['automagic.LayerStacker.single_location'] = Path(target).resolve().as_uri()
+	return {'context': context, 'automagics': automagic.available(context), 'plugins': framework.list_plugins(), 'shared': {}}
+
+
+# TreeGrid values as volxlsx writes them: missing values are None, Hex values and big integers are text, dates are naive UTC
+def plugin_value(value):
+	if value is None or isinstance(value, interfaces.renderers.BaseAbsentValue):
+		return None
+	if isinstance(value, format_hints.Hex):
+		return hex(value)
+	if isinstance(value, bool):
+		return str(value)
+	if isinstance(value, int):
+		return value if abs(value) < MAX_EXACT_INTEGER else str(value)
+	if isinstance(value, datetime):
+		return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+	if isinstance(value, (bytes, bytearray)):
+		return value.hex()
+	if isinstance(value, (float, str)):
+		return value
+	return str(value)
+
+
+# Gives a plugin the requirements already satisfied by the previous ones (store=False), or remembers its own (store=True)
+def share_requirements(engine, plugin_class, config_path, store):
+	config = engine['context'].config
+	for requirement in plugin_class.get_requirements():
+		if not isinstance(requirement, SHARED_REQUIREMENTS):
+			continue
+		path = interfaces.configuration.path_join(config_path, requirement.name)
+		if store:
+			if config.get(path) is not None:
+				engine['shared'][requirement.name] = (config.get(path), config.branch(path))
+		elif requirement.name in engine['shared']:
+			value, branch = engine['shared'][requirement.name]
+			config.splice(path, branch)
+			config[path] = value
+
+
+# Runs a plugin (full name, "windows.pslist.PsList") and returns (columns, rows, error). Rows produced before an error are kept.
+def run_plugin(engine, name):
+	context = engine['context']
+	plugin_class = engine['plugins'][name]
+	config_path = interfaces.configuration.path_join('plugins', plugin_class.__name__)
+	share_requirements(engine, plugin_class, config_path, False)
+	automagics = automagic.choose_automagic(engine['automagics'], plugin_class)
+	constructed = plugins.construct_plugin(context, automagics, plugin_class, 'plugins', None, None)
+	# Timeliner runs the other plugins itself
+	if hasattr(constructed, 'automagics'):
+		constructed.automagics = automagics
+	share_requirements(engine, plugin_class, config_path, True)
+
+	grid = constructed.run()
+	columns = [column.name for column in grid.columns]
+	data = [[] for column in columns]
+
+	def visit(node, accumulator):
+		values = [plugin_value(value) for value in node.values]
+		for column, value in zip(data, values):
+			column.append(value)
+		return accumulator
+
+	error = None
+	try:
+		grid.populate(visit, None)
+	except Exception as e:
+		error = e
+	return columns, zip(*data), error
@@ -1,205 +1,364 @@
 import os, sys
-import pandas as pd
-import subprocess
+import csv
+import re
 from pathlib import Path
 import argparse 
 import io
-
-
-# Creates a new sheet in the XLSX file with the content of a pandas dataframe
-def xlsx_preparer(df,writer,sheetname):
-
-	workbook = writer.book
-	####### Bookmarking colors #########
-	# Light red fill for "evidence"
-	format1 = workbook.add_format({'bg_color':   '#FFC7CE'})
-
-	# Light yellow fill for "of interest"
-	format2 = workbook.add_format({'bg_color':   '#FFEB9C'})
-
-	# Green fill for "bookmark"
-	format3 = workbook.add_format({'bg_color':   '#C6EFCE'})
-	####################################
-
-
-	(max_row, max_col) = df.shape
-	df.insert(0,'Tag',[None]*max_row)
-	df.to_excel(writer, sheet_name=sheetname, startrow=1, header=False, index=False)
-	worksheet = writer.sheets[sheetname]
-	column_settings = [{'header': column} for column in df.columns]
-	worksheet.add_table(0, 0, max_row, max_col, {'columns': column_settings})
-	worksheet.set_column(0, max_col, 17)
-	worksheet.data_validation(1,0,max_row,0, {'validate': 'list', 'source': ['Evidence', 'Of interest', 'Bookmark']})
-	worksheet.conditional_format(0,0,max_row,0, {'type':'text','criteria':'containing','value':'Evidence','format':format1})
-	worksheet.conditional_format(0,0,max_row,0, {'type':'text','criteria':'containing','value':'Of interest','format':format2})
-	worksheet.conditional_format(0,0,max_row,0, {'type':'text','criteria':'containing','value':'Bookmark','format':format3})
-
-
-# Runs the given volatility command and returns the csv output as a pandas dataframe
-def run_cmd_get_df(cmd):
-	try:
-		process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-		csv = io.StringIO()
-		for line in process.stdout:
-			csv.write(line.decode().strip('"\n') + '\n')
-		csv.seek(0)
-		df = pd.read_csv(csv, index_col=0)
-		csv.close()
-		return df
-	except Exception as e:
-		pass
-
-
-def pslist(target, writer):
-	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.pslist.PsList')
-		df = run_cmd_get_df(cmd)
-		df['CreateTime'] = pd.to_datetime(df['CreateTime'])
-		df['ExitTime'] = pd.to_datetime(df['ExitTime'])
-		xlsx_preparer(df,writer,'PsList')
-	except Exception as e:
-		pass
-
-
-def psscan(target, writer):
+import tempfile
+import time
+import gzip
+import hashlib
+import json
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from xlsx_stream import open_workbook, write_sheet, close_workbook
+from timestamps import timestamp_normaliser
+from metrics import open_metrics, close_metrics, record_metrics, metrics_scope, in_scope, measure_stage, metrics_summary
+from supervisor import run_tool, add_tool_arguments, configure_tools
+
+
+# Values pandas used to read as missing in Volatility's CSV output
+MISSING_VALUES = {'', 'N/A', 'n/a', 'NA', 'NULL', 'null', 'NaN', 'nan', 'None', '<NA>', '#N/A'}
+
+# Integers are written as numbers, up to the 15 digits Excel keeps exactly (offsets and addresses stay as text)
+INTEGER = re.compile(r'-?\d{1,15}$')
+
+
+def typed_value(value):
+	if value in MISSING_VALUES:
+		return None
+	if INTEGER.match(value):
+		return int(value)
+	return value
+
+
+# Parses Volatility's CSV output from a binary stream: returns the columns and a row iterator, the first (TreeDepth) column is left
+# out. Rows are parsed as they come, the whole output is never held in memory. Values of the "dates" columns become UTC epoch microseconds.
+def read_csv_rows(stream, dates=()):
+	# Command lines and handle names can be longer than the default limit of the csv module
+	csv.field_size_limit(2**31 - 1)
+	lines = (line.decode(errors='replace') for line in stream)
+	reader = csv.reader(lines)
+	header = next(reader, None)
+	if header is None:
+		return None, None
+	columns = header[1:]
+	converters = [(i, timestamp_normaliser('iso')) for i, column in enumerate(columns) if column in dates]
+
+	def rows():
+		for row in reader:
+			if row:
+				values = [typed_value(value) for value in row[1:]]
+				for position, normalise in converters:
+					if position < len(values):
+						values[position] = normalise(values[position])
+				yield values
+	return columns, rows()
+
+
+# Volatility plugins run for the report, in sheet order: (name, plugin, sheet name, date columns)
+PLUGINS = [
+	('pslist', 'windows.pslist.PsList', 'PsList', ['CreateTime', 'ExitTime']),
+	('psscan', 'windows.psscan.PsScan', 'PsScan', ['CreateTime', 'ExitTime']),
+	('netscan', 'windows.netscan.NetScan', 'NetScan', ['Created']),
+	('cmdline', 'windows.cmdline.CmdLine', 'CmdLine', []),
+	('getsids', 'windows.getsids.GetSIDs', 'GetSIDs', []),
+	('privs', 'windows.privileges.Privs', 'Privs', []),
+	('ssdt', 'windows.ssdt.SSDT', 'SSDT', []),
+	('mutantscan', 'windows.mutantscan.MutantScan', 'MutantScan', []),
+	('driverscan', 'windows.driverscan.DriverScan', 'DriverScan', []),
+	('driverirp', 'windows.driverirp.DriverIrp', 'DriverIrp', []),
+	('dlllist', 'windows.dlllist.DllList', 'DllList', ['LoadTime']),
+	('timeliner', 'timeliner.Timeliner', 'Timeline', ['Created Date', 'Modified Date', 'Accessed Date', 'Changed Date']),
+]
+
+
+def vol_command(target, plugin):
+	return ('vol.exe', '-f', target, '-q', '-r', 'csv', plugin)
+
+
+# Runs a plugin with its CSV output going to a temporary file, returns (output file, error or None, seconds). The vol.exe process is
+# recorded in the metrics, what it prints on stderr goes to its log (supervisor.py).
+def run_plugin(target, name, plugin):
+	print("Launching "+name)
+	spool = tempfile.TemporaryFile()
 	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.psscan.PsScan')
-		df = run_cmd_get_df(cmd)
-		df['CreateTime'] = pd.to_datetime(df['CreateTime'])
-		df['ExitTime'] = pd.to_datetime(df['ExitTime'])
-		xlsx_preparer(df,writer,'PsScan')
-	except Exception as e:
-		pass
-
-def netscan(target, writer):
+		with measure_stage('plugin', name) as values:
+			result = run_tool(vol_command(target, plugin), stdout=spool)
+			values.update(exit_code=result.code, bytes_out=os.fstat(spool.fileno()).st_size)
+	except BaseException:
+		spool.close()
+		raise
+	error = None
+	if result.killed:
+		error = "killed ("+result.killed+") after "+str(result.attempts)+" runs, see "+result.log
+	elif result.code:
+		error = "exit code "+str(result.code)+", see "+result.log
+	return spool, error, result.seconds
+
+
+####### Plugin result cache ####
+# Parsed plugin outputs are kept on disk, keyed by the dump fingerprint, the plugin and the Volatility version, so a re-run only
+# executes the plugins that are missing. Entries are gzip files holding pickled blocks of columns, the least recently used ones
+# are removed when the cache grows past its size limit.
+
+CACHE_FORMAT = 2
+CACHE_BLOCK_ROWS = 10000
+CACHE_SUFFIX = ".volcache"
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.join(str(Path.home()), '.cache'), 'volxlsx')
+DEFAULT_CACHE_MB = 2048
+
+# Dumps are tens of GB: the fingerprint hashes the size and DUMP_SAMPLES evenly spaced blocks (first and last included)
+DUMP_SAMPLES = 64
+DUMP_SAMPLE_BYTES = 1024 * 1024
+
+VOL_VERSION = re.compile(r'Volatility 3 Framework\s+(\S+)')
+
+
+def dump_fingerprint(target):
+	size = os.path.getsize(target)
+	digest = hashlib.sha1(str(size).encode())
+	with open(target, 'rb') as dump:
+		if size <= DUMP_SAMPLES * DUMP_SAMPLE_BYTES:
+			for block in iter(lambda: dump.read(DUMP_SAMPLE_BYTES), b''):
+				digest.update(block)
+		else:
+			step = (size - DUMP_SAMPLE_BYTES) // (DUMP_SAMPLES - 1)
+			for i in range(DUMP_SAMPLES):
+				dump.seek(i * step)
+				digest.update(dump.read(DUMP_SAMPLE_BYTES))
+	return str(size)+"-"+digest.hexdigest()
+
+
+# Volatility prints its version in the banner of the help message (on stdout, or with the messages in its log)
+def vol_version():
+	with tempfile.TemporaryFile() as output:
+		try:
+			result = run_tool(('vol.exe', '-h'), stdout=output)
+		except OSError:
+			return "unknown"
+		output.seek(0)
+		match = VOL_VERSION.search(output.read().decode(errors='replace'))
+	if match is None and not result.killed:
+		with open(result.log, 'rb') as log:
+			match = VOL_VERSION.search(log.read().decode(errors='replace'))
+	return match.group(1) if match else "unknown"
+
+
+# Results of the two engines are cached apart, their version is the Volatility version prefixed by the engine name
+def open_cache(cache_dir, size_mb, target, version):
+	os.makedirs(cache_dir, exist_ok=True)
+	print("Fingerprinting the dump for the plugin cache")
+	return {'dir': cache_dir, 'limit': size_mb * 1024 * 1024, 'dump': dump_fingerprint(target), 'version': version}
+
+
+def cache_path(cache, plugin):
+	key = json.dumps([CACHE_FORMAT, cache['dump'], plugin, cache['version']])
+	return os.path.join(cache['dir'], hashlib.sha1(key.encode()).hexdigest()+CACHE_SUFFIX)
+
+
+# Returns (columns, row iterator) of a cache entry, or None when there is no usable entry. A hit makes the entry the most recently used.
+def read_cache(path):
 	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.netscan.NetScan')
-		df = run_cmd_get_df(cmd)
-		df['Created'] = pd.to_datetime(df['Created'])
-		xlsx_preparer(df,writer,'NetScan')
-	except Exception as e:
-		pass
-
-def cmdline(target, writer):
+		entry = gzip.open(path, 'rb')
+		header = pickle.load(entry)
+	except (OSError, EOFError, pickle.UnpicklingError):
+		return None
+	if header.get('format') != CACHE_FORMAT:
+		entry.close()
+		return None
+	os.utime(path)
+
+	def rows():
+		with entry:
+			while True:
+				try:
+					block = pickle.load(entry)
+				except EOFError:
+					return
+				yield from zip(*block)
+	return header['columns'], rows()
+
+
+# Passes the rows through while writing them to a temporary cache entry, kept by commit_cache once the plugin is known to be fine
+def cache_rows(path, plugin, columns, rows):
+	entry = gzip.open(path+".tmp", 'wb', compresslevel=6)
+	pickle.dump({'format': CACHE_FORMAT, 'plugin': plugin, 'columns': columns}, entry, pickle.HIGHEST_PROTOCOL)
+
+	def dump_block(block):
+		width = max(len(row) for row in block)
+		padded = [list(row) + [None] * (width - len(row)) for row in block]
+		pickle.dump([list(column) for column in zip(*padded)], entry, pickle.HIGHEST_PROTOCOL)
+
+	def rows_through():
+		block = []
+		for row in rows:
+			block.append(row)
+			yield row
+			if len(block) == CACHE_BLOCK_ROWS:
+				dump_block(block)
+				block = []
+		if block:
+			dump_block(block)
+		entry.close()
+	return rows_through(), entry
+
+
+def commit_cache(path, entry, keep):
+	entry.close()
+	if keep:
+		os.replace(path+".tmp", path)
+	elif os.path.exists(path+".tmp"):
+		os.remove(path+".tmp")
+
+
+# Least recently used entries go first, until the cache fits in its size limit
+def evict_cache(cache):
+	entries = []
+	for name in os.listdir(cache['dir']):
+		if name.endswith(CACHE_SUFFIX):
+			stat = os.stat(os.path.join(cache['dir'], name))
+			entries.append((stat.st_mtime, stat.st_size, name))
+	total = sum(size for mtime, size, name in entries)
+	for mtime, size, name in sorted(entries):
+		if total <= cache['limit']:
+			break
+		os.remove(os.path.join(cache['dir'], name))
+		total -= size
+		print("Plugin cache: evicted "+name)
+
+
+####### Report ####
+
+# Writes the sheet of a plugin and tells how it went. An error with some rows means Volatility crashed on the way.
+# Complete outputs are stored in the cache when a cache path is given.
+def write_plugin_sheet(writer, sheetname, dates, columns, rows, error, plugin, path=None):
+	entry = None
+	completed = False
+	if path is not None and columns is not None:
+		rows, entry = cache_rows(path, plugin, columns, rows)
 	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.cmdline.CmdLine')
-		df = run_cmd_get_df(cmd)
-		#df['CreateTime'] = pd.to_datetime(df['CreateTime'])
-		xlsx_preparer(df,writer,'CmdLine')
-	except Exception as e:
-		pass
-
-def getsids(target, writer):
+		written = write_sheet(writer, sheetname, columns, rows, dates) if columns is not None else 0
+		completed = True
+	finally:
+		# An output only read in part (the sheet failed on the way) is not complete
+		if entry is not None:
+			commit_cache(path, entry, completed and error is None)
+	if error and written:
+		return "partial ("+error+")", written
+	if error:
+		return "failed ("+error+")", written
+	if columns is None:
+		return "no output", written
+	return "ok", written
+
+
+# vol.exe engine: the plugins run in a pool of "jobs" processes. Yields (name, columns, rows, error, seconds) in the given order.
+def vol_results(target, plugins, jobs):
+	with ThreadPoolExecutor(max_workers=jobs) as pool:
+		run = in_scope(run_plugin)
+		futures = [(name, dates, pool.submit(run, target, name, plugin)) for name, plugin, dates in plugins]
+		for name, dates, future in futures:
+			try:
+				spool, error, seconds = future.result()
+			except Exception as e:
+				yield name, None, None, repr(e), 0.0
+				continue
+			with spool:
+				spool.seek(0)
+				columns, rows = read_csv_rows(spool, dates)
+				yield name, columns, rows, error, seconds
+
+
+# Library engine: the plugins run one after the other in this process, against a single Volatility context
+def library_results(target, plugins):
+	import vol_library
+	engine = vol_library.open_engine(target)
+	for name, plugin, dates in plugins:
+		print("Launching "+name)
+		start = time.perf_counter()
+		try:
+			with measure_stage('plugin', name):
+				columns, rows, error = vol_library.run_plugin(engine, plugin)
+		except Exception as e:
+			yield name, None, None, repr(e), time.perf_counter() - start
+			continue
+		yield name, columns, rows, (repr(error) if error else None), time.perf_counter() - start
+
+
+# Plugins missing from the cache run with the chosen engine, while this thread writes the sheets to the workbook in PLUGINS order
+def create_xlsx_report(target, output, jobs=1, cache=None, engine="vol"):
+	writer = open_workbook(output)
+	summary = []
+	results = None
 	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.getsids.GetSIDs')
-		df = run_cmd_get_df(cmd)
-		xlsx_preparer(df,writer,'GetSIDs')
-	except Exception as e:
-		pass
+		cached = {}
+		if cache is not None:
+			for name, plugin, sheetname, dates in PLUGINS:
+				result = read_cache(cache_path(cache, plugin))
+				if result is not None:
+					cached[name] = result
+		pending = [(name, plugin, dates) for name, plugin, sheetname, dates in PLUGINS if name not in cached]
+		results = library_results(target, pending) if engine == "library" else vol_results(target, pending, jobs)
+		for name, plugin, sheetname, dates in PLUGINS:
+			if name in cached:
+				start = time.perf_counter()
+				columns, rows = cached[name]
+				try:
+					status, rows = "cached", write_sheet(writer, sheetname, columns, rows, dates)
+				except Exception as e:
+					status, rows = "failed ("+repr(e)+")", 0
+				seconds = time.perf_counter() - start
+			else:
+				name, columns, rows, error, seconds = next(results)
+				path = cache_path(cache, plugin) if cache is not None else None
+				try:
+					status, rows = write_plugin_sheet(writer, sheetname, dates, columns, rows, error, plugin, path)
+				except Exception as e:
+					status, rows = "failed ("+repr(e)+")", 0
+			summary.append((name, status, rows, seconds))
+			record_metrics('sheet', name, {'rows': rows, 'status': status, 'seconds': round(seconds, 3)})
+			print(name+": "+status+", "+str(rows)+" rows, "+"%.1f" % seconds+"s")
+	finally:
+		if results is not None:
+			results.close()
+		close_workbook(writer)
+	if cache is not None:
+		evict_cache(cache)
+
+	print("Summary:")
+	for name, status, rows, seconds in summary:
+		print("\t"+name.ljust(12)+("%.1f" % seconds+"s").rjust(10)+str(rows).rjust(10)+" rows  "+status)
+	return summary
+
+
+def positive_int(string):
+	value = int(string)
+	if value < 1:
+		raise argparse.ArgumentTypeError(string+" is not a positive integer")
+	return value
 
-def privs(target, writer):
-	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.privileges.Privs')
-		df = run_cmd_get_df(cmd)
-		xlsx_preparer(df,writer,'Privs')
-	except Exception as e:
-		pass
-
-def ssdt(target, writer):
-	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.ssdt.SSDT')
-		df = run_cmd_get_df(cmd)
-		xlsx_preparer(df,writer,'SSDT')
-	except Exception as e:
-		pass
-
-def mutantscan(target, writer):
-	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.mutantscan.MutantScan')
-		df = run_cmd_get_df(cmd)
-		xlsx_preparer(df,writer,'MutantScan')
-	except Exception as e:
-		pass
-
-def driverscan(target, writer):
-	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.driverscan.DriverScan')
-		df = run_cmd_get_df(cmd)
-		xlsx_preparer(df,writer,'DriverScan')
-	except Exception as e:
-		pass
-
-def driverirp(target, writer):
-	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.driverirp.DriverIrp')
-		df = run_cmd_get_df(cmd)
-		xlsx_preparer(df,writer,'DriverIrp')
-	except Exception as e:
-		pass
-
-def dlllist(target, writer):
-	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'windows.dlllist.DllList')
-		df = run_cmd_get_df(cmd)
-		df['LoadTime'] = pd.to_datetime(df['LoadTime'])
-		xlsx_preparer(df,writer,'DllList')
-	except Exception as e:
-		pass
-
-def timeliner(target, writer):
-	try:
-		cmd = ('vol.exe', '-f', target, '-q', '-r', 'csv', 'timeliner.Timeliner')
-		df = run_cmd_get_df(cmd)
-		df['Created Date'] = pd.to_datetime(df['Created Date'])
-		df['Modified Date'] = pd.to_datetime(df['Modified Date'])
-		df['Accessed Date'] = pd.to_datetime(df['Accessed Date'])
-		df['Changed Date'] = pd.to_datetime(df['Changed Date'])
-		xlsx_preparer(df,writer,'Timeline')
-	except Exception as e:
-		pass
-
-
-def create_xlsx_report(target, output):
-
-	with pd.ExcelWriter(output, engine="xlsxwriter") as writer:  
-		
-		print("Launching pslist")
-		pslist(target, writer)
-		print("Launching psscan")
-		psscan(target, writer)
-		print("Launching netscan")
-		netscan(target, writer)
-		print("Launching cmdline")
-		cmdline(target, writer)
-		print("Launching getsids")
-		getsids(target, writer)
-		print("Launching privs")
-		privs(target, writer)
-		print("Launching ssdt")
-		ssdt(target, writer)
-		print("Launching mutantscan")
-		mutantscan(target, writer)
-		print("Launching driverscan")
-		driverscan(target, writer)
-		print("Launching driverirp")
-		driverirp(target, writer)
-		print("Launching dlllist")
-		dlllist(target, writer)
-		print("Launching timeliner")
-		timeliner(target,writer)
-		
 
 def main():
 	parser = argparse.ArgumentParser(description="VolXLSX by Martendal.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 	parser.add_argument("-t", "--target", required=True, help="Absolute path of the target memory dump.")
 	parser.add_argument("-o", "--output", required=True, help="Absolute path of desired output report.")
-
+	parser.add_argument("-j", "--jobs", required=False, help="Number of Volatility plugins running at the same time (memory dumps are I/O heavy, keep it low on slow disks).", default=2, type=positive_int)
+	parser.add_argument("-e", "--engine", required=False, help="vol: run each plugin in its own vol.exe process. library: run the plugins in this process with the volatility3 package, the dump is only opened and its kernel only found once (-j is ignored).", default="vol", choices=["vol", "library"])
+	parser.add_argument("--cache-dir", required=False, help="Folder of the plugin result cache.", default=DEFAULT_CACHE_DIR)
+	parser.add_argument("--cache-size", required=False, help="Size limit of the plugin result cache in MB, least recently used results are removed past it.", default=DEFAULT_CACHE_MB, type=positive_int)
+	parser.add_argument("--no-cache", required=False, help="Run every plugin and leave the cache untouched.", action="store_true")
+	parser.add_argument("-P", "--profile", required=False, help="Profile the report with cProfile ([report]_profile folder next to the report).", action="store_true")
+
+	add_tool_arguments(parser)
 	args = parser.parse_args()
 	config = vars(args)
 	print(config)
 
 	target = config['target']
 	output = config['output']
+	jobs = config['jobs']
+	engine = config['engine']
 
 	print("Launching VolXLSX")
 	
@@ -212,7 +371,33 @@ def main():
 		print("The dump file exists, proceeding...")
 		if(not output.endswith(".xlsx")):
 			output = output+".xlsx"
-		create_xlsx_report(target, output)
+		try:
+			import xlsxwriter
+		except ImportError:
+			print("The report needs the xlsxwriter package (pip install xlsxwriter).")
+			quit()
+		if engine == "library":
+			try:
+				import vol_library
+			except ImportError as e:
+				print("The library engine needs the volatility3 package ("+str(e)+").")
+				quit()
+		# Metrics of each run are appended next to the report, the logs of the vol.exe processes go to [report]_tools
+		configure_tools(config, os.path.basename(output[:-len(".xlsx")])+"_tools")
+		open_metrics(output[:-len(".xlsx")]+"_metrics.jsonl")
+		try:
+			with metrics_scope(os.path.dirname(os.path.abspath(output)), output[:-len(".xlsx")]+"_profile" if config['profile'] else None):
+				cache = None
+				if not config['no_cache']:
+					version = "library-"+vol_library.VERSION if engine == "library" else "vol-"+vol_version()
+					cache = open_cache(config['cache_dir'], config['cache_size'], target, version)
+				with measure_stage('report', 'report', profile=True) as values:
+					summary = create_xlsx_report(target, output, jobs, cache, engine)
+					values.update(rows=sum(rows for name, status, rows, seconds in summary), bytes_in=os.path.getsize(target), bytes_out=os.path.getsize(output))
+		finally:
+			for line in metrics_summary():
+				print(line)
+			close_metrics()
 
 
 
@@ -14,46 +14,144 @@ https://github.com/Martendal/DFIR-tools
 
 
 import os, sys
-import pandas as pd
+import csv
+import io
+import multiprocessing
+import ntpath
+import fnmatch
+import heapq
+import re
+import json
+import hashlib
+import pickle
+import shutil
+import tempfile
 import sqlite3
 import subprocess
 from pathlib import Path
 import argparse 
 import logging
+import time
+import threading
+from contextlib import contextmanager
+from collections import namedtuple, OrderedDict
+from itertools import islice, accumulate
+from bisect import bisect_right
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from xlsx_stream import open_workbook, write_sheet, close_workbook
+from timestamps import timestamp_normaliser, datetime_from_epoch, parse_timestamp
+from metrics import open_metrics, close_metrics, record_metrics, metrics_scope, in_scope, measure_stage, profiled, metrics_summary
+from supervisor import run_tool, add_tool_arguments, configure_tools
 
 
-logging.basicConfig(filename="windissect_log.log", format='%(asctime)s %(message)s', filemode='w')
 Logger = logging.getLogger()
 Logger.setLevel(logging.DEBUG)
 
 #EVTX
-def evtx_to_csv(evtx_folder, output):
-	Logger.info("Converting EVTX to CSV.")
+# Name of the CSV holding all events. It is only split on disk, in the database "global.csv" is a view over the per-log tables
+EVTX_GLOBAL_CSV = "global.csv"
+
+# Maximum number of per-log CSV files kept open at the same time while splitting
+EVTX_SPLIT_MAX_OPEN = 128
+
+# Creates the EVTX output folder, or empties it of the CSV files of a previous run: logs that are gone, or a global.csv left by
+# another engine, would otherwise be loaded again with the new ones
+def evtx_output_folder(output):
 	path = output+"\\EVTX"
 	try:
 		os.mkdir(path)
 	except FileExistsError:
-		Logger.info("Output folder already exists, results will be overwritten.")
-	for filename in os.listdir(evtx_folder):
-		Logger.info("Converting "+filename+" to CSV.")
-		subprocess.call(['Utils\\EvtxECmd\\EvtxECmd.exe', '-f', evtx_folder+"\\"+filename, '--csv', path, '--csvf', path+"\\"+filename+".csv"])
+		Logger.info("Output folder already exists, removing the CSV files of the previous run.")
+		for name in os.listdir(path):
+			if name.lower().endswith('.csv'):
+				os.remove(os.path.join(path, name))
+	return path
+
+
+def evtx_to_csv(evtx_folder, output):
 	Logger.info("Converting all EVTX to a single CSV file.")
-	subprocess.call(['Utils\\EvtxECmd\\EvtxECmd.exe', '-d', evtx_folder, '--csv', path, '--csvf', path+"\\"+"global.csv"])
+	path = evtx_output_folder(output)
+	code = run_tool(['Utils\\EvtxECmd\\EvtxECmd.exe', '-d', evtx_folder, '--csv', path, '--csvf', path+"\\"+EVTX_GLOBAL_CSV]).code
+	Logger.info("Splitting "+EVTX_GLOBAL_CSV+" into one CSV file per log.")
+	split_evtx_csv(path+"\\"+EVTX_GLOBAL_CSV, path)
+	return code
+
+
+# Streams the EvtxECmd CSV of a whole folder and writes each event to [log name].evtx.csv, as a per-file EvtxECmd run would
+def split_evtx_csv(global_csv, path):
+	csv.field_size_limit(2**31 - 1)
+	writers = OrderedDict()
+	created = set()
+	counts = {}
+	with open(global_csv, 'r', newline='', encoding='utf-8-sig', errors='replace') as source:
+		reader = csv.reader(source)
+		header = next(reader, None)
+		if header is None:
+			return counts
+		if 'SourceFile' in header:
+			key_column = header.index('SourceFile')
+		else:
+			key_column = header.index('Channel')
+		try:
+			for row in reader:
+				if key_column < len(row) and row[key_column]:
+					filename = ntpath.basename(row[key_column])
+					if not filename.lower().endswith('.evtx'):
+						filename = filename.replace('/', '%4')+'.evtx'
+				else:
+					filename = 'Unknown.evtx'
+				entry = writers.get(filename)
+				if entry is None:
+					if len(writers) >= EVTX_SPLIT_MAX_OPEN:
+						writers.popitem(last=False)[1][0].close()
+					handle = open(os.path.join(path, filename+'.csv'), 'a' if filename in created else 'w', newline='', encoding='utf-8')
+					entry = (handle, csv.writer(handle))
+					if filename not in created:
+						entry[1].writerow(header)
+						created.add(filename)
+					writers[filename] = entry
+				else:
+					writers.move_to_end(filename)
+				entry[1].writerow(row)
+				counts[filename] = counts.get(filename, 0) + 1
+		finally:
+			for handle, writer in writers.values():
+				handle.close()
+	for filename, count in counts.items():
+		Logger.info(filename+".csv: "+str(count)+" events.")
+	return counts
 
 #EVTX
 def evtx_to_csv_partial(evtx_folder, output):
 	Logger.info("Converting Security, System and Application EVTX to CSV.")
-	path = output+"\\EVTX"
-	try:
-		os.mkdir(path)
-	except FileExistsError:
-		Logger.info("Output folder already exists, results will be overwritten.")
+	path = evtx_output_folder(output)
 
-	subprocess.call(['Utils\\EvtxECmd\\EvtxECmd.exe', '-f', evtx_folder+"\\Security.evtx", '--csv', path, '--csvf', path+"\\"+"Security.evtx.csv"])
-	subprocess.call(['Utils\\EvtxECmd\\EvtxECmd.exe', '-f', evtx_folder+"\\System.evtx", '--csv', path, '--csvf', path+"\\"+"System.evtx.csv"])
-	subprocess.call(['Utils\\EvtxECmd\\EvtxECmd.exe', '-f', evtx_folder+"\\Application.evtx", '--csv', path, '--csvf', path+"\\"+"Application.evtx.csv"])
+	codes = [run_tool(['Utils\\EvtxECmd\\EvtxECmd.exe', '-f', evtx_folder+"\\"+log, '--csv', path, '--csvf', path+"\\"+log+".csv"]).code for log in ("Security.evtx", "System.evtx", "Application.evtx")]
+	return next((code for code in codes if code), 0)
 #TODO: complete with other needed logs
 
+#EVTX
+# Parses the logs without EvtxECmd (see evtx_native.py), chunks are spread over all the CPUs. Writes the same per-log CSV files.
+def evtx_to_csv_native(evtx_folder, output):
+	import evtx_native
+	Logger.info("Converting all EVTX to CSV files with the native parser.")
+	path = evtx_output_folder(output)
+	evtx_native.convert_folder(evtx_folder, path, os.cpu_count(), Logger)
+	# Report events the native engine has no map for only get generic "Name: value" PayloadData columns
+	for sheet in REPORT_SHEETS:
+		unmapped = []
+		for source in sheet['sources']:
+			if fnmatch.fnmatchcase(source['table'], '*.evtx.csv'):
+				channel = source['table'][:-len('.evtx.csv')].replace('%4', '/')
+				events = [str(event) for event in source.get('events', []) if not evtx_native.has_event_map(channel, event)]
+				if events:
+					unmapped.append(channel+" "+", ".join(events))
+		if unmapped:
+			Logger.info("Native EVTX engine: the \""+sheet['sheet']+"\" sheet has no MapDescription, UserName, RemoteHost or ExecutableInfo for "+"; ".join(unmapped)+
+				" (use the EvtxECmd engine for them).")
+	return 0
+
 
 #Prefetch
 def prefetch_to_csv(prefetch_folder, output):
@@ -63,7 +161,7 @@ def prefetch_to_csv(prefetch_folder, output):
 		os.mkdir(path)
 	except FileExistsError:
 		Logger.info("Output folder already exists, results will be overwritten.")
-	subprocess.call(['Utils\\PECmd.exe', '-d', prefetch_folder, '--csv', path, '--csvf', 'prefetch.csv', '-q'])
+	return run_tool(['Utils\\PECmd.exe', '-d', prefetch_folder, '--csv', path, '--csvf', 'prefetch.csv', '-q']).code
 
 #Amcache
 def amcache_to_csv(amcache_folder, output):
@@ -73,9 +171,9 @@ def amcache_to_csv(amcache_folder, output):
 		os.mkdir(path)
 	except FileExistsError:
 		Logger.info("Output folder already exists, results will be overwritten.")
-	subprocess.call(['Utils\\AmcacheParser.exe', '-f', amcache_folder+"\\Amcache.hve", '--csv', path, '-i'])
-	for filename in os.listdir(path):
-		os.rename(os.path.join(path, filename), os.path.join(path, filename.replace(filename[0:15], '')))
+	code = run_tool(['Utils\\AmcacheParser.exe', '-f', amcache_folder+"\\Amcache.hve", '--csv', path, '-i']).code
+	strip_timestamp_prefix(path)
+	return code
 
 
 #AppCompatCache
@@ -86,7 +184,7 @@ def appcompatcache_to_csv(appcompatcache_folder, output):
 		os.mkdir(path)
 	except FileExistsError:
 		Logger.info("Output folder already exists, results will be overwritten.")
-	subprocess.call(['Utils\\AppCompatCacheParser.exe', '-f', appcompatcache_folder+"\\SYSTEM", '--csv', path, '--csvf', 'appcompatcache.csv'])
+	return run_tool(['Utils\\AppCompatCacheParser.exe', '-f', appcompatcache_folder+"\\SYSTEM", '--csv', path, '--csvf', 'appcompatcache.csv']).code
 
 
 #USNjournal
@@ -97,7 +195,7 @@ def usnjournal_to_csv(usnjournal_folder, output):
 		os.mkdir(path)
 	except FileExistsError:
 		Logger.info("Output folder already exists, results will be overwritten.")
-	subprocess.call(['Utils\\MFTEcmd.exe', '-f', usnjournal_folder+"\\$J", '--csv', path, '--csvf', 'USNjournal.csv'])
+	return run_tool(['Utils\\MFTEcmd.exe', '-f', usnjournal_folder+"\\$J", '--csv', path, '--csvf', 'USNjournal.csv']).code
 
 #LNK
 def lnk_to_csv(lnk_folder, output):
@@ -107,7 +205,7 @@ def lnk_to_csv(lnk_folder, output):
 		os.mkdir(path)
 	except FileExistsError:
 		Logger.info("Output folder already exists, results will be overwritten.")
-	subprocess.call(['Utils\\LECmd.exe', '-d', lnk_folder, '--csv', path, '--csvf', 'lnk.csv', '-q'])
+	return run_tool(['Utils\\LECmd.exe', '-d', lnk_folder, '--csv', path, '--csvf', 'lnk.csv', '-q']).code
 
 
 #RecycleBin
@@ -118,7 +216,7 @@ def recyclebin_to_csv(recyclebin_folder, output):
 		os.mkdir(path)
 	except FileExistsError:
 		Logger.info("Output folder already exists, results will be overwritten.")
-	subprocess.call(['Utils\\RBCmd.exe', '-d', recyclebin_folder, '--csv', path, '--csvf', 'RecycleBin.csv', '-q'])
+	return run_tool(['Utils\\RBCmd.exe', '-d', recyclebin_folder, '--csv', path, '--csvf', 'RecycleBin.csv', '-q']).code
 
 
 #SRUM
@@ -129,9 +227,9 @@ def srum_to_csv(srum_folder, output):
 		os.mkdir(path)
 	except FileExistsError:
 		Logger.info("Output folder already exists, results will be overwritten.")
-	subprocess.call(['Utils\\SrumECmd.exe', '-d', srum_folder, '--csv', path])
-	for filename in os.listdir(path):
-		os.rename(os.path.join(path, filename), os.path.join(path, filename.replace(filename[0:15], '')))
+	code = run_tool(['Utils\\SrumECmd.exe', '-d', srum_folder, '--csv', path]).code
+	strip_timestamp_prefix(path)
+	return code
 
 
 #Registries
@@ -142,7 +240,14 @@ def registries_to_csv(registries_folder, output):
 		os.mkdir(path)
 	except FileExistsError:
 		Logger.info("Output folder already exists, results will be overwritten.")
-	subprocess.call(['Utils\\RECmd\\RECmd.exe', '-d', registries_folder, '--csv', path, '--csvf', 'registry.csv', '--bn', 'Utils\\RECmd\\BatchExamples\\Kroll_Batch.reb'])
+	return run_tool(['Utils\\RECmd\\RECmd.exe', '-d', registries_folder, '--csv', path, '--csvf', 'registry.csv', '--bn', 'Utils\\RECmd\\BatchExamples\\Kroll_Batch.reb']).code
+
+
+#Remove the "YYYYMMDDhhmmss_" prefix some tools put in front of their CSV files (only once, so that re-runs keep the names intact)
+def strip_timestamp_prefix(path):
+	for filename in os.listdir(path):
+		if re.match(r'\d{14}_', filename):
+			os.replace(os.path.join(path, filename), os.path.join(path, filename[15:]))
 
 
 #Remove whitespaces in filenames
@@ -160,405 +265,2297 @@ def create_database(root, db_name):
 		subprocess.call(['Utils\\SQLite\\sqlite3.exe', root+'\\'+db_name, '--cmd', '.mode csv', '.separator ,',import_string.replace("\\","/")])
 
 
-def create_database_alt(root, db_path):
-
-	chunksize = 1000
-	
+#Case database schema
+# Known artefact tables are stored typed and indexed in a "[table]$data" table, with their most repetitive strings replaced by ids
+# of shared "lookup_[column]" tables. A view named after the CSV file joins everything back, so queries see the CSV columns.
+# Timestamp columns are parsed once while loading, with the explicit format of the tool (timestamp_format, see timestamps.py), and
+# stored as UTC epoch microseconds: datetime("TimeCreated" / 1000000, 'unixepoch') gives them back as text in SQL.
+# Tables with a partition column can be split by day of that column (--partition, see Day partitions), the column must be indexed.
+ArtefactSchema = namedtuple('ArtefactSchema', ['integers', 'timestamps', 'lookups', 'indexes', 'timestamp_format', 'partition'], defaults=['ez', None])
+
+EVTX_SCHEMA = ArtefactSchema(
+	integers=['RecordNumber', 'EventRecordId', 'EventId', 'ProcessId', 'ThreadId', 'ChunkNumber', 'ExtraDataOffset'],
+	timestamps=['TimeCreated'],
+	lookups=['Provider', 'Channel', 'Computer', 'MapDescription'],
+	indexes=['EventId', 'TimeCreated', 'Channel', 'Computer'],
+	partition='TimeCreated')
+
+ARTEFACT_SCHEMAS = [
+	# EvtxECmd
+	('*.evtx.csv', EVTX_SCHEMA),
+	# PECmd
+	('prefetch.csv', ArtefactSchema(
+		integers=['Size', 'RunCount'],
+		timestamps=['SourceCreated', 'SourceModified', 'SourceAccessed', 'LastRun', 'PreviousRun0', 'PreviousRun1', 'PreviousRun2', 'PreviousRun3', 'PreviousRun4', 'PreviousRun5', 'PreviousRun6', 'Volume0Created', 'Volume1Created'],
+		lookups=[],
+		indexes=['ExecutableName', 'LastRun'])),
+	('prefetch_Timeline.csv', ArtefactSchema(integers=[], timestamps=['RunTime'], lookups=[], indexes=['RunTime'])),
+	# AmcacheParser
+	('Amcache_*.csv', ArtefactSchema(
+		integers=['Size', 'FileSize', 'BinFileVersion', 'Usn'],
+		timestamps=['FileKeyLastWriteTimestamp', 'LinkDate', 'KeyLastWriteTimestamp', 'InstallDate', 'InstallDateArpLastModified', 'InstallDateMsi', 'InstallDateFromLinkFile', 'DriverTimeStamp', 'DriverLastWriteTime'],
+		lookups=['ProgramName', 'Publisher'],
+		indexes=['FileKeyLastWriteTimestamp', 'SHA1'])),
+	# AppCompatCacheParser
+	('appcompatcache.csv', ArtefactSchema(integers=['CacheEntryPosition', 'ControlSet'], timestamps=['LastModifiedTimeUTC'], lookups=[], indexes=['LastModifiedTimeUTC'])),
+	# MFTECmd ($J)
+	('USNjournal.csv', ArtefactSchema(
+		integers=['EntryNumber', 'SequenceNumber', 'ParentEntryNumber', 'ParentSequenceNumber', 'UpdateSequenceNumber', 'OffsetToData'],
+		timestamps=['UpdateTimestamp'],
+		lookups=['Extension', 'UpdateReasons', 'FileAttributes', 'SourceFile'],
+		indexes=['UpdateTimestamp'],
+		partition='UpdateTimestamp')),
+	# RECmd
+	('registry.csv', ArtefactSchema(
+		integers=[],
+		timestamps=['LastWriteTimestamp'],
+		lookups=['HivePath', 'HiveType', 'Description', 'Category', 'ValueType', 'PluginDetailFile'],
+		indexes=['Category', 'LastWriteTimestamp'])),
+	# SrumECmd
+	('SrumECmd_*.csv', ArtefactSchema(
+		integers=['Id', 'AppId', 'UserId', 'BytesReceived', 'BytesSent', 'InterfaceLuid', 'L2ProfileId', 'L2ProfileFlags', 'ForegroundBytesRead', 'ForegroundBytesWritten', 'ForegroundCycleTime', 'BackgroundBytesRead', 'BackgroundBytesWritten', 'BackgroundCycleTime'],
+		timestamps=['Timestamp', 'ConnectStartTime'],
+		lookups=['ExeInfo', 'ExeInfoDescription', 'SidType', 'Sid', 'UserName', 'InterfaceType'],
+		indexes=['Timestamp'])),
+	# LECmd
+	('lnk.csv', ArtefactSchema(
+		integers=['FileSize', 'HeaderFlags'],
+		timestamps=['SourceCreated', 'SourceModified', 'SourceAccessed', 'TargetCreated', 'TargetModified', 'TargetAccessed', 'TrackerCreatedOn'],
+		lookups=['DriveType', 'VolumeSerialNumber', 'VolumeLabel', 'MachineID', 'MachineMACAddress'],
+		indexes=['SourceModified', 'TargetModified'])),
+	# RBCmd
+	('RecycleBin.csv', ArtefactSchema(integers=['FileSize'], timestamps=['DeletedOn'], lookups=['FileType'], indexes=['DeletedOn'])),
+]
+
+STORE_SUFFIX = "$data"
+
+
+def artefact_schema(table_name):
+	for pattern, schema in ARTEFACT_SCHEMAS:
+		if fnmatch.fnmatchcase(table_name, pattern):
+			return schema
+	return None
+
+
+def column_type(schema, column):
+	if column in schema.integers or column in schema.lookups or column in schema.timestamps:
+		return "INTEGER"
+	return "TEXT"
+
+
+def drop_relation(con, name):
+	row = con.execute("SELECT type FROM sqlite_master WHERE name=? AND type IN ('table', 'view')", (name,)).fetchone()
+	if row:
+		con.execute("DROP "+row[0].upper()+" "+quote_identifier(name))
+
+
+# Creates the lookup table of a column if needed, and caches its content (value -> id). Id 0 stands for NULL so views can use inner joins.
+def open_lookup(con, lookups, column):
+	if column not in lookups:
+		table = quote_identifier("lookup_"+column)
+		con.execute("CREATE TABLE IF NOT EXISTS "+table+" (id INTEGER PRIMARY KEY, value TEXT UNIQUE)")
+		# LIKE is case insensitive, it can only use an index built with NOCASE
+		con.execute("CREATE INDEX IF NOT EXISTS "+quote_identifier("lookup_"+column+"_nocase")+" ON "+table+" (value COLLATE NOCASE)")
+		con.execute("INSERT OR IGNORE INTO "+table+" VALUES (0, NULL)")
+		lookups[column] = dict(con.execute("SELECT value, id FROM "+table+" WHERE id > 0"))
+	return lookups[column]
+
+
+def encode_lookups(con, records, positions, lookups):
+	for record in records:
+		record = list(record)
+		for position, column in positions:
+			value = record[position]
+			if value is None:
+				record[position] = 0
+				continue
+			values = lookups[column]
+			found = values.get(value)
+			if found is None:
+				found = len(values) + 1
+				con.execute("INSERT INTO "+quote_identifier("lookup_"+column)+" VALUES (?, ?)", (found, value))
+				values[value] = found
+			record[position] = found
+		yield record
+
+
+def create_store(con, store, columns, schema):
+	con.execute("CREATE TABLE "+quote_identifier(store)+" (\"index\" INTEGER PRIMARY KEY, "+", ".join(quote_identifier(c)+" "+column_type(schema, c) for c in columns)+")")
+
+
+def create_artefact_table(con, table_name, columns, schema):
+	create_store(con, table_name+STORE_SUFFIX, columns, schema)
+
+
+def create_store_indexes(con, store, columns, schema):
+	for column in schema.indexes:
+		if column in columns:
+			con.execute("CREATE INDEX "+quote_identifier("idx_"+store+"_"+column)+" ON "+quote_identifier(store)+" ("+quote_identifier(column)+")")
+
+
+# SELECT giving the CSV columns of a store, lookup ids replaced by their values
+def store_view_select(store, columns, schema):
+	selected = ['d."index"']
+	joins = []
+	for column in columns:
+		if column in schema.lookups:
+			alias = "l"+str(len(joins))
+			joins.append("JOIN "+quote_identifier("lookup_"+column)+" "+alias+" ON "+alias+".id = d."+quote_identifier(column))
+			selected.append(alias+".value AS "+quote_identifier(column))
+		else:
+			selected.append("d."+quote_identifier(column))
+	return "SELECT "+", ".join(selected)+" FROM "+quote_identifier(store)+" d "+" ".join(joins)
+
+
+# Indexes are built once the rows are in, which is much faster than maintaining them during the inserts
+def finish_artefact_table(con, table_name, columns, schema):
+	store = table_name+STORE_SUFFIX
+	create_store_indexes(con, store, columns, schema)
+	con.execute("CREATE VIEW "+quote_identifier(table_name)+" AS "+store_view_select(store, columns, schema))
+
+
+#Day partitions
+# With --partition, the tables whose schema has a partition column (USN journal, EVTX) and more rows than asked are split by day
+# of that column once loaded: one "[table]$data$[day]" table and "[table]$[day]" view per day, rows without a parsed time going
+# to the "undated" day. The view of the table becomes the UNION ALL of the day views. SQLite pushes the conditions of a query
+# down to each day, where a time range is answered by the index of the day: "between T1 and T2" reads the rows of the window and
+# only probes the other days. TABLE_PARTITIONS lists the days of each table with their time range, in time order.
+TABLE_PARTITIONS = "table_partitions"
+PARTITION_MIN_ROWS = 1000000
+UNDATED_PARTITION = "undated"
+DAY_MICROSECONDS = 86400 * 1000000
+
+
+# (view, day, first time, last time, rows) of the days of a table in time order, the undated day last. Empty if it is not split.
+def table_partitions(con, table_name):
+	if con.execute("SELECT 1 FROM sqlite_master WHERE name=?", (TABLE_PARTITIONS,)).fetchone() is None:
+		return []
+	return con.execute("SELECT partition, day, first, last, rows FROM "+TABLE_PARTITIONS+" WHERE table_name=? ORDER BY day = ?, day", (table_name, UNDATED_PARTITION)).fetchall()
+
+
+def drop_partitions(con, table_name):
+	partitions = table_partitions(con, table_name)
+	for view, day, first, last, rows in partitions:
+		drop_relation(con, view)
+		drop_relation(con, table_name+STORE_SUFFIX+"$"+day)
+	if partitions:
+		con.execute("DELETE FROM "+TABLE_PARTITIONS+" WHERE table_name=?", (table_name,))
+
+
+# Splits a loaded artefact table by day, reading its store through the index of the partition column
+def partition_by_day(con, table_name, columns, schema):
+	store = table_name+STORE_SUFFIX
+	column = quote_identifier(schema.partition)
+	dated = column+TIMESTAMP_RANGE
+	# Integer division rounds towards zero in SQLite, days before 1970 are rounded down
+	day = "("+column+" / "+str(DAY_MICROSECONDS)+" - ("+column+" % "+str(DAY_MICROSECONDS)+" < 0))"
+	days = [row[0] for row in con.execute("SELECT DISTINCT "+day+" FROM "+quote_identifier(store)+" WHERE "+dated+" ORDER BY 1")]
+	con.execute("CREATE TABLE IF NOT EXISTS "+TABLE_PARTITIONS+" (table_name TEXT, partition TEXT, day TEXT, first INTEGER, last INTEGER, rows INTEGER)")
+	views = []
+	for number in days + [None]:
+		if number is None:
+			name = UNDATED_PARTITION
+			condition = column+" IS NULL OR NOT ("+dated+")"
+		else:
+			name = datetime_from_epoch(number * DAY_MICROSECONDS).strftime('%Y-%m-%d')
+			condition = column+" >= "+str(number * DAY_MICROSECONDS)+" AND "+column+" < "+str((number + 1) * DAY_MICROSECONDS)
+		part = store+"$"+name
+		create_store(con, part, columns, schema)
+		rows = con.execute("INSERT INTO "+quote_identifier(part)+" SELECT * FROM "+quote_identifier(store)+" WHERE "+condition+" ORDER BY \"index\"").rowcount
+		if number is None and not rows:
+			drop_relation(con, part)
+			continue
+		create_store_indexes(con, part, columns, schema)
+		view = table_name+"$"+name
+		con.execute("CREATE VIEW "+quote_identifier(view)+" AS "+store_view_select(part, columns, schema))
+		first, last = con.execute("SELECT min("+column+"), max("+column+") FROM "+quote_identifier(part)).fetchone() if number is not None else (None, None)
+		con.execute("INSERT INTO "+TABLE_PARTITIONS+" VALUES (?, ?, ?, ?, ?, ?)", (table_name, view, name, first, last, rows))
+		views.append(view)
+	drop_relation(con, table_name)
+	drop_relation(con, store)
+	con.execute("CREATE VIEW "+quote_identifier(table_name)+" AS "+union_all(views))
+	Logger.info("Table "+table_name+" split in "+str(len(views))+" days.")
+
+
+#Bulk loader
+# The database is rebuilt from the CSV files whenever something goes wrong, so durability is traded for ingest speed
+INGEST_PRAGMAS = [
+	('page_size', 65536),
+	('journal_mode', 'OFF'),
+	('synchronous', 'OFF'),
+	('cache_size', -262144),
+	('temp_store', 'MEMORY'),
+]
+
+# Rows sent to each executemany call, and rows inserted before each commit
+INGEST_BATCH_ROWS = 20000
+INGEST_TRANSACTION_ROWS = 500000
+
+
+def quote_identifier(name):
+	return '"'+name.replace('"', '""')+'"'
+
+
+# Connection of the readers (search, report scans): read-only, with the database mapped in memory
+def open_read_only(db_path):
+	con = sqlite3.connect(Path(os.path.abspath(db_path)).as_uri()+"?mode=ro", uri=True)
+	con.execute("PRAGMA mmap_size="+str(REPORT_MMAP_BYTES))
+	return con
+
+
+def open_ingest_connection(db_path):
+	con = sqlite3.connect(db_path, isolation_level=None)
+	for pragma, value in INGEST_PRAGMAS:
+		con.execute("PRAGMA "+pragma+"="+str(value))
+	return con
+
+
+# Column names as pandas would have built them: empty headers become "Unnamed: N" and duplicates get a ".N" suffix
+def csv_columns(header):
+	columns = []
+	seen = {'index': 0}
+	for position, name in enumerate(header):
+		if not name:
+			name = "Unnamed: "+str(position)
+		if name in seen:
+			seen[name] += 1
+			name = name+"."+str(seen[name])
+		else:
+			seen[name] = 0
+		columns.append(name)
+	return columns
+
+
+# Positions of the timestamp columns of an artefact in its CSV rows
+def timestamp_positions(schema, columns):
+	if schema is None:
+		return []
+	return [i for i, column in enumerate(columns) if column in schema.timestamps]
+
+
+# (position, normaliser) per timestamp column. Each column gets its own normaliser, which remembers the format detected for it.
+def timestamp_converters(schema, positions):
+	return [(position, timestamp_normaliser(schema.timestamp_format)) for position in positions]
+
+
+# Pads or truncates a CSV row to the header width, with NULL for empty fields and timestamps converted to epoch microseconds
+def normalise_row(row, width, converters=()):
+	if len(row) != width:
+		row = (row + [''] * width)[:width]
+	row = [value if value != '' else None for value in row]
+	for position, normalise in converters:
+		row[position] = normalise(row[position])
+	return tuple(row)
+
+
+# Yields the CSV rows as tuples ("index", columns...)
+def csv_records(reader, width, first_id=1, converters=()):
+	row_id = first_id
+	for row in reader:
+		yield (row_id,) + normalise_row(row, width, converters)
+		row_id += 1
+
+
+# Drops everything holding the rows of a CSV file: its view or table, its store, its day partitions and its search index (which
+# would be stale)
+def drop_csv_table(con, table_name):
+	drop_relation(con, table_name+SEARCH_SUFFIX)
+	drop_partitions(con, table_name)
+	drop_relation(con, table_name)
+	drop_relation(con, table_name+STORE_SUFFIX)
+
+
+# Drops and recreates the table of a CSV file (typed and indexed for known artefacts). Returns the insert statement, the dictionary
+# encoded columns as (position in the record, column) and the artefact schema.
+def prepare_csv_table(con, table_name, columns, lookups):
+	schema = artefact_schema(table_name)
+	drop_csv_table(con, table_name)
+	positions = []
+	if schema is None:
+		table = quote_identifier(table_name)
+		con.execute("CREATE TABLE "+table+" (\"index\" INTEGER PRIMARY KEY, "+", ".join(quote_identifier(c)+" TEXT" for c in columns)+")")
+	else:
+		table = quote_identifier(table_name+STORE_SUFFIX)
+		create_artefact_table(con, table_name, columns, schema)
+		positions = [(i + 1, c) for i, c in enumerate(columns) if c in schema.lookups]
+		for position, column in positions:
+			open_lookup(con, lookups, column)
+	insert = "INSERT INTO "+table+" VALUES ("+", ".join(["?"] * (len(columns) + 1))+")"
+	return insert, positions, schema
+
+
+# Tables with a partition column and more than partition_rows rows are split by day (None: never)
+def finish_csv_table(con, table_name, columns, schema, rows=0, partition_rows=None):
+	if schema is not None:
+		finish_artefact_table(con, table_name, columns, schema)
+		if partition_rows is not None and schema.partition in columns and rows > partition_rows:
+			partition_by_day(con, table_name, columns, schema)
+
+
+# Streams a CSV file into a freshly created table, and returns the number of inserted rows
+def load_csv_table(con, csv_path, table_name, lookups, partition_rows=None):
+	csv.field_size_limit(2**31 - 1)
+	with open(csv_path, 'r', newline='', encoding='utf-8-sig', errors='replace') as source:
+		reader = csv.reader(source)
+		header = next(reader, None)
+		if header is None:
+			Logger.info(csv_path+" is empty, skipping.")
+			return 0
+		columns = csv_columns(header)
+		insert, positions, schema = prepare_csv_table(con, table_name, columns, lookups)
+		converters = timestamp_converters(schema, timestamp_positions(schema, columns))
+		records = csv_records(reader, len(columns), 1, converters)
+		if positions:
+			records = encode_lookups(con, records, positions, lookups)
+
+		rows = 0
+		uncommitted = 0
+		con.execute("BEGIN")
+		while True:
+			batch = list(islice(records, INGEST_BATCH_ROWS))
+			if not batch:
+				break
+			con.executemany(insert, batch)
+			rows += len(batch)
+			uncommitted += len(batch)
+			if uncommitted >= INGEST_TRANSACTION_ROWS:
+				con.execute("COMMIT")
+				con.execute("BEGIN")
+				uncommitted = 0
+		finish_csv_table(con, table_name, columns, schema, rows, partition_rows)
+		con.execute("COMMIT")
+	return rows
+
+
+# CSV files to load as (path, table name). The global EVTX CSV is skipped, it is a view over the per-log tables, and so is the
+# timeline, which is built from the tables.
+def database_csv_files(root):
+	for p in Path(root).rglob('*.csv'):
+		table_name = str(os.path.basename(p))
+		if table_name in (EVTX_GLOBAL_CSV, TIMELINE_CSV):
+			continue
+		yield str(Path(p).resolve()), table_name
+
+
+# Two CSV files of the same name would be loaded into the same table: the first one is kept, in both loaders
+def unique_csv_files(files):
+	tables = set()
+	for csv_path, table_name in files:
+		if table_name in tables:
+			Logger.info("Table "+table_name+" is already loaded from another file, skipping "+csv_path+".")
+			continue
+		tables.add(table_name)
+		yield csv_path, table_name
+
+
+def log_table_rate(table_name, rows, seconds):
+	Logger.info("Table "+table_name+": "+str(rows)+" rows in "+"%.1f" % seconds+"s ("+str(int(rows / seconds) if seconds else rows)+" rows/s).")
+
+
+# files: (CSV path, table name) to load, all the CSV files of root by default. on_loaded(csv path, table name, rows) is called
+# after each loaded table. partition_rows: see finish_csv_table.
+def create_database_bulk(root, db_path, files=None, on_loaded=None, partition_rows=None):
+	Logger.info("Creating database")
+	con = open_ingest_connection(db_path)
+	stats = {}
+	lookups = {}
+	if files is None:
+		files = database_csv_files(root)
+	try:
+		for csv_path, table_name in unique_csv_files(files):
+			Logger.info("Adding "+csv_path+" to database.")
+			start = time.perf_counter()
+			try:
+				rows = load_csv_table(con, csv_path, table_name, lookups, partition_rows)
+			except (csv.Error, sqlite3.Error, UnicodeError) as e:
+				Logger.info("Could not load "+csv_path+": "+repr(e))
+				# Without a journal (INGEST_PRAGMAS) a rollback is undefined: what was written is kept and the partial table dropped.
+				# Lookup tables are shared with the other tables, the values this file added stay in them unused.
+				if con.in_transaction:
+					con.execute("COMMIT")
+				drop_csv_table(con, table_name)
+				lookups.clear()
+				continue
+			seconds = time.perf_counter() - start
+			stats[table_name] = (rows, seconds)
+			log_table_rate(table_name, rows, seconds)
+			if on_loaded:
+				on_loaded(csv_path, table_name, rows)
+		create_evtx_global_view(con)
+		con.execute("PRAGMA optimize")
+	finally:
+		con.close()
+	return stats
+
+
+#Parallel ingest
+# A pool of processes parses and normalises the CSV files (big files are cut in several parts) and sends row batches through a
+# bounded queue to the main process, which is the only one writing to the database.
+
+# Files bigger than this are cut in parts of about this size
+PARALLEL_PART_BYTES = 64 * 1024 * 1024
+
+# Rows per batch sent to the writer, and batches waiting in the queue per worker
+PARALLEL_BATCH_ROWS = 5000
+PARALLEL_QUEUE_BATCHES = 4
+
+ingest_queue = None
+
+
+def init_ingest_worker(queue):
+	global ingest_queue
+	ingest_queue = queue
+	csv.field_size_limit(2**31 - 1)
+
+
+# Reads the header record of a CSV file, returns it with the offset of the first data record
+def csv_header(csv_path):
+	with open(csv_path, 'rb') as source:
+		lines = []
+		quotes = 0
+		for line in source:
+			lines.append(line)
+			quotes += line.count(b'"')
+			if quotes % 2 == 0:
+				break
+	if not lines:
+		return None, 0
+	text = b''.join(lines).decode('utf-8-sig', errors='replace')
+	return next(csv.reader(io.StringIO(text, newline='')), None), sum(len(line) for line in lines)
+
+
+# Offsets cutting [start, end of file) in parts of about PARALLEL_PART_BYTES. An offset is only kept on a record boundary: a newline
+# preceded by an even number of quotes, so quoted fields holding newlines are never cut.
+def csv_split_points(csv_path, start):
+	size = os.path.getsize(csv_path)
+	points = []
+	with open(csv_path, 'rb') as source:
+		source.seek(start)
+		offset = start
+		quotes = 0
+		target = start + PARALLEL_PART_BYTES
+		while target < size:
+			while offset < target:
+				block = source.read(min(1024 * 1024, target - offset))
+				if not block:
+					return points
+				quotes += block.count(b'"')
+				offset += len(block)
+			while True:
+				line = source.readline()
+				if not line:
+					return points
+				quotes += line.count(b'"')
+				offset += len(line)
+				if quotes % 2 == 0:
+					break
+			if offset < size:
+				points.append(offset)
+			target = offset + PARALLEL_PART_BYTES
+	return points
+
+
+def csv_part_lines(csv_path, start, end):
+	with open(csv_path, 'rb') as source:
+		source.seek(start)
+		position = start
+		for line in source:
+			if position >= end:
+				break
+			position += len(line)
+			yield line.decode('utf-8', errors='replace')
+
+
+# Worker side: parses a part (number "part" of the file) of a CSV file and queues its normalised rows (timestamps at "timestamps"
+# positions converted) as ('rows', table, part, rows) messages. Always ends with a ('done', table, part, error) message.
+def parse_csv_part(table_name, part, csv_path, start, end, width, timestamps=()):
+	error = None
+	try:
+		schema = artefact_schema(table_name)
+		converters = timestamp_converters(schema, timestamps) if schema is not None else []
+		batch = []
+		for row in csv.reader(csv_part_lines(csv_path, start, end)):
+			batch.append(normalise_row(row, width, converters))
+			if len(batch) >= PARALLEL_BATCH_ROWS:
+				ingest_queue.put(('rows', table_name, part, batch))
+				batch = []
+		if batch:
+			ingest_queue.put(('rows', table_name, part, batch))
+	except Exception as e:
+		error = repr(e)
+	ingest_queue.put(('done', table_name, part, error))
+
+
+# Rows are written in file order, so that the "index" of a row is the one the single process load gives it: rows of the part being
+# written go to the database, those of the next parts wait in a temporary file until the parts before them are done.
+def create_database_parallel(root, db_path, workers, files=None, on_loaded=None, partition_rows=None):
+	Logger.info("Creating database ("+str(workers)+" parsing processes).")
+	con = open_ingest_connection(db_path)
+	lookups = {}
+	tables = {}
+	tasks = []
+	stats = {}
+	if files is None:
+		files = database_csv_files(root)
+	state = {'uncommitted': 0}
+
+	def write_rows(table, batch):
+		records = [(table['rows'] + i + 1,) + row for i, row in enumerate(batch)]
+		if table['positions']:
+			records = encode_lookups(con, records, table['positions'], lookups)
+		con.executemany(table['insert'], records)
+		table['rows'] += len(batch)
+		state['uncommitted'] += len(batch)
+		if state['uncommitted'] >= INGEST_TRANSACTION_ROWS:
+			con.execute("COMMIT")
+			con.execute("BEGIN")
+			state['uncommitted'] = 0
+
+	# Moves on to the next parts of a table once the current one is done, writing the rows they already sent
+	def next_parts(table):
+		while True:
+			spool = table['waiting'].pop(table['next'], None)
+			if spool is not None:
+				with spool:
+					rows = read_spool(spool)
+					while not table['error']:
+						batch = list(islice(rows, PARALLEL_BATCH_ROWS))
+						if not batch:
+							break
+						write_rows(table, batch)
+			if table['next'] not in table['done']:
+				return
+			table['next'] += 1
 
-	#Create DB first
-	con = None
 	try:
-		con = sqlite3.connect(db_path)
-		Logger.info("Creating database")
-	except Error as e:
-		Logger.info(e)
+		for csv_path, table_name in unique_csv_files(files):
+			header, header_end = csv_header(csv_path)
+			if header is None:
+				Logger.info(csv_path+" is empty, skipping.")
+				continue
+			Logger.info("Adding "+csv_path+" to database.")
+			columns = csv_columns(header)
+			insert, positions, schema = prepare_csv_table(con, table_name, columns, lookups)
+			points = [header_end] + csv_split_points(csv_path, header_end) + [os.path.getsize(csv_path)]
+			timestamps = timestamp_positions(schema, columns)
+			for part, (part_start, part_end) in enumerate(zip(points, points[1:])):
+				tasks.append((table_name, part, csv_path, part_start, part_end, len(columns), timestamps))
+			tables[table_name] = {'path': csv_path, 'columns': columns, 'insert': insert, 'positions': positions, 'schema': schema,
+				'parts': len(points) - 1, 'rows': 0, 'error': None, 'next': 0, 'done': set(), 'waiting': {}}
+
+		start = time.perf_counter()
+		queue = multiprocessing.Queue(maxsize=workers * PARALLEL_QUEUE_BATCHES)
+		with ProcessPoolExecutor(workers, initializer=init_ingest_worker, initargs=(queue,)) as executor:
+			futures = {executor.submit(parse_csv_part, *task): task[:2] for task in tasks}
+			state['remaining'] = len(tasks)
+
+			# A part is ended once, by its 'done' message or by the loss of its process
+			def end_part(table_name, part, error):
+				table = tables[table_name]
+				if part in table['done']:
+					return
+				state['remaining'] -= 1
+				table['parts'] -= 1
+				table['done'].add(part)
+				if error and not table['error']:
+					table['error'] = error
+					Logger.info("Could not load "+table_name+": "+error)
+				next_parts(table)
+				if table['parts'] == 0:
+					if table['error']:
+						drop_csv_table(con, table_name)
+					else:
+						finish_csv_table(con, table_name, table['columns'], table['schema'], table['rows'], partition_rows)
+						con.execute("COMMIT")
+						con.execute("BEGIN")
+						state['uncommitted'] = 0
+						seconds = time.perf_counter() - start
+						stats[table_name] = (table['rows'], seconds)
+						log_table_rate(table_name, table['rows'], seconds)
+						if on_loaded:
+							on_loaded(table['path'], table_name, table['rows'])
+
+			try:
+				con.execute("BEGIN")
+				while state['remaining']:
+					try:
+						kind, table_name, part, payload = queue.get(timeout=5)
+					except Empty:
+						# A process killed by the system (out of memory, crash in the C code) breaks the pool: every part not ended
+						# by then fails with its table, instead of being waited for forever
+						for future in [future for future in futures if future.done()]:
+							table_name, part = futures.pop(future)
+							if future.exception() is not None:
+								end_part(table_name, part, "parsing process lost ("+repr(future.exception())+")")
+						if not futures:
+							for task in tasks:
+								end_part(task[0], task[1], "parsing process stopped before sending all its rows")
+						continue
+					table = tables[table_name]
+					if kind == 'rows':
+						if table['error'] or part in table['done']:
+							continue
+						if part == table['next']:
+							write_rows(table, payload)
+						else:
+							if part not in table['waiting']:
+								table['waiting'][part] = tempfile.TemporaryFile()
+							pickle.dump(payload, table['waiting'][part], pickle.HIGHEST_PROTOCOL)
+						continue
+					end_part(table_name, part, payload)
+				con.execute("COMMIT")
+			finally:
+				# Stopped on an error: parts not started are cancelled and the rows of the running ones read until they end, so that
+				# no process stays blocked on the full queue
+				for future in futures:
+					future.cancel()
+				while not all(future.done() for future in futures):
+					try:
+						queue.get(timeout=0.1)
+					except Empty:
+						pass
+		create_evtx_global_view(con)
+		con.execute("PRAGMA optimize")
 	finally:
-		if con:
-			for p in Path(root).rglob('*.csv'):
-				index_offset = 1
-				Logger.info("Adding "+str(p)+" to database.")
-				table_name = str(os.path.basename(p))
-				csv_path = str(Path(p).resolve())
-				Logger.info("Table name: "+table_name)
-				Logger.info("CSV path: "+csv_path)
-				for df in pd.read_csv(csv_path, chunksize = chunksize, iterator = True, dtype=str):
-					df.index += index_offset
-					df.to_sql(table_name, con, if_exists = 'append')
-					index_offset += 1
-			con.close()
+		for table in tables.values():
+			for spool in table['waiting'].values():
+				spool.close()
+		con.close()
+	return stats
+
+
+# Parallel parsing only pays off with several processes and files big enough to be cut in parts: a single process, or a few small
+# files (the CSV files of a single stage, loaded as soon as it ends), are loaded in process
+def load_database(root, db_path, workers=1, files=None, on_loaded=None, partition_rows=None):
+	if files is not None:
+		files = list(files)
+	if workers > 1 and (files is None or sum(os.path.getsize(csv_path) for csv_path, table_name in files) > PARALLEL_PART_BYTES):
+		return create_database_parallel(root, db_path, workers, files, on_loaded, partition_rows)
+	return create_database_bulk(root, db_path, files, on_loaded, partition_rows)
+
+
+# SQLite refuses compound SELECTs with more than 500 terms, so big unions are nested by groups
+SQLITE_MAX_COMPOUND = 400
+
+def union_all(tables):
+	return union_selects(['SELECT * FROM '+quote_identifier(table) for table in tables])
+
+
+def union_selects(selects):
+	if len(selects) <= SQLITE_MAX_COMPOUND:
+		return ' UNION ALL '.join(selects)
+	groups = [selects[i:i+SQLITE_MAX_COMPOUND] for i in range(0, len(selects), SQLITE_MAX_COMPOUND)]
+	return ' UNION ALL '.join('SELECT * FROM ('+' UNION ALL '.join(group)+')' for group in groups)
+
+
+# Column of the "global.csv" view naming the per-log table of each row: "index" is only unique within a table
+EVTX_SOURCE_COLUMN = "source_table"
+
+# "global.csv" is not loaded a second time, it is a view over all the per-log EVTX tables. Logs converted separately (partial
+# conversion, native engine) do not always have the same columns: the view has the columns of all of them, NULL where a log has none.
+def create_evtx_global_view(con):
+	tables = [row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name LIKE '%.evtx.csv' AND name != ? ORDER BY name", (EVTX_GLOBAL_CSV,))]
+	con.execute('DROP VIEW IF EXISTS "'+EVTX_GLOBAL_CSV+'"')
+	if tables:
+		Logger.info("Creating view "+EVTX_GLOBAL_CSV+" over "+str(len(tables))+" EVTX tables.")
+		columns = {table: relation_columns(con, table) for table in tables}
+		shared = list(OrderedDict.fromkeys(column for table in tables for column in columns[table] if column != EVTX_SOURCE_COLUMN))
+		selects = []
+		for table in tables:
+			present = set(columns[table])
+			selected = [quote_identifier(column) if column in present else "NULL AS "+quote_identifier(column) for column in shared]
+			selects.append("SELECT "+", ".join(selected)+", '"+table.replace("'", "''")+"' AS "+EVTX_SOURCE_COLUMN+" FROM "+quote_identifier(table))
+		con.execute('CREATE VIEW "'+EVTX_GLOBAL_CSV+'" AS '+union_selects(selects))
+	con.commit()
 
 	
 
 
 
 ############################################################################### Reporting ################################################################
-def xlsx_preparer(df,writer,sheetname,workbook):
-	####### Bookmarking colors #########
-	# Light red fill for "evidence"
-	format1 = workbook.add_format({'bg_color':   '#FFC7CE'})
-
-	# Light yellow fill for "of interest"
-	format2 = workbook.add_format({'bg_color':   '#FFEB9C'})
-
-	# Green fill for "bookmark"
-	format3 = workbook.add_format({'bg_color':   '#C6EFCE'})
-	####################################
-
-	(max_row, max_col) = df.shape
-	df.insert(0,'Tag',[None]*max_row)
-	df.to_excel(writer, sheet_name=sheetname, startrow=1, header=False, index=False)
-	worksheet = writer.sheets[sheetname]
-	column_settings = [{'header': column} for column in df.columns]
-	worksheet.add_table(0, 0, max_row, max_col, {'columns': column_settings})
-	worksheet.set_column(0, max_col, 17)
-	worksheet.data_validation(0,0,max_row,0, {'validate': 'list', 'source': ['Evidence', 'Of interest', 'Bookmark']})
-	worksheet.conditional_format(0,0,max_row,0, {'type':'text','criteria':'containing','value':'Evidence','format':format1})
-	worksheet.conditional_format(0,0,max_row,0, {'type':'text','criteria':'containing','value':'Of interest','format':format2})
-	worksheet.conditional_format(0,0,max_row,0, {'type':'text','criteria':'containing','value':'Bookmark','format':format3})
-
-
-
-def cleared_audit_log(con,writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * from \"Security.evtx.csv\" WHERE (EventId=1102)", con)
-		df2 = pd.read_sql_query("SELECT * from \"System.evtx.csv\" WHERE (EventId=102)", con)
-		frame = [df,df2]
-		result = pd.concat(frame)
-		result['TimeCreated'] = pd.to_datetime(result['TimeCreated'])
-		xlsx_preparer(result,writer,'Event log cleared',workbook)
-	except Exception as e:
-		pass
-
-def logon_events(con, writer,workbook):
+# Report sheets, in workbook order. Each sheet concatenates the rows selected from its sources:
+#	- table: table (or view) to read, sources whose table does not exist are ignored
+#	- events: EventId values to keep (optional)
+#	- filters: extra condition for some of these events, as {EventId: SQL condition} (optional)
+#	- where: SQL condition on the rows (optional, combined with events)
+# "dates" lists the columns converted to dates. More sheets can be added, or these ones replaced, with --report-config.
+REPORT_SHEETS = [
+	# Filled by the IOC sweep (-i)
+	{'sheet': 'IOC hits', 'dates': ['time'], 'sources': [
+		{'table': 'ioc_hits'}]},
+	{'sheet': 'Event log cleared', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'Security.evtx.csv', 'events': [1102]},
+		{'table': 'System.evtx.csv', 'events': [102]}]},
+	{'sheet': 'Logon Events', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'Security.evtx.csv', 'events': [4768, 4769, 4770, 4771, 4776, 4624, 4625, 4634, 4647, 4648, 4672, 4778, 4779]}]},
+	{'sheet': 'Account mgt Events', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'Security.evtx.csv', 'events': [4720, 4722, 4723, 4724, 4725, 4726, 4727, 4728, 4729, 4730, 4731, 4732, 4733, 4734, 4735, 4737, 4738, 4741, 4742, 4743, 4754, 4755, 4756, 4757, 4758, 4798, 4799]}]},
+	{'sheet': 'Sched. Tasks Events', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'Security.evtx.csv', 'events': [4698, 4699, 4700, 4701, 4702]},
+		{'table': 'Microsoft-Windows-TaskScheduler%4Operational.evtx.csv', 'events': [106, 140, 141, 200, 201]}]},
+	{'sheet': 'RDP Events', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'Security.evtx.csv', 'events': [4778, 4779, 4624], 'filters': {4624: "\"PayloadData2\" LIKE 'LogonType 10'"}},
+		{'table': 'RemoteDesktopServices-RDPCoreTS%4Operational.evtx.csv', 'events': [131]},
+		{'table': 'TerminalServices-RemoteConnectionManager%4Operational.evtx.csv', 'events': [1149]}]},
+	{'sheet': 'App Install Events', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'Application.evtx.csv', 'events': [1033, 1034, 11707, 11708, 11724]}]},
+	{'sheet': 'Services Events', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'System.evtx.csv', 'events': [7034, 7035, 7036, 7040, 7045]},
+		{'table': 'Security.evtx.csv', 'events': [4697]}]},
+	{'sheet': 'WMI Events', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'Microsoft-Windows-WMI-Activity%4Operational.evtx.csv', 'events': [5857, 5858, 5859, 5860, 5861]}]},
+	{'sheet': 'PowerShell Events', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'Microsoft-Windows-PowerShell%4Operational.evtx.csv', 'events': [4103, 4104]}]},
+	{'sheet': 'Process Events', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'Security.evtx.csv', 'events': [4688, 4689]},
+		{'table': 'Application.evtx.csv', 'events': [1000, 1001, 1002]},
+		{'table': 'System.evtx.csv', 'events': [1001]}]},
+	{'sheet': 'Share Events', 'dates': ['TimeCreated'], 'sources': [
+		{'table': 'Security.evtx.csv', 'events': [5140, 5142, 5143, 5144, 5145]}]},
+	{'sheet': 'Present programs (amcache)', 'dates': ['FileKeyLastWriteTimestamp', 'LinkDate'], 'sources': [
+		{'table': 'Amcache_UnassociatedFileEntries.csv'},
+		{'table': 'Amcache_AssociatedFileEntries.csv'}]},
+	{'sheet': 'RecycleBin', 'dates': ['DeletedOn'], 'sources': [
+		{'table': 'RecycleBin.csv'}]},
+	{'sheet': 'Program execution (prefetch)', 'dates': ['RunTime'], 'sources': [
+		{'table': 'prefetch_Timeline.csv'}]},
+	{'sheet': 'Program execution (registry)', 'dates': ['LastWriteTimestamp'], 'sources': [
+		{'table': 'registry.csv', 'where': "\"Category\" LIKE 'Program Execution'"}]},
+	{'sheet': 'Amcache plugged devices', 'dates': ['FileKeyLastWriteTimestamp'], 'sources': [
+		{'table': 'Amcache_DevicePnps.csv'}]},
+	{'sheet': 'Amcache drivers', 'dates': ['FileKeyLastWriteTimestamp', 'DriverTimeStamp', 'DriverLastWriteTime'], 'sources': [
+		{'table': 'Amcache_DriveBinaries.csv'}]},
+	{'sheet': 'Amcache installed programs', 'dates': ['FileKeyLastWriteTimestamp', 'InstallDateArpLastModified', 'InstallDate', 'InstallDateMsi', 'InstallDateFromLinkFile'], 'sources': [
+		{'table': 'Amcache_ProgramEntries.csv'}]},
+	{'sheet': 'Shortcuts', 'dates': ['SourceCreated', 'SourceModified', 'SourceAccessed', 'TargetCreated', 'TargetModified', 'TargetAccessed', 'TrackerCreatedOn'], 'sources': [
+		{'table': 'lnk.csv'}]},
+	{'sheet': 'System info', 'dates': ['LastWriteTimestamp'], 'sources': [
+		{'table': 'registry.csv', 'where': "\"Category\" LIKE 'System Info'"}]},
+	{'sheet': 'Network shares (registry)', 'dates': ['LastWriteTimestamp'], 'sources': [
+		{'table': 'registry.csv', 'where': "\"Category\" LIKE 'Network Shares'"}]},
+	{'sheet': '3rd party applications', 'dates': ['LastWriteTimestamp'], 'sources': [
+		{'table': 'registry.csv', 'where': "\"Category\" LIKE 'Third Party Applications'"}]},
+	{'sheet': 'Network usage', 'dates': ['Timestamp'], 'sources': [
+		{'table': 'SrumECmd_NetworkUsages_Output.csv'}]},
+]
+
+# Not in the default report, can be enabled through --report-config
+#	{'sheet': 'Service crash', 'dates': ['TimeCreated'], 'sources': [{'table': 'System.evtx.csv', 'events': [7034]}]}
+#	{'sheet': 'Application error', 'dates': ['TimeCreated'], 'sources': [{'table': 'Application.evtx.csv', 'events': [1000, 1001, 1002]}]}
+#	{'sheet': 'User Activity (registry)', 'dates': ['LastWriteTimestamp'], 'sources': [{'table': 'registry.csv', 'where': "\"Category\" LIKE 'User Activity'"}]}
+#	{'sheet': 'VSS info (registry)', 'dates': ['LastWriteTimestamp'], 'sources': [{'table': 'registry.csv', 'where': "\"Category\" LIKE 'Volume Shadow Copies'"}]}
+#	{'sheet': 'Apps resource use', 'dates': ['Timestamp'], 'sources': [{'table': 'SrumECmd_AppResourceUseInfo_Output.csv'}]}
+
+
+# Reads a JSON list of sheets (same format as REPORT_SHEETS). A sheet named like a default one replaces it, the others are appended.
+def load_report_sheets(config_path=None):
+	sheets = [dict(sheet) for sheet in REPORT_SHEETS]
+	if not config_path:
+		return sheets
+	with open(config_path, 'r', encoding='utf-8') as f:
+		extra = json.load(f)
+	if not isinstance(extra, list):
+		raise ValueError(config_path+": the report configuration must be a list of sheets")
+	positions = {sheet['sheet']: i for i, sheet in enumerate(sheets)}
+	for sheet in extra:
+		if not isinstance(sheet, dict) or 'sheet' not in sheet or not sheet.get('sources'):
+			raise ValueError(config_path+": each sheet needs a \"sheet\" name and \"sources\"")
+		for source in sheet['sources']:
+			if 'table' not in source:
+				raise ValueError(config_path+": a source of sheet "+sheet['sheet']+" has no \"table\"")
+			# JSON keys are strings
+			source['filters'] = {int(event): condition for event, condition in source.get('filters', {}).items()}
+		if sheet['sheet'] in positions:
+			sheets[positions[sheet['sheet']]] = sheet
+		else:
+			positions[sheet['sheet']] = len(sheets)
+			sheets.append(sheet)
+	return sheets
+
+
+# SQL condition selecting the rows of a source, None when it takes the whole table
+def source_condition(source):
+	events = source.get('events') or []
+	filters = source.get('filters') or {}
+	conditions = []
+	plain = [int(event) for event in events if event not in filters]
+	if plain:
+		conditions.append('"EventId" IN ('+", ".join(str(event) for event in plain)+')')
+	for event in events:
+		if event in filters:
+			conditions.append('("EventId" = '+str(int(event))+' AND ('+filters[event]+'))')
+	condition = ' OR '.join(conditions)
+	if source.get('where'):
+		condition = '('+condition+') AND ('+source['where']+')' if condition else source['where']
+	return condition or None
+
+
+# Rows routed to a sheet source are spooled to a temporary file by pickled batches, so shared scans never hold whole sheets in memory
+REPORT_SPOOL_BATCH = 5000
+
+# Tables are scanned by a pool of processes (--report-workers) reading the database over read-only connections, which map it in
+# memory up to this size. Their spools are named files (in a folder of each report), reopened by the report.
+REPORT_MMAP_BYTES = 1024 * 1024 * 1024
+REPORT_SPOOL_PREFIX = "windissect_report_"
+
+
+def read_spool(spool):
+	spool.seek(0)
+	while True:
+		try:
+			batch = pickle.load(spool)
+		except EOFError:
+			return
+		yield from batch
+
+
+# Reopens a spool written by a scan worker. The file goes away once closed (Windows) or at once (POSIX, the handle keeps it).
+def open_spool(path):
+	if os.name == 'nt':
+		return os.fdopen(os.open(path, os.O_RDONLY | os.O_BINARY | os.O_TEMPORARY), 'rb')
+	spool = open(path, 'rb')
+	os.remove(path)
+	return spool
+
+
+# Values of the date columns (positions) of a row as datetime objects, converted as write_sheet would, so that the conversion runs
+# with the scans. Values write_sheet would not write as dates are kept.
+def report_dates(row, positions):
+	row = list(row)
+	for position in positions:
+		value = row[position]
+		try:
+			timestamp = datetime_from_epoch(value) if isinstance(value, int) else parse_timestamp(value)
+		except (OverflowError, ValueError):
+			continue
+		if timestamp is not None and timestamp.year >= 1900:
+			row[position] = timestamp
+	return tuple(row)
+
+
+# One scan of a table answers all the sources reading it: each source condition becomes a flag column telling where a row goes.
+# The WHERE clause is an indexed "EventId IN (...)" when every source filters on events. Returns the columns and one spool per source,
+# made by "spool". dates: the date columns of each source, converted to datetime objects in its rows.
+def scan_report_table(con, table, sources, dates=None, spool=tempfile.TemporaryFile):
+	conditions = [source_condition(source) for source in sources]
+	flags = ", ".join("("+(condition or "1")+") AS \"#"+str(i)+"\"" for i, condition in enumerate(conditions))
+	query = "SELECT *, "+flags+" FROM "+quote_identifier(table)
+	if all(source.get('events') for source in sources):
+		events = sorted({int(event) for source in sources for event in source['events']})
+		query += ' WHERE "EventId" IN ('+", ".join(str(event) for event in events)+') AND ('+" OR ".join("("+c+")" for c in conditions)+')'
+	elif all(conditions):
+		query += " WHERE "+" OR ".join("("+c+")" for c in conditions)
+	query += ' ORDER BY "index"'
+
+	cursor = con.execute(query)
+	columns = [description[0] for description in cursor.description][:-len(sources)]
+	width = len(columns)
+	positions = [[i for i, column in enumerate(columns) if column in source_dates] for source_dates in (dates or [[] for source in sources])]
+	spools = []
+	batches = [[] for source in sources]
 	try:
-		df = pd.read_sql_query("SELECT * from \"Security.evtx.csv\" WHERE (EventId=4768) OR (EventId=4769) OR (EventId=4770) OR (EventId=4771) OR (EventId=4776) OR (EventId=4624) OR (EventId=4625) OR (EventId=4634) OR (EventId=4647) OR (EventId=4648) OR (EventId=4672) OR (EventId=4778) OR (EventId=4779)", con)
-		df['TimeCreated'] = pd.to_datetime(df['TimeCreated'])
-		xlsx_preparer(df,writer,'Logon Events',workbook)
-	except Exception as e:
-		pass
+		for source in sources:
+			spools.append(spool())
+		for row in cursor:
+			for i in range(len(sources)):
+				if row[width + i]:
+					batches[i].append(report_dates(row[:width], positions[i]) if positions[i] else row[:width])
+					if len(batches[i]) >= REPORT_SPOOL_BATCH:
+						pickle.dump(batches[i], spools[i], pickle.HIGHEST_PROTOCOL)
+						batches[i] = []
+		for spool, batch in zip(spools, batches):
+			if batch:
+				pickle.dump(batch, spool, pickle.HIGHEST_PROTOCOL)
+	except BaseException:
+		for spool in spools:
+			spool.close()
+		raise
+	return columns, spools
+
+
+# Rows of a sheet: its sources one after the other, aligned on the union of their columns as pandas.concat does
+def sheet_rows(columns, parts):
+	for part_columns, spool in parts:
+		if part_columns == columns:
+			yield from read_spool(spool)
+		else:
+			positions = [part_columns.index(column) if column in part_columns else None for column in columns]
+			for row in read_spool(spool):
+				yield tuple(row[p] if p is not None else None for p in positions)
+
+
+# Sheet sources reading each table, as {table: [(sheet name, position, source, sheet dates)]}, for the tables in "existing" (all of
+# them if None)
+def report_table_users(sheets, existing=None):
+	by_table = OrderedDict()
+	for sheet in sheets:
+		for position, source in enumerate(sheet['sources']):
+			if existing is None or source['table'] in existing:
+				by_table.setdefault(source['table'], []).append((sheet['sheet'], position, source, sheet.get('dates', [])))
+	return by_table
+
+
+def log_report_scan(table, users, seconds):
+	record_metrics('report_query', table, {'wall_seconds': round(seconds, 3), 'sheets': sorted({user[0] for user in users})})
+	Logger.info("Report: scanned "+table+" for "+str(len(users))+" sheet sources in "+"%.1f" % seconds+"s.")
+
+
+# Scans a table for its sheet sources (report_table_users). Returns (columns, spools, seconds), None when the table cannot be read.
+def scan_report_users(con, table, users):
+	start = time.perf_counter()
+	try:
+		columns, spools = scan_report_table(con, table, [user[2] for user in users], [user[3] for user in users])
+	except sqlite3.Error as e:
+		Logger.info("Could not read "+table+" for the report: "+repr(e))
+		return None
+	seconds = time.perf_counter() - start
+	log_report_scan(table, users, seconds)
+	return columns, spools, seconds
+
+
+# Worker side: scans a table over its own read-only connection. Returns (columns, spool paths, seconds, error), the spools being
+# left in named files of spool_dir for the report (open_spool).
+def scan_report_worker(db_path, table, sources, dates, spool_dir=None):
+	created = []
+
+	def named_spool():
+		spool = tempfile.NamedTemporaryFile(prefix=REPORT_SPOOL_PREFIX, dir=spool_dir, delete=False)
+		created.append(spool.name)
+		return spool
+
+	start = time.perf_counter()
+	con = open_read_only(db_path)
+	try:
+		columns, spools = scan_report_table(con, table, sources, dates, named_spool)
+	except BaseException as e:
+		for path in created:
+			os.remove(path)
+		if isinstance(e, sqlite3.Error):
+			return None, [], 0, repr(e)
+		raise
+	finally:
+		con.close()
+	for spool in spools:
+		spool.close()
+	return columns, created, time.perf_counter() - start, None
 
 
-def account_management_events(con, writer,workbook):
+# Scans tables as soon as they are loaded, while the other tools are still running: prefetch is {'sheets': sheets, 'scans': {table:
+# (columns, spools, seconds)}}, the scans being handed to the report, which only scans the tables left. A table loaded again is scanned again.
+def prefetch_report_scans(db_path, prefetch, tables):
+	by_table = report_table_users(prefetch['sheets'])
+	con = sqlite3.connect(db_path)
 	try:
-		df = pd.read_sql_query("SELECT * from \"Security.evtx.csv\" WHERE (EventId=4720) OR (EventId=4722) OR (EventId=4723) OR (EventId=4724) OR (EventId=4725) OR (EventId=4726) OR (EventId=4727) OR (EventId=4728) OR (EventId=4729) OR (EventId=4730) OR (EventId=4731) OR (EventId=4732) OR (EventId=4733) OR (EventId=4734) OR (EventId=4735) OR (EventId=4737) OR (EventId=4738) OR (EventId=4741) OR (EventId=4742) OR (EventId=4743) OR (EventId=4754) OR (EventId=4755) OR (EventId=4756) OR (EventId=4757) OR (EventId=4758) OR (EventId=4798) OR (EventId=4799)", con)
-		df['TimeCreated'] = pd.to_datetime(df['TimeCreated'])
-		xlsx_preparer(df,writer,'Account mgt Events',workbook)
-	except Exception as e:
-		pass	
-	
-
-def scheduled_tasks_events(con, writer,workbook):
+		for table in tables:
+			if table not in by_table:
+				continue
+			close_report_scans({table: prefetch['scans'].pop(table)} if table in prefetch['scans'] else {})
+			scan = scan_report_users(con, table, by_table[table])
+			if scan is not None:
+				prefetch['scans'][table] = scan
+	finally:
+		con.close()
+
+
+def close_report_scans(scans):
+	for columns, spools, seconds in scans.values():
+		for spool in spools:
+			spool.close()
+	scans.clear()
+
+
+# Runs every sheet query with one scan per table and yields (sheet, columns, parts, query seconds) in sheet order, for the sheets having
+# at least one table: parts are (columns, spool) per source and query seconds the time of the scans the sheet uses. Scans already done
+# (prefetch_report_scans) are taken out of "prepared". With several workers, the other tables are all handed at once to a pool of
+# processes (scan_report_worker), so the sheets are written while the tables they do not read are still being scanned. The caller
+# closes the spools.
+def collect_report_sheets(db_path, sheets, prepared=None, workers=1):
+	if prepared is None:
+		prepared = {}
+	con = open_read_only(db_path)
+	pool = None
+	spool_dir = None
+	jobs = {}
+	parts = {}
 	try:
-		df = pd.read_sql_query("SELECT * from \"Security.evtx.csv\" WHERE (EventId=4698) OR (EventId=4699) OR (EventId=4700) OR (EventId=4701) OR (EventId=4702)", con)
-		df2 = pd.read_sql_query("SELECT * from \"Microsoft-Windows-TaskScheduler%4Operational.evtx.csv\" WHERE (EventId=106) OR (EventId=140) OR (EventId=141) OR (EventId=200) OR (EventId=201)", con)
-		frame = [df,df2]
-		result = pd.concat(frame)
-		result['TimeCreated'] = pd.to_datetime(result['TimeCreated'])
-		xlsx_preparer(result,writer,'Sched. Tasks Events',workbook)
-	except Exception as e:
-		pass
-
-def RDP_events(con, writer,workbook):
+		existing = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+		by_table = report_table_users(sheets, existing)
+		pending = [table for table in by_table if table not in prepared]
+		if workers > 1 and len(pending) > 1:
+			# The spools of the workers go to a folder of their own, removed at the end whatever happened to the workers
+			spool_dir = tempfile.mkdtemp(prefix=REPORT_SPOOL_PREFIX)
+			pool = multiprocessing.Pool(min(workers, len(pending)))
+			for table in pending:
+				users = by_table[table]
+				jobs[table] = pool.apply_async(scan_report_worker, (db_path, table, [user[2] for user in users], [user[3] for user in users], spool_dir))
+			pool.close()
+
+		scans = {}
+		for sheet in sheets:
+			for source in sheet['sources']:
+				table = source['table']
+				if table not in by_table or table in scans:
+					continue
+				users = by_table[table]
+				if table in prepared:
+					scan = prepared.pop(table)
+				elif table in jobs:
+					columns, paths, seconds, error = jobs.pop(table).get()
+					scan = None
+					if error:
+						Logger.info("Could not read "+table+" for the report: "+error)
+					else:
+						scan = (columns, [open_spool(path) for path in paths], seconds)
+						log_report_scan(table, users, seconds)
+				else:
+					scan = scan_report_users(con, table, users)
+				scans[table] = None
+				if scan is not None:
+					columns, spools, scans[table] = scan
+					for user, spool in zip(users, spools):
+						parts[(user[0], user[1])] = (columns, spool)
+
+			sheet_parts = [parts.pop((sheet['sheet'], position)) for position in range(len(sheet['sources'])) if (sheet['sheet'], position) in parts]
+			if not sheet_parts:
+				continue
+			columns = []
+			for part_columns, spool in sheet_parts:
+				columns.extend(column for column in part_columns if column not in columns)
+			tables = {source['table'] for source in sheet['sources'] if scans.get(source['table']) is not None}
+			yield sheet, columns, sheet_parts, sum(scans[table] for table in tables)
+	finally:
+		con.close()
+		# Spools of the sheets not reached (the report stopped)
+		for part_columns, spool in parts.values():
+			spool.close()
+		if pool is not None:
+			pool.terminate()
+			pool.join()
+		if spool_dir is not None:
+			# Spools still open (Windows) go away once closed
+			shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+# Returns the number of rows written. scans: tables already scanned (prefetch_report_scans), closed once used. workers: processes
+# scanning the other tables (1 scans them in this process).
+def create_xlsx_report(db_path, output_report, Logger, sheets=None, scans=None, workers=1):
+	if sheets is None:
+		sheets = REPORT_SHEETS
+	Logger.info("Creating XLSX report.")
+	report = open_workbook(output_report)
+	total = 0
 	try:
-		df = pd.read_sql_query("SELECT * from \"Security.evtx.csv\" WHERE (EventId=4778) OR (EventId=4779) OR (EventId=4624 AND \"PayloadData2\" LIKE 'LogonType 10')", con)
-		try:
-			df2 = pd.read_sql_query("SELECT * from \"RemoteDesktopServices-RDPCoreTS%4Operational.evtx.csv\" WHERE (EventId=131)", con)
-		except Exception as e:
-			df2 = pd.DataFrame()
+		for sheet, columns, parts, query_seconds in collect_report_sheets(db_path, sheets, scans, workers):
+			values = {'query_seconds': round(query_seconds, 3), 'tables': sorted({source['table'] for source in sheet['sources']})}
+			start = time.perf_counter()
+			try:
+				rows = write_sheet(report, sheet['sheet'], columns, sheet_rows(columns, parts), sheet.get('dates', []))
+				Logger.info("Sheet "+sheet['sheet']+": "+str(rows)+" rows.")
+				values['rows'] = rows
+				total += rows
+			except Exception as e:
+				Logger.info("Could not write sheet "+sheet['sheet']+": "+repr(e))
+				values['error'] = repr(e)
+			finally:
+				for part_columns, spool in parts:
+					spool.close()
+			values['write_seconds'] = round(time.perf_counter() - start, 3)
+			record_metrics('report_sheet', sheet['sheet'], values)
+	finally:
+		close_workbook(report)
+		# Scans no sheet used (a table that disappeared)
+		close_report_scans(scans or {})
+	return total
+
+
+########################################################################  Parquet export  ##########################################################
+
+# Every loaded table is also written as a Parquet file (--format parquet), read back from the database so that artefact columns are
+# typed: integers as int64, timestamps (epoch microseconds in the database) as UTC timestamps, lookup columns dictionary encoded. Files are zstd compressed and cut in row
+# groups with min/max statistics, so readers only load the columns and row groups they need. EVTX tables share the same columns, they
+# go to an "evtx" subfolder that can be read as a single dataset.
+PARQUET_FOLDER = "parquet"
+PARQUET_MANIFEST = "parquet_manifest.json"
+PARQUET_ROW_GROUP_ROWS = 262144
+PARQUET_COMPRESSION = "zstd"
+
+
+def parquet_file(table_name):
+	name = table_name[:-len(".csv")] if table_name.endswith(".csv") else table_name
+	if fnmatch.fnmatchcase(table_name, '*.evtx.csv'):
+		return "evtx/"+name+".parquet"
+	return name+".parquet"
+
+
+def parquet_schema(pa, table_name, columns):
+	schema = artefact_schema(table_name)
+	fields = []
+	for column in columns:
+		if column == 'index':
+			field_type = pa.int64()
+		elif schema is not None and column in schema.integers:
+			field_type = pa.int64()
+		elif schema is not None and column in schema.timestamps:
+			field_type = pa.timestamp('us', tz='UTC')
+		elif schema is not None and column in schema.lookups:
+			field_type = pa.dictionary(pa.int32(), pa.string())
+		else:
+			field_type = pa.string()
+		fields.append(pa.field(column, field_type))
+	return pa.schema(fields)
+
+
+# Values that do not fit the column type (text in an integer column, timestamps no format could parse) are left out, the CSV still has them
+def parquet_column(pa, field, values, rejected):
+	if pa.types.is_int64(field.type) or pa.types.is_timestamp(field.type):
+		typed = [value if isinstance(value, int) else None for value in values]
+	else:
+		return pa.array([value if value is None else str(value) for value in values], type=field.type)
+	rejected[field.name] = rejected.get(field.name, 0) + sum(1 for value, kept in zip(values, typed) if value is not None and kept is None)
+	return pa.array(typed, type=field.type)
+
+
+# Writes a table to a Parquet file (through a temporary file), returns its manifest entry
+# Tables split by day are written day after day, so row groups do not mix days and their time statistics prune them like the days
+def export_parquet_table(con, table_name, path):
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+	relations = [view for view, day, first, last, rows in table_partitions(con, table_name)] or [table_name]
+	columns = [row[1] for row in con.execute("PRAGMA table_info("+quote_identifier(table_name)+")")]
+	schema = parquet_schema(pa, table_name, columns)
+	rejected = {}
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	temporary = path+".tmp"
+	with pq.ParquetWriter(temporary, schema, compression=PARQUET_COMPRESSION) as writer:
+		for relation in relations:
+			cursor = con.execute("SELECT * FROM "+quote_identifier(relation)+" ORDER BY \"index\"")
+			while True:
+				rows = cursor.fetchmany(PARQUET_ROW_GROUP_ROWS)
+				if not rows:
+					break
+				values = list(zip(*rows))
+				arrays = [parquet_column(pa, field, column_values, rejected) for field, column_values in zip(schema, values)]
+				writer.write_table(pa.Table.from_arrays(arrays, schema=schema), row_group_size=PARQUET_ROW_GROUP_ROWS)
+	os.replace(temporary, path)
+	metadata = pq.ParquetFile(path).metadata
+	for column, count in rejected.items():
+		if count:
+			Logger.info("Parquet "+table_name+": "+str(count)+" values of "+column+" do not fit its type, left empty.")
+	return {'rows': metadata.num_rows, 'row_groups': metadata.num_row_groups, 'bytes': os.path.getsize(path),
+		'columns': [[field.name, str(field.type)] for field in schema], 'rejected': {column: count for column, count in rejected.items() if count}}
+
+
+# Row counts, row groups and schema of every exported file, next to the files, to validate what readers load
+def save_parquet_manifest(folder, tables):
+	temporary = folder+"\\"+PARQUET_MANIFEST+".tmp"
+	with open(temporary, 'w', encoding='utf-8') as f:
+		json.dump({'compression': PARQUET_COMPRESSION, 'row_group_rows': PARQUET_ROW_GROUP_ROWS, 'tables': tables}, f, indent=1, sort_keys=True)
+	os.replace(temporary, folder+"\\"+PARQUET_MANIFEST)
+
+
+########################################################################  Timeline  ################################################################
+
+# The timeline is a single chronological stream of the events of every table: (time, artefact, host, description, source table,
+# source "index", time column). Each (table, time column) is read in time order, through the index of the column when it has one,
+# and the sorted streams are merged k-way, holding one row per stream in memory whatever the size of the tables.
+# Sources, by table pattern:
+#	- times: timestamp columns, each one gives an event per row
+#	- host: column naming the host (the target name otherwise)
+#	- description: columns joined as "Column: value | ..." when present in the table
+TIMELINE_SOURCES = [
+	{'tables': '*.evtx.csv', 'artefact': 'EVTX', 'times': ['TimeCreated'], 'host': 'Computer', 'description': ['Channel', 'EventId', 'MapDescription', 'UserName', 'RemoteHost', 'PayloadData1', 'PayloadData2', 'PayloadData3', 'ExecutableInfo']},
+	{'tables': 'prefetch_Timeline.csv', 'artefact': 'Prefetch', 'times': ['RunTime'], 'description': ['ExecutableName']},
+	{'tables': 'Amcache_*.csv', 'artefact': 'Amcache', 'times': ['FileKeyLastWriteTimestamp', 'InstallDate', 'DriverLastWriteTime'], 'description': ['Name', 'FullPath', 'ProgramName', 'KeyName', 'DriverName', 'Publisher', 'SHA1']},
+	{'tables': 'appcompatcache.csv', 'artefact': 'AppCompatCache', 'times': ['LastModifiedTimeUTC'], 'description': ['Path', 'Executed']},
+	{'tables': 'USNjournal.csv', 'artefact': 'USN journal', 'times': ['UpdateTimestamp'], 'description': ['ParentPath', 'Name', 'UpdateReasons']},
+	{'tables': 'registry.csv', 'artefact': 'Registry', 'times': ['LastWriteTimestamp'], 'description': ['Category', 'Description', 'KeyPath', 'ValueName', 'ValueData']},
+	{'tables': 'SrumECmd_*.csv', 'artefact': 'SRUM', 'times': ['Timestamp'], 'description': ['ExeInfo', 'UserName', 'BytesSent', 'BytesReceived']},
+	{'tables': 'lnk.csv', 'artefact': 'LNK', 'times': ['SourceCreated', 'SourceModified', 'SourceAccessed', 'TargetCreated', 'TargetModified', 'TargetAccessed'], 'description': ['SourceFile', 'LocalPath', 'Arguments']},
+	{'tables': 'RecycleBin.csv', 'artefact': 'Recycle bin', 'times': ['DeletedOn'], 'description': ['FileName', 'FileSize']},
+]
+
+TIMELINE_TABLE = "timeline"
+TIMELINE_CSV = "timeline.csv"
+TIMELINE_COLUMNS = ['time', 'artefact', 'host', 'description', 'source_table', 'source_index', 'time_column']
+TIMELINE_BATCH_ROWS = 20000
+
+# Integers sort before text in SQLite: this range keeps the parsed timestamps (epoch microseconds) and can use the column index
+TIMESTAMP_RANGE = " BETWEEN -9223372036854775808 AND 9223372036854775807"
+
+
+# (table, source, time column) to read, for the tables and views of the database
+def timeline_streams(con):
+	names = [row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY name")]
+	streams = []
+	for name in names:
+		if name == EVTX_GLOBAL_CSV or name == TIMELINE_TABLE:
+			continue
+		for source in TIMELINE_SOURCES:
+			if fnmatch.fnmatchcase(name, source['tables']):
+				columns = [row[1] for row in con.execute("PRAGMA table_info("+quote_identifier(name)+")")]
+				streams.extend((name, source, column) for column in source['times'] if column in columns)
+				break
+	return streams
+
+
+# Events of one (table, time column), in time order. Tables split by day on that column are read day after day.
+def timeline_events(con, table, source, time_column, hostname):
+	columns = [row[1] for row in con.execute("PRAGMA table_info("+quote_identifier(table)+")")]
+	host = source.get('host') if source.get('host') in columns else None
+	described = [column for column in source['description'] if column in columns]
+	selected = [time_column, 'index'] + ([host] if host else []) + described
+	schema = artefact_schema(table)
+	relations = [table]
+	if schema is not None and schema.partition == time_column:
+		relations = [view for view, day, first, last, rows in table_partitions(con, table) if day != UNDATED_PARTITION] or relations
+	first = 3 if host else 2
+	for relation in relations:
+		query = "SELECT "+", ".join(quote_identifier(c) for c in selected)+" FROM "+quote_identifier(relation)+" WHERE "+quote_identifier(time_column)+TIMESTAMP_RANGE+" ORDER BY "+quote_identifier(time_column)
+		for row in con.execute(query):
+			description = " | ".join(column+": "+str(value) for column, value in zip(described, row[first:]) if value is not None)
+			yield (row[0], source['artefact'], (row[2] if host else None) or hostname, description, table, row[1], time_column)
+
+
+def timeline_time(value):
+	return datetime_from_epoch(value).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def timeline_parquet_writer(path):
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+	text = pa.dictionary(pa.int32(), pa.string())
+	schema = pa.schema([('time', pa.timestamp('us', tz='UTC')), ('artefact', text), ('host', text), ('description', pa.string()),
+		('source_table', text), ('source_index', pa.int64()), ('time_column', text)])
+	return pa, schema, pq.ParquetWriter(path, schema, compression=PARQUET_COMPRESSION)
+
+
+# Merges the sorted streams and writes them, in one pass, to the TIMELINE_TABLE table (indexed on time), to a CSV file and, when
+# parquet_path is set, to a Parquet file. Returns the number of events.
+def create_timeline(db_path, csv_path, hostname, parquet_path=None):
+	con = open_ingest_connection(db_path)
+	parquet = None
+	try:
+		streams = timeline_streams(con)
+		Logger.info("Building the timeline from "+str(len(streams))+" sorted streams.")
+		drop_relation(con, TIMELINE_TABLE)
+		con.execute("CREATE TABLE "+TIMELINE_TABLE+" (time INTEGER, artefact TEXT, host TEXT, description TEXT, source_table TEXT, source_index INTEGER, time_column TEXT)")
+		insert = "INSERT INTO "+TIMELINE_TABLE+" VALUES (?, ?, ?, ?, ?, ?, ?)"
+		events = heapq.merge(*[timeline_events(con, table, source, column, hostname) for table, source, column in streams], key=lambda event: event[0])
+		if parquet_path:
+			pa, schema, parquet = timeline_parquet_writer(parquet_path+".tmp")
+		rows = 0
+		con.execute("BEGIN")
+		with open(csv_path+".tmp", 'w', newline='', encoding='utf-8') as f:
+			writer = csv.writer(f)
+			writer.writerow(TIMELINE_COLUMNS)
+			while True:
+				batch = list(islice(events, TIMELINE_BATCH_ROWS))
+				if not batch:
+					break
+				con.executemany(insert, batch)
+				writer.writerows((timeline_time(event[0]),) + event[1:] for event in batch)
+				if parquet is not None:
+					values = list(zip(*batch))
+					parquet.write_table(pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(values, schema)], schema=schema))
+				rows += len(batch)
+		con.execute("CREATE INDEX idx_"+TIMELINE_TABLE+"_time ON "+TIMELINE_TABLE+" (time)")
+		con.execute("COMMIT")
+		if parquet is not None:
+			parquet.close()
+			parquet = None
+			os.replace(parquet_path+".tmp", parquet_path)
+		os.replace(csv_path+".tmp", csv_path)
+	finally:
+		if parquet is not None:
+			parquet.close()
+		con.close()
+	Logger.info("Timeline: "+str(rows)+" events.")
+	return rows
+
+
+########################################################################  Full-text search  ########################################################
+
+# Optional (-S): the free-text columns of the known artefact tables get an FTS5 index, "[table]$fts", that reads its text from the
+# table's view (external content, so nothing is stored twice) and maps its rowids to the "index" of the rows. The trigram tokenizer
+# matches any substring of 3 characters or more, case insensitive, like LIKE '%x%' but through the index; SQLite builds without it
+# (before 3.34) fall back to word tokens. Sources, by table pattern:
+#	- columns: free-text columns indexed when present in the table
+#	- times: the first of these columns present in the table gives the time of a hit
+SEARCH_SOURCES = [
+	{'tables': '*.evtx.csv', 'artefact': 'EVTX', 'times': ['TimeCreated'], 'columns': ['MapDescription', 'UserName', 'RemoteHost', 'PayloadData1', 'PayloadData2', 'PayloadData3', 'PayloadData4', 'PayloadData5', 'PayloadData6', 'ExecutableInfo', 'Payload']},
+	{'tables': 'prefetch.csv', 'artefact': 'Prefetch', 'times': ['LastRun'], 'columns': ['ExecutableName', 'SourceFilename', 'Directories', 'FilesLoaded']},
+	{'tables': 'Amcache_*.csv', 'artefact': 'Amcache', 'times': ['FileKeyLastWriteTimestamp', 'KeyLastWriteTimestamp', 'DriverLastWriteTime', 'InstallDate'], 'columns': ['Name', 'FullPath', 'ProgramName', 'ProductName', 'Publisher', 'KeyName', 'DriverName', 'SHA1', 'Description']},
+	{'tables': 'appcompatcache.csv', 'artefact': 'AppCompatCache', 'times': ['LastModifiedTimeUTC'], 'columns': ['Path']},
+	{'tables': 'USNjournal.csv', 'artefact': 'USN journal', 'times': ['UpdateTimestamp'], 'columns': ['Name', 'ParentPath']},
+	{'tables': 'registry.csv', 'artefact': 'Registry', 'times': ['LastWriteTimestamp'], 'columns': ['KeyPath', 'ValueName', 'ValueData', 'ValueData2', 'ValueData3', 'Comment']},
+	{'tables': 'SrumECmd_*.csv', 'artefact': 'SRUM', 'times': ['Timestamp'], 'columns': ['ExeInfo', 'ExeInfoDescription', 'UserName', 'Sid']},
+	{'tables': 'lnk.csv', 'artefact': 'LNK', 'times': ['TargetModified', 'SourceModified'], 'columns': ['SourceFile', 'LocalPath', 'TargetIDAbsolutePath', 'NetworkPath', 'CommonPath', 'RelativePath', 'WorkingDirectory', 'Arguments', 'MachineID']},
+	{'tables': 'RecycleBin.csv', 'artefact': 'Recycle bin', 'times': ['DeletedOn'], 'columns': ['FileName', 'SourceName']},
+]
+
+SEARCH_SUFFIX = "$fts"
+SEARCH_TOKENIZERS = ["trigram", "unicode61 remove_diacritics 2"]
+SEARCH_LIMIT = 100
+
+# Tokens of context around the match in the hits (characters with the trigram tokenizer, 64 at most)
+SEARCH_SNIPPET_TOKENS = 48
+
+
+def search_source(table_name):
+	for source in SEARCH_SOURCES:
+		if fnmatch.fnmatchcase(table_name, source['tables']):
+			return source
+	return None
+
+
+def relation_columns(con, name):
+	return [row[1] for row in con.execute("PRAGMA table_info("+quote_identifier(name)+")")]
+
+
+# First tokenizer of SEARCH_TOKENIZERS this SQLite build knows
+def search_tokenizer(con):
+	for tokenizer in SEARCH_TOKENIZERS:
 		try:
-			df3 = pd.read_sql_query("SELECT * from \"TerminalServices-RemoteConnectionManager%4Operational.evtx.csv\" WHERE (EventId=1149)", con)
-		except Exception as e:
-			df3 = pd.DataFrame()
-		frame = [df,df2,df3]
-		result = pd.concat(frame)
-		result['TimeCreated'] = pd.to_datetime(result['TimeCreated'])
-		xlsx_preparer(result,writer,'RDP Events',workbook)
-	except Exception as e:
-		pass
-
-def application_installation_events(con, writer,workbook):
+			con.execute("CREATE VIRTUAL TABLE temp.tokenizer_check USING fts5(value, tokenize='"+tokenizer+"')")
+		except sqlite3.OperationalError:
+			continue
+		con.execute("DROP TABLE temp.tokenizer_check")
+		return tokenizer
+	raise RuntimeError("this SQLite build has no FTS5 support")
+
+
+# (Re)builds the index of a table from its view. Returns the indexed columns, none when the table has no free-text column.
+def create_search_index(con, table_name, tokenizer):
+	source = search_source(table_name)
+	columns = relation_columns(con, table_name)
+	indexed = [column for column in source['columns'] if column in columns]
+	drop_relation(con, table_name+SEARCH_SUFFIX)
+	if indexed:
+		con.execute("CREATE VIRTUAL TABLE "+quote_identifier(table_name+SEARCH_SUFFIX)+" USING fts5("+", ".join(quote_identifier(c) for c in indexed)+
+			", content="+quote_identifier(table_name)+", content_rowid='index', tokenize='"+tokenizer+"')")
+		con.execute("INSERT INTO "+quote_identifier(table_name+SEARCH_SUFFIX)+"("+quote_identifier(table_name+SEARCH_SUFFIX)+") VALUES ('rebuild')")
+	return indexed
+
+
+# The text of the command line is searched as a literal string, unless it is given in the FTS5 query syntax (--fts)
+def search_query(text, fts=False):
+	return text if fts else '"'+text.replace('"', '""')+'"'
+
+
+# Hits of one table: (sort key, time, artefact, table, index, rank, snippet). order is "time" (oldest first) or "rank" (best first).
+def table_hits(con, table_name, query, order, limit):
+	source = search_source(table_name)
+	columns = relation_columns(con, table_name)
+	time_column = next((column for column in source['times'] if column in columns), None)
+	fts = quote_identifier(table_name+SEARCH_SUFFIX)
+	selected = ("v."+quote_identifier(time_column) if time_column else "NULL")+", f.rowid, f.rank, snippet("+fts+", -1, '[', ']', '...', "+str(SEARCH_SNIPPET_TOKENS)+")"
+	sql = "SELECT "+selected+" FROM "+fts+" f LEFT JOIN "+quote_identifier(table_name)+" v ON v.\"index\" = f.rowid WHERE "+fts+" MATCH ?"
+	if order == 'time' and time_column:
+		# Parsed timestamps first (integers sort before text), rows without a time last
+		sql += " ORDER BY v."+quote_identifier(time_column)+" IS NULL, v."+quote_identifier(time_column)
+	else:
+		sql += " ORDER BY f.rank"
+	hits = []
+	for time_value, index, rank, snippet in con.execute(sql+" LIMIT ?", (query, limit)):
+		if order == 'time':
+			key = (0, time_value, "") if isinstance(time_value, int) else (1, 0, str(time_value)) if time_value is not None else (2, 0, "")
+		else:
+			key = rank
+		hits.append((key, time_value, source['artefact'], table_name, index, rank, snippet))
+	return hits
+
+
+# Runs a query over the indexes of a database, returns the first "limit" hits of all the tables and the number of indexed tables
+def search_database(db_path, query, order='time', limit=SEARCH_LIMIT, tables=None):
+	con = open_read_only(db_path)
 	try:
-		df = pd.read_sql_query("SELECT * from \"Application.evtx.csv\" WHERE (EventId=1033) OR (EventId=1034) OR (EventId=11707) OR (EventId=11708) OR (EventId=11724)", con)
-		df['TimeCreated'] = pd.to_datetime(df['TimeCreated'])
-		xlsx_preparer(df,writer,'App Install Events',workbook)
-	except Exception as e:
-		pass
-
-def services_events(con, writer,workbook):
+		names = [row[0][:-len(SEARCH_SUFFIX)] for row in con.execute("SELECT name FROM sqlite_master WHERE type='table' AND sql LIKE 'CREATE VIRTUAL TABLE%' AND name LIKE ? ESCAPE '\\'", ("%"+SEARCH_SUFFIX.replace("$", "\\$"),))]
+		names = [name for name in names if search_source(name) and (not tables or any(fnmatch.fnmatchcase(name, pattern) for pattern in tables))]
+		hits = []
+		for name in names:
+			hits.extend(table_hits(con, name, query, order, limit))
+	finally:
+		con.close()
+	hits.sort(key=lambda hit: hit[0])
+	return hits[:limit], len(names)
+
+
+def search_time(value):
+	if isinstance(value, int):
+		return timeline_time(value)
+	return "" if value is None else str(value)
+
+
+########################################################################  IOC sweep  ###############################################################
+
+# The sweep (-i) looks for a list of indicators in every loaded table, reading each table once whatever the number of indicators.
+# Hashes and IPv4 addresses are exact indicators: the hex and dotted tokens of the rows are looked up in sets. The other types
+# (domains, paths, file and service names, URLs, strings...) are substrings: all of them are found in one pass over the text of a
+# row, by an Aho-Corasick automaton (pyahocorasick) when it is installed, or else by a regular expression shaped as a trie of the
+# indicators. Matching is case insensitive. Hits go to the IOC_HITS_TABLE table, numbered in time order with a pointer to the
+# table and "index" of their row, and to the "IOC hits" sheet of the report.
+IOC_HITS_TABLE = "ioc_hits"
+IOC_HITS_COLUMNS = ['time', 'indicator', 'type', 'description', 'artefact', 'source_table', 'source_index', 'column', 'value']
+IOC_BATCH_ROWS = 20000
+
+# Exact types with the length of their values (None: checked by IOC_IPV4)
+IOC_EXACT_TYPES = {'md5': 32, 'sha1': 40, 'sha256': 64, 'ip': None}
+IOC_TYPE_ALIASES = {'ipv4': 'ip', 'ip-src': 'ip', 'ip-dst': 'ip', 'sha-1': 'sha1', 'sha-256': 'sha256', 'hash': ''}
+IOC_HASH_LENGTHS = {32: 'md5', 40: 'sha1', 64: 'sha256'}
+
+# Shorter substrings would hit almost every row
+IOC_MIN_LENGTH = 3
+
+# Characters of the matching cell kept in the hits
+IOC_VALUE_CHARS = 500
+
+IOC_HEX = re.compile(r'[0-9a-f]{32,}')
+IOC_IPV4 = re.compile(r'(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}(?!\d|\.\d)')
+
+# Cells of a row are joined with a character no indicator contains, so substrings never match across two cells
+IOC_CELL_SEPARATOR = "\0"
+
+
+# Type of an indicator: the given one (aliases resolved), guessed from the value when missing. Hashes and IPs that do not look like
+# one (IPv6 addresses...) are matched as substrings.
+def ioc_type(kind, value):
+	kind = (kind or "").strip().lower()
+	kind = IOC_TYPE_ALIASES.get(kind, kind)
+	looks_hex = re.fullmatch(r'[0-9a-f]+', value) is not None
+	if not kind:
+		if looks_hex and len(value) in IOC_HASH_LENGTHS:
+			return IOC_HASH_LENGTHS[len(value)], True
+		if IOC_IPV4.fullmatch(value):
+			return 'ip', True
+		return 'string', False
+	if kind in IOC_EXACT_TYPES:
+		length = IOC_EXACT_TYPES[kind]
+		exact = (looks_hex and len(value) == length) if length else IOC_IPV4.fullmatch(value) is not None
+		return kind, exact
+	return kind, False
+
+
+# Indicators of a CSV file with "value" and optionally "type" and "description" columns, or of a text file with one value per line
+# (lines starting with # are comments). Returns {'exact': {value: [indicators]}, 'substrings': {value: [indicators]}, 'skipped': n},
+# values being lower case and indicators (value, type, description).
+def load_indicators(path):
+	with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+		lines = [line for line in f.read().splitlines() if line.strip() and not line.lstrip().startswith('#')]
+	header = [column.strip().lower() for column in next(csv.reader(lines[:1]), [])]
+	if 'value' in header:
+		rows = [{key.strip().lower(): (item or "").strip() for key, item in row.items() if key} for row in csv.DictReader(lines[1:], fieldnames=header)]
+	else:
+		rows = [{'value': line.strip()} for line in lines]
+	indicators = {'exact': {}, 'substrings': {}, 'skipped': 0}
+	for row in rows:
+		value = row.get('value', "").lower()
+		if not value:
+			continue
+		kind, exact = ioc_type(row.get('type'), value)
+		if not exact and len(value) < IOC_MIN_LENGTH or IOC_CELL_SEPARATOR in value:
+			indicators['skipped'] += 1
+			continue
+		indicators['exact' if exact else 'substrings'].setdefault(value, []).append((row['value'], kind, row.get('description') or None))
+	return indicators
+
+
+# Regular expression finding, at each position of a text, the longest indicator starting there
+def trie_expression(words):
+	trie = {}
+	for word in words:
+		node = trie
+		for char in word:
+			node = node.setdefault(char, {})
+		node[''] = True
+
+	def pattern(node):
+		branches = [re.escape(char)+pattern(child) for char, child in sorted(node.items()) if char]
+		if not branches:
+			return ""
+		body = branches[0] if len(branches) == 1 else "(?:"+"|".join(branches)+")"
+		return "(?:"+body+")?" if '' in node else body
+	return re.compile("(?=("+pattern(trie)+"))", re.DOTALL)
+
+
+# Function giving every (start, indicator) occurrence of the substring indicators in a text, overlapping ones included
+def substring_matcher(words):
 	try:
-		df = pd.read_sql_query("SELECT * from \"System.evtx.csv\" WHERE (EventId=7034) OR (EventId=7035) OR (EventId=7036) OR (EventId=7040) OR (EventId=7045)", con)
-		df2 = pd.read_sql_query("SELECT * from \"Security.evtx.csv\" WHERE (EventId=4697)", con)
-		frame = [df,df2]
-		result = pd.concat(frame)
-		result['TimeCreated'] = pd.to_datetime(result['TimeCreated'])
-		xlsx_preparer(result,writer,'Services Events',workbook)
-	except Exception as e:
-		pass
-
-def WMI_events(con, writer,workbook):
+		import ahocorasick
+	except ImportError:
+		ahocorasick = None
+	if ahocorasick is not None:
+		automaton = ahocorasick.Automaton()
+		for word in words:
+			automaton.add_word(word, word)
+		automaton.make_automaton()
+		return lambda text: ((end - len(word) + 1, word) for end, word in automaton.iter(text)), "Aho-Corasick"
+	expression = trie_expression(words)
+
+	def find(text):
+		for match in expression.finditer(text):
+			found = match.group(1)
+			# Shorter indicators starting at the same position
+			for length in range(IOC_MIN_LENGTH, len(found) + 1):
+				if found[:length] in words:
+					yield match.start(), found[:length]
+	return find, "trie expression"
+
+
+# (start, indicator) of the exact indicators in a text: hex tokens (Amcache prefixes SHA1 values with 0000) and IPv4 addresses
+def exact_matches(text, exact, hashes, ips):
+	if hashes:
+		for match in IOC_HEX.finditer(text):
+			token = match.group()
+			if token in exact:
+				yield match.start(), token
+			elif len(token) == 44 and token.startswith("0000") and token[4:] in exact:
+				yield match.start() + 4, token[4:]
+	if ips:
+		for match in IOC_IPV4.finditer(text):
+			if match.group() in exact:
+				yield match.start(), match.group()
+
+
+# Sweeps one table, inserting its hits with "insert". Returns the rows read and the hits.
+def sweep_table(con, table_name, indicators, find, insert):
+	schema = artefact_schema(table_name)
+	columns = relation_columns(con, table_name)
+	swept = [column for column in columns if column != 'index' and not (schema and (column in schema.integers or column in schema.timestamps))]
+	source = next((source for source in TIMELINE_SOURCES if fnmatch.fnmatchcase(table_name, source['tables'])), None)
+	time_column = next((column for column in source['times'] if column in columns), None) if source else None
+	artefact = source['artefact'] if source else table_name
+	exact = indicators['exact']
+	hashes = any(kind != 'ip' for found in exact.values() for value, kind, description in found)
+	ips = any(kind == 'ip' for found in exact.values() for value, kind, description in found)
+
+	cursor = con.execute("SELECT \"index\", "+(quote_identifier(time_column) if time_column else "NULL")+", "+", ".join(quote_identifier(c) for c in swept)+" FROM "+quote_identifier(table_name))
+	rows = 0
+	hits = 0
+	while True:
+		batch = cursor.fetchmany(IOC_BATCH_ROWS)
+		if not batch:
+			break
+		rows += len(batch)
+		found_rows = []
+		for row in batch:
+			cells = ["" if value is None else str(value) for value in row[2:]]
+			# Cells lowered one by one: lowering can lengthen a cell ("İ" gives 2 characters), the cell ends come from the lowered ones
+			lowered = [cell.lower() for cell in cells]
+			text = IOC_CELL_SEPARATOR.join(lowered)
+			matches = [(start, word, exact) for start, word in exact_matches(text, exact, hashes, ips)] if exact else []
+			if find is not None:
+				matches.extend((start, word, indicators['substrings']) for start, word in find(text))
+			if not matches:
+				continue
+			ends = list(accumulate(len(cell) + 1 for cell in lowered))
+			seen = set()
+			for start, word, group in matches:
+				position = bisect_right(ends, start)
+				if (word, position, group is exact) in seen:
+					continue
+				seen.add((word, position, group is exact))
+				for value, kind, description in group[word]:
+					found_rows.append((row[1], value, kind, description, artefact, table_name, row[0], swept[position], cells[position][:IOC_VALUE_CHARS]))
+		if found_rows:
+			con.executemany(insert, found_rows)
+			hits += len(found_rows)
+	return rows, hits
+
+
+# Sweeps the loaded tables and rebuilds IOC_HITS_TABLE, hits numbered in time order. Returns the rows read and the hits.
+def sweep_database(db_path, tables, indicators):
+	find, engine = substring_matcher(set(indicators['substrings'])) if indicators['substrings'] else (None, None)
+	Logger.info("IOC sweep: "+str(len(indicators['exact']))+" exact and "+str(len(indicators['substrings']))+" substring indicators"+(" ("+engine+")" if engine else "")+
+		", "+str(indicators['skipped'])+" skipped.")
+	con = open_ingest_connection(db_path)
 	try:
-		df = pd.read_sql_query("SELECT * from \"Microsoft-Windows-WMI-Activity%4Operational.evtx.csv\" WHERE (EventId=5857) OR (EventId=5858) OR (EventId=5859) OR (EventId=5860) OR (EventId=5861)", con)
-		df['TimeCreated'] = pd.to_datetime(df['TimeCreated'])
-		xlsx_preparer(df,writer,'WMI Events',workbook)
-	except Exception as e:
-		pass
+		columns = ", ".join(quote_identifier(column)+(" INTEGER" if column in ('time', 'source_index') else " TEXT") for column in IOC_HITS_COLUMNS)
+		con.execute("CREATE TEMP TABLE ioc_hits_unsorted ("+columns+")")
+		insert = "INSERT INTO ioc_hits_unsorted VALUES ("+", ".join(["?"] * len(IOC_HITS_COLUMNS))+")"
+		total_rows = 0
+		total_hits = 0
+		con.execute("BEGIN")
+		for table_name in tables:
+			start = time.perf_counter()
+			with measure_stage('ioc_sweep', table_name) as values:
+				rows, hits = sweep_table(con, table_name, indicators, find, insert)
+				values.update(rows=rows, hits=hits)
+			total_rows += rows
+			total_hits += hits
+			Logger.info("IOC sweep "+table_name+": "+str(hits)+" hits in "+str(rows)+" rows, "+"%.1f" % (time.perf_counter() - start)+"s.")
+		drop_relation(con, IOC_HITS_TABLE)
+		con.execute("CREATE TABLE "+IOC_HITS_TABLE+" (\"index\" INTEGER PRIMARY KEY, "+columns+")")
+		selected = ", ".join(quote_identifier(column) for column in IOC_HITS_COLUMNS)
+		con.execute("INSERT INTO "+IOC_HITS_TABLE+" ("+selected+") SELECT "+selected+" FROM ioc_hits_unsorted ORDER BY time IS NULL, time, source_table, source_index")
+		for column in ('time', 'indicator'):
+			con.execute("CREATE INDEX "+quote_identifier("idx_"+IOC_HITS_TABLE+"_"+column)+" ON "+IOC_HITS_TABLE+" ("+quote_identifier(column)+")")
+		con.execute("COMMIT")
+		con.execute("DROP TABLE ioc_hits_unsorted")
+	finally:
+		con.close()
+	return total_rows, total_hits
 
-def PowerShell_events(con, writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * from \"Microsoft-Windows-PowerShell%4Operational.evtx.csv\" WHERE (EventId=4103) OR (EventId=4104)", con)
-		df['TimeCreated'] = pd.to_datetime(df['TimeCreated'])
-		xlsx_preparer(df,writer,'PowerShell Events',workbook)
-	except Exception as e:
-		pass
 
-def Process_events(con, writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * from \"Security.evtx.csv\" WHERE (EventId=4688) OR (EventId=4689)", con)
-		df2 = pd.read_sql_query("SELECT * from \"Application.evtx.csv\" WHERE (EventId=1000) OR (EventId=1001) OR (EventId=1002)", con)
-		df3 = pd.read_sql_query("SELECT * from \"System.evtx.csv\" WHERE (EventId=1001)", con)
-		frame = [df,df2,df3]
-		result = pd.concat(frame)
-		result['TimeCreated'] = pd.to_datetime(result['TimeCreated'])
-		xlsx_preparer(result,writer,'Process Events',workbook)
-	except Exception as e:
-		pass
+########################################################################  Scheduling  ##############################################################
 
-def Network_Share_events(con, writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * from \"Security.evtx.csv\" WHERE (EventId=5140) OR (EventId=5142) OR (EventId=5143) OR (EventId=5144) OR (EventId=5145)", con)
-		df['TimeCreated'] = pd.to_datetime(df['TimeCreated'])
-		xlsx_preparer(df,writer,'Share Events',workbook)
-	except Exception as e:
-		pass
+# A conversion stage: the *_to_csv function to call, the artefact folder it reads, its resource class, the output subfolder it writes
+# and the tool it runs
+Stage = namedtuple('Stage', ['name', 'function', 'source', 'resource', 'folder', 'tool'])
 
-def amcache_program_presence(con, writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * from \"Amcache_UnassociatedFileEntries.csv\"", con)
-		df2 = pd.read_sql_query("SELECT * from \"Amcache_AssociatedFileEntries.csv\"", con)
-		frame = [df,df2]
-		result = pd.concat(frame)
-		result['FileKeyLastWriteTimestamp'] = pd.to_datetime(result['FileKeyLastWriteTimestamp'])
-		result['LinkDate'] = pd.to_datetime(result['LinkDate'])
-		xlsx_preparer(result,writer,'Present programs (amcache)',workbook)
-	except Exception as e:
-		pass
-	
-	
+# Maximum number of stages of a given resource class running at the same time (classes not listed are only bounded by --jobs)
+#	- disk: stages reading huge raw files ($J)
+#	- tree: stages recursively walking the whole target root
+RESOURCE_LIMITS = {'disk': 1, 'tree': 2}
 
-def recyclebin(con,writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * from \"RecycleBin.csv\"", con)
-		df['DeletedOn'] = pd.to_datetime(df['DeletedOn'])
-		xlsx_preparer(df,writer,'RecycleBin',workbook)
-	except Exception as e:
-		pass
-	
 
-def prefetch_program_execution(con,writer,workbook):
+# evtx_engine: "evtxecmd" or "native" (evtx_native.py, whose source file stands for the tool in the manifest)
+def conversion_stages(target_root, evtx_engine="evtxecmd"):
+	if evtx_engine == "native":
+		evtx_stage = Stage('evtx', evtx_to_csv_native, target_root+"\\Windows\\System32\\winevt\\logs", 'cpu', 'EVTX', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evtx_native.py'))
+	else:
+		evtx_stage = Stage('evtx', evtx_to_csv, target_root+"\\Windows\\System32\\winevt\\logs", 'cpu', 'EVTX', 'Utils\\EvtxECmd\\EvtxECmd.exe')
+	return [
+		evtx_stage,
+		#Stage('evtx', evtx_to_csv_partial, target_root+"\\Windows\\System32\\winevt\\logs", 'cpu', 'EVTX', 'Utils\\EvtxECmd\\EvtxECmd.exe'),
+		Stage('prefetch', prefetch_to_csv, target_root+"\\Windows\\prefetch", 'cpu', 'Prefetch', 'Utils\\PECmd.exe'),
+		Stage('amcache', amcache_to_csv, target_root+"\\Windows\\AppCompat\\Programs", 'cpu', 'Amcache', 'Utils\\AmcacheParser.exe'),
+		Stage('appcompatcache', appcompatcache_to_csv, target_root+"\\Windows\\System32\\Config", 'cpu', 'AppCompatCache', 'Utils\\AppCompatCacheParser.exe'),
+		Stage('usnjournal', usnjournal_to_csv, target_root+"\\$Extend", 'disk', 'USNjournal', 'Utils\\MFTEcmd.exe'),
+		Stage('lnk', lnk_to_csv, target_root, 'tree', 'LNK', 'Utils\\LECmd.exe'),
+		Stage('recyclebin', recyclebin_to_csv, target_root, 'tree', 'RecycleBin', 'Utils\\RBCmd.exe'),
+		Stage('srum', srum_to_csv, target_root, 'tree', 'SRUM', 'Utils\\SrumECmd.exe'),
+		Stage('registries', registries_to_csv, target_root, 'tree', 'Registries', 'Utils\\RECmd\\RECmd.exe'),
+	]
+
+
+# Global limits shared by the hosts of a batch: one semaphore per resource class, plus "tools" for any tool process and "ingest"
+# for database loads
+def batch_slots(jobs, ingest_writers):
+	slots = {'tools': threading.BoundedSemaphore(jobs), 'ingest': threading.BoundedSemaphore(ingest_writers)}
+	for resource, limit in RESOURCE_LIMITS.items():
+		slots[resource] = threading.BoundedSemaphore(limit)
+	return slots
+
+
+# Holds the slots of the given kinds (none without slots). The resource class is taken before the tool slot, so that a stage
+# waiting for its resource never keeps a tool slot from the others.
+@contextmanager
+def acquire_slots(slots, kinds):
+	taken = []
 	try:
-		df = pd.read_sql_query("SELECT * from \"prefetch_Timeline.csv\"", con)
-		df['RunTime'] = pd.to_datetime(df['RunTime'])
-		xlsx_preparer(df,writer,'Program execution (prefetch)',workbook)
-	except Exception as e:
-		pass
-	
-
-def amcache_plugged_devices(con,writer,workbook):
+		for kind in kinds:
+			if slots is not None and kind in slots:
+				slots[kind].acquire()
+				taken.append(kind)
+		yield
+	finally:
+		for kind in reversed(taken):
+			slots[kind].release()
+
+
+# Removes the whitespaces of the files a stage produced and returns its CSV files as (path, table name), in a single walk of its
+# folder. The global EVTX CSV and the timeline are not loaded, as in database_csv_files.
+def stage_csv_files(folder):
+	files = []
+	for path, folders, names in os.walk(folder):
+		for name in sorted(names):
+			if ' ' in name:
+				os.replace(os.path.join(path, name), os.path.join(path, name.replace(' ', '_')))
+				name = name.replace(' ', '_')
+			if name.lower().endswith('.csv') and name not in (EVTX_GLOBAL_CSV, TIMELINE_CSV):
+				files.append((str(Path(path, name).resolve()), name))
+	return files
+
+
+# Runs a stage and removes the whitespaces of the files it produced, returns its wall time, its output files (folder_outputs) and
+# its CSV files (stage_csv_files) and the tool exit code. The tools often exit with a non-zero code after a partial success (one locked
+# or corrupt hive), so the code does not fail the stage: it is recorded and what the tool wrote is loaded. The stage is recorded in the
+# metrics, with the size of its source (fingerprint) if given.
+def run_stage(stage, output_dir, slots=None, source=None):
+	with acquire_slots(slots, [stage.resource, 'tools']):
+		# EVTX is the only stage with Python work (splitting global.csv, or the native parser), the others wait for their tool
+		with measure_stage('conversion', stage.name, profile=stage.name == 'evtx') as values:
+			start = time.perf_counter()
+			code = stage.function(stage.source, output_dir)
+			seconds = time.perf_counter() - start
+			folder = output_dir+"\\"+stage.folder
+			files = stage_csv_files(folder)
+			outputs = folder_outputs(folder, count=True)
+			values.update({'exit_code': code, 'rows': sum(output.get('lines', 0) for output in outputs.values()), 'bytes_in': (source or {}).get('bytes'),
+				'bytes_out': sum(output['size'] for output in outputs.values())})
+	return seconds, outputs, files, code
+
+
+# Runs the stages in a pool of "jobs" workers, never exceeding RESOURCE_LIMITS, and returns the wall time of each stage.
+# on_finished(stage, seconds, error, outputs, files, code) is called from the calling thread each time a stage ends (outputs, files and
+# the tool exit code are None when it failed). slots are the batch limits, if any, and sources the source fingerprint of each stage (for the metrics).
+def run_stages(stages, output_dir, jobs, on_finished=None, slots=None, sources=None):
+	pending = list(stages)
+	running = {}
+	in_use = {}
+	timings = {}
+	run = in_scope(run_stage)
+	with ThreadPoolExecutor(max_workers=jobs) as pool:
+		while pending or running:
+			for stage in list(pending):
+				if len(running) >= jobs:
+					break
+				limit = RESOURCE_LIMITS.get(stage.resource)
+				if limit is not None and in_use.get(stage.resource, 0) >= limit:
+					continue
+				pending.remove(stage)
+				in_use[stage.resource] = in_use.get(stage.resource, 0) + 1
+				Logger.info("Starting stage "+stage.name+".")
+				running[pool.submit(run, stage, output_dir, slots, (sources or {}).get(stage.name))] = stage
+
+			done, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in done:
+				stage = running.pop(future)
+				in_use[stage.resource] -= 1
+				error = None
+				outputs = None
+				files = None
+				code = None
+				try:
+					timings[stage.name], outputs, files, code = future.result()
+					Logger.info("Stage "+stage.name+" finished in "+"%.1f" % timings[stage.name]+"s"+(" (tool exit code "+str(code)+")" if code else "")+".")
+				except Exception as e:
+					timings[stage.name] = None
+					error = repr(e)
+					Logger.info("Stage "+stage.name+" failed: "+error)
+				if on_finished:
+					on_finished(stage, timings[stage.name], error, outputs, files, code)
+	return timings
+
+
+def log_stage_timings(timings):
+	Logger.info("Stage wall times:")
+	for name, seconds in timings.items():
+		if seconds is None:
+			Logger.info("\t"+name+": failed")
+		else:
+			Logger.info("\t"+name+": "+"%.1f" % seconds+"s")
+
+
+# Returns the wall time of each stage that ran (None for failed stages). Tables are loaded while the conversion goes on: the CSV
+# files of each stage are queued for a loader thread as soon as the stage ends, those of the stages already up to date first, so
+# the loads overlap with the tools still running. With report_prefetch (see prefetch_report_scans), the loader also scans each
+# loaded table for the report.
+def convert_target(target_root,output_dir,db_path,jobs=1,ingest_workers=1,manifest=None,force=(),slots=None,evtx_engine="evtxecmd",partition_rows=None,report_prefetch=None):
+	if manifest is None:
+		manifest = load_manifest(output_dir)
+	timings = {}
+
+	stale = []
+	fresh = []
+	inputs = {}
+	sources = {}
+	for stage in conversion_stages(target_root, evtx_engine):
+		if stage.source not in sources:
+			sources[stage.source] = folder_fingerprint(stage.source)
+		inputs[stage.name] = {'source': sources[stage.source], 'tool': file_fingerprint(stage.tool)}
+		if not is_forced(stage.name, force) and conversion_up_to_date(manifest, stage, inputs[stage.name], output_dir):
+			Logger.info("Stage "+stage.name+" is up to date, skipping.")
+			fresh.append(stage)
+		else:
+			stale.append(stage)
+
+	tool = {'schemas': schemas_digest()}
+	loaded = {'rows': 0, 'bytes_in': 0}
+	# (stage name, CSV files) to load, None once every stage ended
+	batches = Queue()
+	loader = {'seconds': 0, 'error': None}
+
+	def on_loaded(csv_path, table_name, rows):
+		source = file_fingerprint(csv_path)
+		record_stage(manifest, 'table:'+table_name, {'source': source, 'tool': table_tool(tool, table_name, partition_rows), 'status': 'done', 'rows': rows})
+		record_metrics('table', table_name, {'rows': rows, 'bytes_in': source['size'] if source else None})
+		loaded['rows'] += rows
+		loaded['bytes_in'] += source['size'] if source else 0
+
+	def load_batch(name, files):
+		tables = []
+		for csv_path, table_name in files:
+			entry = {'source': file_fingerprint(csv_path), 'tool': table_tool(tool, table_name, partition_rows)}
+			if not is_forced('table:'+table_name, force) and table_up_to_date(manifest, table_name, entry, db_path):
+				Logger.info("Table "+table_name+" is up to date, skipping.")
+			else:
+				tables.append((csv_path, table_name))
+		if not tables:
+			return
+		loaded.update(rows=0, bytes_in=0)
+		with acquire_slots(slots, ['ingest']):
+			with measure_stage('load', name, profile=True) as values:
+				start = time.perf_counter()
+				#create_database(output_dir, db_name)
+				load_database(output_dir, db_path, ingest_workers, tables, on_loaded, partition_rows)
+				loader['seconds'] += time.perf_counter() - start
+				values.update(loaded, tables=len(tables), bytes_out=os.path.getsize(db_path) if os.path.exists(db_path) else None)
+		if report_prefetch is not None:
+			prefetch_report_scans(db_path, report_prefetch, [table_name for csv_path, table_name in tables])
+
+	# A failed load stops the loads (the tables left are loaded by the next run), the conversion goes on
+	def load_batches():
+		while True:
+			batch = batches.get()
+			if batch is None:
+				return
+			if loader['error'] is None:
+				try:
+					load_batch(*batch)
+				except Exception as e:
+					loader['error'] = e
+					Logger.info("Loading the tables of "+batch[0]+" failed: "+repr(e))
+
+	def on_finished(stage, seconds, error, outputs, files, code):
+		entry = dict(inputs[stage.name], status='failed' if error else 'done', seconds=seconds, error=error)
+		if not error:
+			entry.update(outputs=outputs, exit_code=code)
+		record_stage(manifest, stage.name, entry)
+		# What a failed tool wrote is still loaded, as a partial result
+		batches.put((stage.name, files if files is not None else stage_csv_files(output_dir+"\\"+stage.folder)))
+
+	thread = threading.Thread(target=in_scope(load_batches), name="loader")
+	thread.start()
 	try:
-		df = pd.read_sql_query("SELECT * from \"Amcache_DevicePnps.csv\"", con)
-		df['FileKeyLastWriteTimestamp'] = pd.to_datetime(df['FileKeyLastWriteTimestamp'])
-		xlsx_preparer(df,writer,'Amcache plugged devices',workbook)
-	except Exception as e:
-		pass
-	
+		for stage in fresh:
+			batches.put((stage.name, stage_csv_files(output_dir+"\\"+stage.folder)))
+		Logger.info("Converting artefacts to CSV ("+str(jobs)+" concurrent jobs), loading the tables as they come.")
+		timings.update(run_stages(stale, output_dir, jobs, on_finished, slots, {name: entry['source'] for name, entry in inputs.items()}))
+	finally:
+		batches.put(None)
+		thread.join()
+	if loader['error'] is not None:
+		raise loader['error']
+	timings['database'] = loader['seconds']
+	log_stage_timings(timings)
+	return timings
 
-def drivers(con,writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * from \"Amcache_DriveBinaries.csv\"", con)
-		df['FileKeyLastWriteTimestamp'] = pd.to_datetime(df['FileKeyLastWriteTimestamp'])
-		df['DriverTimeStamp'] = pd.to_datetime(df['DriverTimeStamp'])
-		df['DriverLastWriteTime'] = pd.to_datetime(df['DriverLastWriteTime'])
-		xlsx_preparer(df,writer,'Amcache drivers',workbook)
-	except Exception as e:
-		pass
-	
 
-def installed_programs(con,writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * from \"Amcache_ProgramEntries.csv\"", con)
-		df['FileKeyLastWriteTimestamp'] = pd.to_datetime(df['FileKeyLastWriteTimestamp'])
-		df['InstallDateArpLastModified'] = pd.to_datetime(df['InstallDateArpLastModified'])
-		df['InstallDate'] = pd.to_datetime(df['InstallDate'])
-		df['InstallDateMsi'] = pd.to_datetime(df['InstallDateMsi'])
-		df['InstallDateFromLinkFile'] = pd.to_datetime(df['InstallDateFromLinkFile'])
-		xlsx_preparer(df,writer,'Amcache installed programs',workbook)
-	except Exception as e:
-		pass
-	
+########################################################################  Manifest  ################################################################
 
-def shortcuts(con,writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * from \"lnk.csv\"", con)
-		df['SourceCreated'] = pd.to_datetime(df['SourceCreated'])
-		df['SourceModified'] = pd.to_datetime(df['SourceModified'])
-		df['SourceAccessed'] = pd.to_datetime(df['SourceAccessed'])
-		df['TargetCreated'] = pd.to_datetime(df['TargetCreated'])
-		df['TargetModified'] = pd.to_datetime(df['TargetModified'])
-		df['TargetAccessed'] = pd.to_datetime(df['TargetAccessed'])
-		df['TrackerCreatedOn'] = pd.to_datetime(df['TrackerCreatedOn'])
-		xlsx_preparer(df,writer,'Shortcuts',workbook)
-	except Exception as e:
-		pass
-	
+# windissect_manifest.json, in the output folder, records for each stage (conversion, table load, report) what it ran on (input
+# fingerprints, tool version) and what it produced. A stage whose record still matches is skipped, so an interrupted or repeated run
+# resumes from the first stale or failed stage. Stage names: the conversion stage names, "table:[table name]" and "report".
+MANIFEST_NAME = "windissect_manifest.json"
 
-def service_crash(con,writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * from \"System.evtx.csv\" WHERE (EventId=7034)", con)
-		df['TimeCreated'] = pd.to_datetime(df['TimeCreated'])
-		xlsx_preparer(df,writer,'Service crash',workbook)
-	except Exception as e:
-		pass
-	
 
-def application_error(con,writer,workbook):
+def load_manifest(output_dir):
+	path = output_dir+"\\"+MANIFEST_NAME
 	try:
-		df = pd.read_sql_query("SELECT * from \"Application.evtx.csv\" WHERE (EventId=1000) OR (EventId=1001) OR (EventId=1002)", con)
-		df['TimeCreated'] = pd.to_datetime(df['TimeCreated'])
-		xlsx_preparer(df,writer,'Application error',workbook)
-	except Exception as e:
-		pass
-	
-	
+		with open(path, 'r', encoding='utf-8') as f:
+			stages = json.load(f).get('stages', {})
+	except (OSError, ValueError):
+		stages = {}
+	# Stages are recorded both by convert_target and by its loader thread
+	return {'path': path, 'stages': stages, 'lock': threading.Lock()}
 
-def registry_program_execution(con,writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * FROM \"registry.csv\" WHERE \"Category\" LIKE 'Program Execution'", con)
-		df['LastWriteTimestamp'] = pd.to_datetime(df['LastWriteTimestamp'])
-		xlsx_preparer(df,writer,'Program execution (registry)',workbook)
-	except Exception as e:
-		pass
 
+# Written after every stage (through a temporary file) so that a crash never loses finished stages
+def save_manifest(manifest):
+	temporary = manifest['path']+".tmp"
+	with open(temporary, 'w', encoding='utf-8') as f:
+		json.dump({'stages': manifest['stages']}, f, indent=1, sort_keys=True)
+	os.replace(temporary, manifest['path'])
 
-def registry_network_shares(con,writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * FROM \"registry.csv\" WHERE \"Category\" LIKE 'Network Shares'", con)
-		df['LastWriteTimestamp'] = pd.to_datetime(df['LastWriteTimestamp'])
-		xlsx_preparer(df,writer,'Network shares (registry)',workbook)
-	except Exception as e:
-		pass
 
-def registry_system_info(con,writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * FROM \"registry.csv\" WHERE \"Category\" LIKE 'System Info'", con)
-		df['LastWriteTimestamp'] = pd.to_datetime(df['LastWriteTimestamp'])
-		xlsx_preparer(df,writer,'System info',workbook)
-	except Exception as e:
-		pass
+def record_stage(manifest, name, entry):
+	entry['finished'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+	with manifest['lock']:
+		manifest['stages'][name] = entry
+		save_manifest(manifest)
 
 
-def registry_third_party_applications(con,writer,workbook):
-	try:
-		df = pd.read_sql_query("SELECT * FROM \"registry.csv\" WHERE \"Category\" LIKE 'Third Party Applications'", con)
-		df['LastWriteTimestamp'] = pd.to_datetime(df['LastWriteTimestamp'])
-		xlsx_preparer(df,writer,'3rd party applications',workbook)
-	except Exception as e:
-		pass
+# --force accepts stage names or patterns ("table:*", "all")
+def is_forced(name, force):
+	return any(pattern == 'all' or fnmatch.fnmatchcase(name, pattern) for pattern in force)
 
 
-def registry_user_activity(con,writer,workbook):
+def file_fingerprint(path):
 	try:
-		df = pd.read_sql_query("SELECT * FROM \"registry.csv\" WHERE \"Category\" LIKE 'User Activity'", con)
-		df['LastWriteTimestamp'] = pd.to_datetime(df['LastWriteTimestamp'])
-		xlsx_preparer(df,writer,'User Activity (registry)',workbook)
-	except Exception as e:
-		pass
-
-def registry_vss_info(con,writer,workbook):
+		st = os.stat(path)
+	except OSError:
+		return None
+	return {'path': path, 'size': st.st_size, 'mtime': st.st_mtime_ns}
+
+
+# Paths, sizes and modification times of every file under a folder, summed up in a digest
+def folder_fingerprint(folder):
+	digest = hashlib.sha1()
+	files = 0
+	size = 0
+	for path, folders, names in os.walk(folder):
+		folders.sort()
+		for name in sorted(names):
+			full_path = os.path.join(path, name)
+			try:
+				st = os.stat(full_path)
+			except OSError:
+				continue
+			digest.update((os.path.relpath(full_path, folder)+"|"+str(st.st_size)+"|"+str(st.st_mtime_ns)+"\n").encode('utf-8', 'replace'))
+			files += 1
+			size += st.st_size
+	return {'path': folder, 'files': files, 'bytes': size, 'digest': digest.hexdigest()}
+
+
+def count_lines(path):
+	lines = 0
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1024 * 1024), b''):
+			lines += block.count(b'\n')
+	return lines
+
+
+# Files produced in an output folder: size, and when count is set the number of data lines of CSV files
+def folder_outputs(folder, count=False):
+	outputs = {}
+	if not os.path.isdir(folder):
+		return outputs
+	for name in sorted(os.listdir(folder)):
+		full_path = os.path.join(folder, name)
+		if os.path.isfile(full_path):
+			outputs[name] = {'size': os.path.getsize(full_path)}
+			if count and name.endswith('.csv'):
+				outputs[name]['lines'] = max(count_lines(full_path) - 1, 0)
+	return outputs
+
+
+def stage_entry_matches(manifest, name, inputs):
+	entry = manifest['stages'].get(name)
+	return entry is not None and entry.get('status') == 'done' and all(entry.get(key) == value for key, value in inputs.items())
+
+
+def conversion_up_to_date(manifest, stage, inputs, output_dir):
+	if not stage_entry_matches(manifest, stage.name, inputs):
+		return False
+	recorded = manifest['stages'][stage.name].get('outputs', {})
+	current = folder_outputs(output_dir+"\\"+stage.folder)
+	return all(name in current and current[name]['size'] == output['size'] for name, output in recorded.items())
+
+
+def table_up_to_date(manifest, table_name, inputs, db_path):
+	if not stage_entry_matches(manifest, 'table:'+table_name, inputs) or not os.path.exists(db_path):
+		return False
+	con = sqlite3.connect(db_path)
 	try:
-		df = pd.read_sql_query("SELECT * FROM \"registry.csv\" WHERE \"Category\" LIKE 'Volume Shadow Copies'", con)
-		df['LastWriteTimestamp'] = pd.to_datetime(df['LastWriteTimestamp'])
-		xlsx_preparer(df,writer,'VSS info (registry)',workbook)
-	except Exception as e:
-		pass
-
-
-
-def srum_network_usages(con,writer,workbook):
+		return con.execute("SELECT 1 FROM sqlite_master WHERE name=?", (table_name,)).fetchone() is not None
+	except sqlite3.Error:
+		return False
+	finally:
+		con.close()
+
+
+# A schema change means the tables must be loaded again
+def schemas_digest():
+	return hashlib.sha1(repr(ARTEFACT_SCHEMAS).encode()).hexdigest()
+
+
+# Loader settings of a table: a change of --partition only loads again the tables that can be split
+def table_tool(tool, table_name, partition_rows=None):
+	schema = artefact_schema(table_name)
+	if schema is None or schema.partition is None or partition_rows is None:
+		return tool
+	return dict(tool, partition_rows=partition_rows)
+
+
+# The report is up to date when the loaded tables did not change since it was written, and neither it nor this script changed
+def report_inputs(manifest, report_config=None):
+	tables = sorted((name, entry.get('source'), entry.get('tool'), entry.get('rows')) for name, entry in manifest['stages'].items() if name.startswith('table:'))
+	return {'tables': hashlib.sha1(json.dumps(tables, sort_keys=True).encode()).hexdigest(), 'tool': file_fingerprint(os.path.abspath(__file__)),
+		'config': file_fingerprint(report_config) if report_config else None}
+
+
+# scans: report scans done while loading (prefetch_report_scans), workers: processes scanning the other tables
+def create_report_stage(db_path, output_report, manifest, force=(), report_config=None, scans=None, workers=1):
+	inputs = report_inputs(manifest, report_config)
+	sweep = manifest['stages'].get('ioc-sweep', {})
+	inputs['ioc_sweep'] = [sweep.get('iocs'), sweep.get('hits'), sweep.get('finished')]
+	entry = manifest['stages'].get('report')
+	if not os.path.exists(db_path):
+		Logger.info("No database (no stage produced a CSV file), skipping the report.")
+		close_report_scans(scans or {})
+		return
+	if not is_forced('report', force) and stage_entry_matches(manifest, 'report', inputs) and entry.get('output') == file_fingerprint(output_report):
+		Logger.info("Report is up to date, skipping.")
+		close_report_scans(scans or {})
+		return
+	start = time.perf_counter()
+	with measure_stage('report', 'report', profile=True) as values:
+		values['rows'] = create_xlsx_report(db_path, output_report, Logger, load_report_sheets(report_config), scans, workers)
+		values['bytes_out'] = os.path.getsize(output_report)
+	record_stage(manifest, 'report', dict(inputs, status='done', seconds=time.perf_counter() - start, output=file_fingerprint(output_report)))
+
+
+# A table is exported again when it was loaded again since its Parquet file was written
+def export_parquet_stage(db_path, output_dir, manifest, force=()):
+	folder = output_dir+"\\"+PARQUET_FOLDER
+	os.makedirs(folder, exist_ok=True)
+	Logger.info("Exporting tables to Parquet.")
+	con = sqlite3.connect(db_path)
+	tables = {}
 	try:
-		df = pd.read_sql_query("SELECT * FROM \"SrumECmd_NetworkUsages_Output.csv\"", con)
-		df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-		xlsx_preparer(df,writer,'Network usage',workbook)
-	except Exception as e:
-		pass
-
-
-def srum_app_resource_use(con,writer,workbook):
+		with profiled('parquet'):
+			for csv_path, table_name in database_csv_files(output_dir):
+				table_entry = manifest['stages'].get('table:'+table_name)
+				if table_entry is None or table_entry.get('status') != 'done':
+					continue
+				if con.execute("SELECT 1 FROM sqlite_master WHERE name=?", (table_name,)).fetchone() is None:
+					continue
+				name = 'parquet:'+table_name
+				path = folder+"\\"+parquet_file(table_name).replace("/", "\\")
+				inputs = {'source': table_entry.get('source'), 'tool': table_entry.get('tool'), 'loaded_rows': table_entry.get('rows')}
+				entry = manifest['stages'].get(name)
+				if not is_forced(name, force) and stage_entry_matches(manifest, name, inputs) and entry.get('output') == file_fingerprint(path):
+					Logger.info("Parquet "+table_name+" is up to date, skipping.")
+					tables[table_name] = dict(entry['table'], file=parquet_file(table_name))
+					continue
+				start = time.perf_counter()
+				try:
+					with measure_stage('parquet', table_name) as values:
+						table = export_parquet_table(con, table_name, path)
+						values.update(rows=table['rows'], bytes_out=table['bytes'])
+				except Exception as e:
+					Logger.info("Could not export "+table_name+" to Parquet: "+repr(e))
+					record_stage(manifest, name, dict(inputs, status='failed', error=repr(e)))
+					continue
+				if table['rows'] != table_entry.get('rows'):
+					Logger.info("Parquet "+table_name+": "+str(table['rows'])+" rows written but "+str(table_entry.get('rows'))+" rows loaded.")
+				tables[table_name] = dict(table, file=parquet_file(table_name))
+				record_stage(manifest, name, dict(inputs, status='done', seconds=time.perf_counter() - start, table=table, output=file_fingerprint(path)))
+				Logger.info("Parquet "+table_name+": "+str(table['rows'])+" rows, "+str(table['row_groups'])+" row groups.")
+	finally:
+		con.close()
+	save_parquet_manifest(folder, tables)
+
+
+# The timeline is built again when a table was loaded again since, or when the sources or this script changed
+def create_timeline_stage(db_path, output_dir, hostname, manifest, force=(), parquet=False):
+	csv_path = output_dir+"\\"+TIMELINE_CSV
+	parquet_path = output_dir+"\\"+PARQUET_FOLDER+"\\timeline.parquet" if parquet else None
+	inputs = report_inputs(manifest)
+	inputs['host'] = hostname
+	outputs = {'csv': file_fingerprint(csv_path), 'parquet': file_fingerprint(parquet_path) if parquet else None}
+	entry = manifest['stages'].get('timeline')
+	if not is_forced('timeline', force) and stage_entry_matches(manifest, 'timeline', inputs) and entry.get('outputs') == outputs and outputs['csv'] is not None and (not parquet or outputs['parquet'] is not None):
+		Logger.info("Timeline is up to date, skipping.")
+		return
+	if parquet:
+		os.makedirs(output_dir+"\\"+PARQUET_FOLDER, exist_ok=True)
+	start = time.perf_counter()
+	with measure_stage('timeline', 'timeline', profile=True) as values:
+		rows = create_timeline(db_path, csv_path, hostname, parquet_path)
+		values.update(rows=rows, bytes_out=os.path.getsize(csv_path))
+	outputs = {'csv': file_fingerprint(csv_path), 'parquet': file_fingerprint(parquet_path) if parquet else None}
+	record_stage(manifest, 'timeline', dict(inputs, status='done', seconds=time.perf_counter() - start, rows=rows, outputs=outputs))
+
+
+# A table is indexed again when it was loaded again since, or when its indexed columns changed (SEARCH_SOURCES). Indexes of tables
+# that are no longer in the database are dropped.
+def create_search_stage(db_path, manifest, force=()):
+	con = open_ingest_connection(db_path)
 	try:
-		df = pd.read_sql_query("SELECT * FROM \"SrumECmd_AppResourceUseInfo_Output.csv\"", con)
-		df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-		xlsx_preparer(df,writer,'Apps resource use',workbook)
-	except Exception as e:
-		pass
-
+		tokenizer = search_tokenizer(con)
+		names = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+		for name in sorted(names):
+			if name.endswith(SEARCH_SUFFIX) and name[:-len(SEARCH_SUFFIX)] not in names:
+				drop_relation(con, name)
+		Logger.info("Indexing the free-text columns for search ("+tokenizer.split()[0]+" tokenizer).")
+		for table_name in sorted(names):
+			source = search_source(table_name)
+			table_entry = manifest['stages'].get('table:'+table_name)
+			if source is None or table_name == EVTX_GLOBAL_CSV or table_entry is None or table_entry.get('status') != 'done':
+				continue
+			name = 'search:'+table_name
+			inputs = {'source': table_entry.get('source'), 'tool': table_entry.get('tool'), 'loaded_rows': table_entry.get('rows'), 'columns': source['columns'], 'tokenizer': tokenizer}
+			if not is_forced(name, force) and stage_entry_matches(manifest, name, inputs) and (table_name+SEARCH_SUFFIX in names or not manifest['stages'][name].get('columns_indexed')):
+				continue
+			start = time.perf_counter()
+			try:
+				with measure_stage('search', table_name) as values:
+					con.execute("BEGIN")
+					indexed = create_search_index(con, table_name, tokenizer)
+					con.execute("COMMIT")
+					values.update(rows=table_entry.get('rows'), columns=len(indexed))
+			except sqlite3.Error as e:
+				Logger.info("Could not index "+table_name+" for search: "+repr(e))
+				# Without a journal a rollback is undefined (INGEST_PRAGMAS): the partial index is dropped so that search never reads it
+				try:
+					if con.in_transaction:
+						con.execute("COMMIT")
+					drop_relation(con, table_name+SEARCH_SUFFIX)
+				except sqlite3.Error as drop_error:
+					Logger.info("Could not drop the partial search index of "+table_name+": "+repr(drop_error))
+				record_stage(manifest, name, dict(inputs, status='failed', error=repr(e)))
+				continue
+			seconds = time.perf_counter() - start
+			record_stage(manifest, name, dict(inputs, status='done', seconds=seconds, columns_indexed=indexed))
+			Logger.info("Search index "+table_name+": "+str(len(indexed))+" columns in "+"%.1f" % seconds+"s.")
+	finally:
+		con.close()
 
 
-def create_xlsx_report(db_path, output_report, Logger):
+# The sweep is done again when tables were loaded again, or when the indicator file or this script changed
+def create_ioc_sweep_stage(db_path, manifest, ioc_path, force=()):
+	inputs = report_inputs(manifest)
+	inputs['iocs'] = file_fingerprint(os.path.abspath(ioc_path))
 	con = sqlite3.connect(db_path)
-	Logger.info("Creating XLSX report.")
-	with pd.ExcelWriter(output_report, engine="xlsxwriter") as writer:  
-		workbook = writer.book
-		cleared_audit_log(con,writer,workbook)
-		logon_events(con, writer,workbook)
-		account_management_events(con, writer,workbook)
-		scheduled_tasks_events(con, writer,workbook)
-		RDP_events(con, writer,workbook)
-		application_installation_events(con, writer,workbook)
-		services_events(con, writer,workbook)
-		WMI_events(con, writer,workbook)
-		PowerShell_events(con, writer,workbook)
-		Process_events(con, writer,workbook)
-		Network_Share_events(con, writer,workbook)
-		amcache_program_presence(con,writer,workbook)
-		recyclebin(con,writer,workbook)
-		prefetch_program_execution(con,writer,workbook)
-		registry_program_execution(con,writer,workbook)
-		amcache_plugged_devices(con,writer,workbook)
-		drivers(con,writer,workbook)
-		installed_programs(con,writer,workbook)
-		shortcuts(con,writer,workbook)
-		registry_program_execution(con,writer,workbook)
-		registry_system_info(con,writer,workbook)
-		registry_network_shares(con,writer,workbook)
-		registry_third_party_applications(con,writer,workbook)
-		srum_network_usages(con,writer,workbook)
-
-
-def convert_target(target_root,output_dir,db_path):
-	evtx_folder = target_root+"\\Windows\\System32\\winevt\\logs"
-	prefetch_folder = target_root+"\\Windows\\prefetch"
-	amcache_folder = target_root+"\\Windows\\AppCompat\\Programs"
-	appcompatcache_folder = target_root+"\\Windows\\System32\\Config"
-	usnjournal_folder = target_root+"\\$Extend"
-	lnk_folder = target_root
-	recyclebin_folder = target_root
-	srum_folder = target_root
-	registries_folder = target_root
-
-	Logger.info("Converting artefacts to CSV.")
-	evtx_to_csv(evtx_folder, output_dir)
-	#evtx_to_csv_partial(evtx_folder, output_dir)
-	prefetch_to_csv(prefetch_folder, output_dir)
-	amcache_to_csv(amcache_folder,output_dir)
-	appcompatcache_to_csv(appcompatcache_folder,output_dir)
-	usnjournal_to_csv(usnjournal_folder, output_dir)
-	lnk_to_csv(lnk_folder, output_dir)
-	recyclebin_to_csv(recyclebin_folder, output_dir)
-	srum_to_csv(srum_folder,output_dir)
-	registries_to_csv(registries_folder, output_dir)
-	remove_whitespaces_filename(output_dir)
-
-	#create_database(output_dir, db_name)
-	create_database_alt(output_dir, db_path)
+	try:
+		existing = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+	finally:
+		con.close()
+	if not is_forced('ioc-sweep', force) and stage_entry_matches(manifest, 'ioc-sweep', inputs) and IOC_HITS_TABLE in existing:
+		Logger.info("IOC sweep is up to date, skipping.")
+		return
+	tables = sorted(name[len('table:'):] for name, entry in manifest['stages'].items() if name.startswith('table:') and entry.get('status') == 'done' and name[len('table:'):] in existing)
+	start = time.perf_counter()
+	with measure_stage('ioc_sweep', 'ioc-sweep', profile=True) as values:
+		rows, hits = sweep_database(db_path, tables, load_indicators(ioc_path))
+		values.update(rows=rows, hits=hits, tables=len(tables))
+	record_stage(manifest, 'ioc-sweep', dict(inputs, status='done', seconds=time.perf_counter() - start, rows=rows, hits=hits, finished=time.strftime('%Y-%m-%dT%H:%M:%S')))
+	Logger.info("IOC sweep: "+str(hits)+" hits in "+str(rows)+" rows of "+str(len(tables))+" tables.")
+
+
+# Each run appends the metrics of its stages (metrics.py) to windissect_metrics.jsonl in the output folder. With --profile, the Python
+# side of the conversion (EVTX), database, Parquet, timeline and report stages is profiled, in the windissect_profile subfolder of each host.
+METRICS_FILE = "windissect_metrics.jsonl"
+PROFILE_FOLDER = "windissect_profile"
+
+# What each tool prints goes to a log in this subfolder of each host (supervisor.py): [stage]_[tool].log
+TOOL_LOG_FOLDER = "windissect_tools"
+
+
+# Everything win_dissect does for one acquisition, with the options of the command line. Returns the conversion stages that failed.
+def dissect_host(target_root, output_dir, hostname, config, slots=None):
+	db_path = output_dir+"\\"+hostname+".db"
+	output_report = output_dir+"\\"+hostname+".xlsx"
+	if not os.path.exists(output_dir):
+		os.makedirs(output_dir)
+	manifest = load_manifest(output_dir)
+	# Metrics of this host are recorded with its output folder, profiles go to a subfolder of it
+	with metrics_scope(output_dir, output_dir+"\\"+PROFILE_FOLDER if config['profile'] else None):
+		# Report queries start as soon as their tables are loaded
+		prefetch = {'sheets': load_report_sheets(config['report_config']), 'scans': {}} if 'xlsx' in config['format'] else None
+		timings = convert_target(target_root,output_dir,db_path,config['jobs'],config['ingest_workers'],manifest,config['force'],slots,config['evtx_engine'],config['partition'],prefetch)
+
+		if config['search_index']:
+			create_search_stage(db_path, manifest, config['force'])
+		if config['iocs']:
+			create_ioc_sweep_stage(db_path, manifest, config['iocs'], config['force'])
+		if 'parquet' in config['format']:
+			export_parquet_stage(db_path, output_dir, manifest, config['force'])
+		if config['timeline']:
+			create_timeline_stage(db_path, output_dir, hostname, manifest, config['force'], 'parquet' in config['format'])
+		if 'xlsx' in config['format']:
+			create_report_stage(db_path, output_report, manifest, config['force'], config['report_config'], prefetch['scans'], config['report_workers'])
+	return [name for name, seconds in timings.items() if seconds is None]
+
+
+########################################################################  Batch  ###################################################################
+
+# Batch mode (-b) processes many acquisitions: each host goes to its own output subfolder with its own manifest, hosts run in a pool
+# (--hosts) and share global limits on tool processes (--jobs, RESOURCE_LIMITS) and database loads (--ingest-writers).
+# windissect_batch.json, in the output folder, records the status of each host: completed hosts are skipped by the next runs.
+BATCH_STATUS = "windissect_batch.json"
+
+
+# A host folder is the root of the acquired system, or holds it in a subfolder (KAPE puts it in a drive letter folder, "C")
+def collection_root(folder):
+	if os.path.isdir(os.path.join(folder, "Windows")):
+		return folder
+	for name in sorted(os.listdir(folder)):
+		candidate = os.path.join(folder, name)
+		if os.path.isdir(os.path.join(candidate, "Windows")):
+			return candidate
+	return folder
+
+
+# Hosts of a batch as (name, target root): the subfolders of a folder (named after them), or the rows of a CSV file or the
+# items of a JSON list with "name" and "target"
+def batch_hosts(path):
+	if os.path.isdir(path):
+		return [(name, collection_root(os.path.join(path, name))) for name in sorted(os.listdir(path)) if os.path.isdir(os.path.join(path, name))]
+	with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+		if path.lower().endswith(".json"):
+			items = json.load(f)
+		else:
+			items = list(csv.DictReader(f))
+	hosts = []
+	for item in items:
+		if not item.get('name') or not item.get('target'):
+			raise ValueError(path+": each host needs a \"name\" and a \"target\"")
+		hosts.append((item['name'], item['target']))
+	return hosts
+
+
+def load_batch_status(output_dir):
+	path = output_dir+"\\"+BATCH_STATUS
+	try:
+		with open(path, 'r', encoding='utf-8') as f:
+			hosts = json.load(f).get('hosts', {})
+	except (OSError, ValueError):
+		hosts = {}
+	return {'path': path, 'hosts': hosts}
+
+
+def save_batch_status(status):
+	temporary = status['path']+".tmp"
+	with open(temporary, 'w', encoding='utf-8') as f:
+		json.dump({'hosts': status['hosts']}, f, indent=1, sort_keys=True)
+	os.replace(temporary, status['path'])
+
+
+def log_batch_summary(status, hosts):
+	lines = ["Batch summary:"]
+	for name, target in hosts:
+		entry = status['hosts'].get(name, {})
+		line = "\t"+name+": "+entry.get('status', 'not run')
+		if entry.get('seconds') is not None:
+			line += " in "+"%.1f" % entry['seconds']+"s"
+		if entry.get('failed'):
+			line += " (failed stages: "+", ".join(entry['failed'])+")"
+		if entry.get('error'):
+			line += " ("+entry['error']+")"
+		lines.append(line)
+	for line in lines:
+		Logger.info(line)
+		print(line)
+
+
+def run_batch(batch, output_dir, config):
+	hosts = batch_hosts(batch)
+	status = load_batch_status(output_dir)
+	slots = batch_slots(config['jobs'], config['ingest_writers'])
+	lock = threading.Lock()
+	Logger.info("Batch of "+str(len(hosts))+" hosts ("+str(config['hosts'])+" at a time).")
+
+	def run_host(name, target):
+		start = time.perf_counter()
+		entry = {'target': target}
+		try:
+			failed = dissect_host(target, output_dir+"\\"+name, name, config, slots)
+			entry.update(status='partial' if failed else 'done', failed=failed)
+		except Exception as e:
+			Logger.info("Host "+name+" failed: "+repr(e))
+			entry.update(status='failed', error=repr(e))
+		entry['seconds'] = time.perf_counter() - start
+		entry['finished'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+		with lock:
+			status['hosts'][name] = entry
+			save_batch_status(status)
+		Logger.info("Host "+name+": "+entry['status']+".")
+
+	with ThreadPoolExecutor(max_workers=config['hosts']) as pool:
+		futures = []
+		for name, target in hosts:
+			entry = status['hosts'].get(name)
+			if entry and entry.get('status') == 'done' and entry.get('target') == target and not is_forced('host:'+name, config['force']):
+				Logger.info("Host "+name+" is already done, skipping.")
+				continue
+			futures.append(pool.submit(run_host, name, target))
+		for future in futures:
+			future.result()
+	log_batch_summary(status, hosts)
+
 
 def dir_path(string):
 	if os.path.isdir(string):
@@ -566,25 +2563,103 @@ def dir_path(string):
 	else:
 		raise NotADirectoryError(string)
 
+def positive_int(string):
+	value = int(string)
+	if value < 1:
+		raise argparse.ArgumentTypeError(string+" is not a positive integer")
+	return value
+
 
 ########################################################################  MAIN  ####################################################################""
 
+# win_dissect.py search "[text]": searches the indexes built with -S, in one database or in every host of a batch output folder
+def search_main(arguments):
+	parser = argparse.ArgumentParser(prog="win_dissect.py search", description="Searches the free-text columns of the artefacts indexed with -S (at least 3 characters, case insensitive).", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+	parser.add_argument("query", help="Text to look for, anywhere in the indexed columns (or an FTS5 query with --fts).")
+	parser.add_argument("-o", "--output", required=False, help="Output folder of the run.", default=os.getcwd()+"\\OUTPUT", type=dir_path)
+	parser.add_argument("-n", "--name", required=False, help="Name of the target (the database is [output]\\[name].db).", default="windissect_output")
+	parser.add_argument("-b", "--batch", required=False, help="The output folder is a batch output: search the database of every host ([output]\\[host]\\[host].db), -n is ignored.", action="store_true")
+	parser.add_argument("--table", required=False, help="Only search these tables (table name or wildcards). Can be repeated.", action='append', default=None)
+	parser.add_argument("--order", required=False, help="Hits returned: the oldest first (time) or the best matches first (rank).", default="time", choices=['time', 'rank'])
+	parser.add_argument("-l", "--limit", required=False, help="Number of hits returned.", default=SEARCH_LIMIT, type=positive_int)
+	parser.add_argument("--fts", required=False, help="The query uses the FTS5 syntax (\"a\" AND \"b\", NEAR(...), column filters).", action="store_true")
+	parser.add_argument("--csv", required=False, help="Also write the hits to this CSV file.", default=None)
+	args = parser.parse_args(arguments)
+
+	if args.batch:
+		databases = [(name, args.output+"\\"+name+"\\"+name+".db") for name in sorted(os.listdir(args.output)) if os.path.isfile(args.output+"\\"+name+"\\"+name+".db")]
+	else:
+		databases = [(args.name, args.output+"\\"+args.name+".db")] if os.path.isfile(args.output+"\\"+args.name+".db") else []
+	if not databases:
+		parser.error("No database found in "+args.output+".")
+
+	start = time.perf_counter()
+	query = search_query(args.query, args.fts)
+	hits = []
+	indexed = 0
+	for host, db_path in databases:
+		try:
+			found, tables = search_database(db_path, query, args.order, args.limit, args.table)
+		except sqlite3.Error as e:
+			parser.error("Search failed on "+db_path+": "+str(e))
+		hits.extend(hit + (host,) for hit in found)
+		indexed += tables
+	hits.sort(key=lambda hit: hit[0])
+	hits = hits[:args.limit]
+	milliseconds = (time.perf_counter() - start) * 1000
+
+	if not indexed:
+		print("No search index in "+", ".join(db_path for host, db_path in databases)+": run win_dissect with -S first.")
+		return
+	rows = [(search_time(time_value), host, artefact, table_name, index, round(-rank, 2), snippet) for key, time_value, artefact, table_name, index, rank, snippet, host in hits]
+	for row in rows:
+		print(row[0].ljust(27)+("" if len(databases) == 1 else row[1]+"  ")+row[2].ljust(15)+row[3]+"#"+str(row[4])+"  "+row[6].replace("\r", " ").replace("\n", " "))
+	print(str(len(rows))+" hits ("+args.order+" order, limit "+str(args.limit)+") in "+"%.0f" % milliseconds+" ms, "+str(indexed)+" indexed tables.")
+	if args.csv:
+		with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+			writer = csv.writer(f)
+			writer.writerow(['time', 'host', 'artefact', 'table', 'index', 'score', 'snippet'])
+			writer.writerows(rows)
+
+
 def main():
 
+	# A command of its own, which only reads the database and leaves the log of the last run alone
+	if len(sys.argv) > 1 and sys.argv[1] == "search":
+		return search_main(sys.argv[2:])
+
+	# Configured here and not at import time, so that parsing processes do not truncate the log
+	logging.basicConfig(filename="windissect_log.log", format='%(asctime)s %(message)s', filemode='w')
+
 	parser = argparse.ArgumentParser(description="Win_Dissect by Martendal. It's just an orchestrator of Eric Zimmerman's tools that can be launched to convert a KAPE acquisition to CSV and to a XLSX \"portable case\".", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 	parser.add_argument("-t", "--target", required=False, help="Absolute path to the target folder containing the OS to parse.", default="C:\\", type=dir_path)
 	parser.add_argument("-o", "--output", required=False, help="Absolute path to the output folder. The folder must exist.", default=os.getcwd()+"\\OUTPUT", type=dir_path)
 	parser.add_argument("-n", "--name", required=False, help="Name of the target.", default="windissect_output")
+	parser.add_argument("-j", "--jobs", required=False, help="Number of conversion stages (Eric Zimmerman's tools) running at the same time.", default=os.cpu_count() or 1, type=positive_int)
+	parser.add_argument("-f", "--force", required=False, help="Run a stage even if the manifest says it is up to date (stage name, \"table:[table name]\", \"report\", wildcards or \"all\"). Can be repeated.", action='append', default=[])
+	parser.add_argument("-r", "--report-config", required=False, help="JSON file with extra report sheets (same format as REPORT_SHEETS in this script).", default=None)
+	parser.add_argument("-F", "--format", required=False, help="Outputs built from the database: xlsx (report) and/or parquet (one file per table, needs pyarrow). Can be repeated, xlsx alone by default.", action='append', choices=['xlsx', 'parquet'], default=None)
+	parser.add_argument("-T", "--timeline", required=False, help="Also build a timeline of all the tables: timeline.csv, a \"timeline\" table in the database and, with -F parquet, parquet\\timeline.parquet.", action="store_true")
+	parser.add_argument("-b", "--batch", required=False, help="Process many acquisitions: a folder holding one subfolder per host, or a CSV/JSON file listing hosts (\"name\" and \"target\"). Each host goes to its own subfolder of the output folder, -t and -n are ignored.", default=None)
+	parser.add_argument("--hosts", required=False, help="Batch mode: number of hosts processed at the same time (they share the --jobs tool processes).", default=2, type=positive_int)
+	parser.add_argument("--ingest-writers", required=False, help="Batch mode: number of databases loaded at the same time.", default=1, type=positive_int)
+	parser.add_argument("--evtx-engine", required=False, help="EVTX parser: EvtxECmd, or the built-in parser spreading each log over all the CPUs (native, fewer event maps).", default="evtxecmd", choices=['evtxecmd', 'native'])
+	parser.add_argument("-S", "--search-index", required=False, help="Also index the free-text columns of the artefacts (FTS5) for \"win_dissect.py search\". Only tables loaded again are indexed again.", action="store_true")
+	parser.add_argument("-p", "--partition", required=False, help="Split the USN journal and EVTX tables having more than this number of rows by day (one table per day behind the table's view), so that time-bounded queries only read the days they need.", nargs='?', const=PARTITION_MIN_ROWS, default=None, type=int)
+	parser.add_argument("-i", "--iocs", required=False, help="Sweep the loaded tables for the indicators of this file (CSV with \"value\", \"type\" and \"description\" columns, or one value per line): hits go to the \"ioc_hits\" table and the \"IOC hits\" sheet.", default=None)
+	parser.add_argument("-P", "--profile", required=False, help="Profile the Python stages with cProfile (.prof and .txt files in the windissect_profile subfolder of the output).", action="store_true")
+	parser.add_argument("-w", "--ingest-workers", required=False, help="Number of processes parsing CSV files while loading the database (1 loads everything in a single process).", default=os.cpu_count() or 1, type=positive_int)
+	parser.add_argument("--report-workers", required=False, help="Number of processes running the report queries, each over its own read-only connection (1 runs them in this process).", default=os.cpu_count() or 1, type=positive_int)
+	add_tool_arguments(parser)
 	args = parser.parse_args()
 	config = vars(args)
+	config['format'] = config['format'] or ['xlsx']
+	configure_tools(config, TOOL_LOG_FOLDER)
 	Logger.info(config)
 
 	target_root = config['target']
 	output_dir = config['output']
 	hostname = config['name']
-	db_name = hostname+".db"
-	db_path = output_dir+"\\"+db_name
-	output_report = output_dir+"\\"+hostname+".xlsx"
 
 
 	Logger.info("Launching Win_Dissect.")
@@ -593,9 +2668,41 @@ def main():
 		Logger.info("Creating output directory.")
 		os.makedirs(output_dir)
 
-	convert_target(target_root,output_dir,db_path)
+	# Checked now rather than after hours of conversion
+	load_report_sheets(config['report_config'])
+	if config['iocs']:
+		try:
+			load_indicators(config['iocs'])
+		except (OSError, UnicodeDecodeError, csv.Error) as e:
+			parser.error("Cannot read the indicators "+config['iocs']+": "+str(e))
+	if 'xlsx' in config['format']:
+		try:
+			import xlsxwriter
+		except ImportError:
+			parser.error("--format xlsx needs the xlsxwriter package (pip install xlsxwriter).")
+	if 'parquet' in config['format']:
+		try:
+			import pyarrow.parquet
+		except ImportError:
+			parser.error("--format parquet needs the pyarrow package (pip install pyarrow).")
 
-	create_xlsx_report(db_path, output_report,Logger)
+	if config['batch']:
+		try:
+			batch_hosts(config['batch'])
+		except (OSError, ValueError) as e:
+			parser.error("Cannot read the batch "+config['batch']+": "+str(e))
+
+	open_metrics(output_dir+"\\"+METRICS_FILE)
+	try:
+		if config['batch']:
+			run_batch(config['batch'], output_dir, config)
+		else:
+			dissect_host(target_root, output_dir, hostname, config)
+	finally:
+		for line in metrics_summary():
+			Logger.info(line)
+			print(line)
+		close_metrics()
 
 
 if __name__ == "__main__":
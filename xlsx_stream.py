@@ -0,0 +1,107 @@
+'''
+Streaming XLSX writer shared by win_dissect and volxlsx.
+
+Rows are written one by one with xlsxwriter's constant_memory mode, so a sheet never has to fit in RAM. Each sheet gets the "Tag"
+bookmarking column, and results bigger than what Excel accepts in a sheet continue in numbered sheets ("Logon Events (2)", ...).
+
+https://github.com/Martendal/DFIR-tools
+'''
+
+from datetime import datetime
+from timestamps import parse_timestamp, datetime_from_epoch
+
+
+# Excel limits: rows per sheet (header included) and sheet name length
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_SHEETNAME = 31
+
+# Data rows written in a sheet before continuing in the next one
+SHEET_MAX_ROWS = EXCEL_MAX_ROWS - 1
+
+TAGS = ['Evidence', 'Of interest', 'Bookmark']
+
+# Opens a workbook in constant memory mode. Strings are always written as strings (no formula, URL or number guessing).
+# xlsxwriter is imported here: worker processes and runs without a report never load it.
+def open_workbook(path):
+	import xlsxwriter
+	workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'strings_to_formulas': False, 'strings_to_urls': False, 'strings_to_numbers': False})
+	formats = {
+		'header': workbook.add_format({'bold': True, 'bg_color': '#D9E1F2', 'bottom': 1}),
+		'date': workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'}),
+		####### Bookmarking colors #########
+		# Light red fill for "evidence"
+		'Evidence': workbook.add_format({'bg_color':   '#FFC7CE'}),
+		# Light yellow fill for "of interest"
+		'Of interest': workbook.add_format({'bg_color':   '#FFEB9C'}),
+		# Green fill for "bookmark"
+		'Bookmark': workbook.add_format({'bg_color':   '#C6EFCE'}),
+		####################################
+	}
+	return {'workbook': workbook, 'formats': formats, 'sheets': set()}
+
+
+def close_workbook(report):
+	report['workbook'].close()
+
+
+# Sheet names must be unique and at most 31 characters long, continuation sheets are numbered
+def sheet_name(report, name, number):
+	suffix = "" if number == 1 else " ("+str(number)+")"
+	name = name[:EXCEL_MAX_SHEETNAME - len(suffix)]+suffix
+	while name.lower() in report['sheets']:
+		number += 1
+		suffix = " ("+str(number)+")"
+		name = name[:EXCEL_MAX_SHEETNAME - len(suffix)]+suffix
+	report['sheets'].add(name.lower())
+	return name
+
+
+# Filter, column width, tag validation and bookmarking colors, once the rows of a sheet are written
+def finish_sheet(report, worksheet, rows, width):
+	formats = report['formats']
+	last_row = max(rows, 1)
+	worksheet.autofilter(0, 0, rows, width)
+	worksheet.freeze_panes(1, 0)
+	worksheet.set_column(0, width, 17)
+	worksheet.data_validation(1, 0, last_row, 0, {'validate': 'list', 'source': TAGS})
+	for tag in TAGS:
+		worksheet.conditional_format(1, 0, last_row, 0, {'type': 'text', 'criteria': 'containing', 'value': tag, 'format': formats[tag]})
+
+
+def start_sheet(report, name, number, columns):
+	worksheet = report['workbook'].add_worksheet(sheet_name(report, name, number))
+	worksheet.write_row(0, 0, ['Tag'] + list(columns), report['formats']['header'])
+	return worksheet
+
+
+# Writes the rows (any iterable of sequences) after a "Tag" column, continuing in new sheets past SHEET_MAX_ROWS rows.
+# Values of the "dates" columns (epoch microseconds or strings), and datetime values, are written as Excel dates when they can be parsed. Returns the number of written rows.
+def write_sheet(report, name, columns, rows, dates=()):
+	date_format = report['formats']['date']
+	date_positions = {i for i, column in enumerate(columns) if column in dates}
+	width = len(columns)
+	number = 1
+	worksheet = start_sheet(report, name, number, columns)
+	row_number = 0
+	total = 0
+	for row in rows:
+		if row_number == SHEET_MAX_ROWS:
+			finish_sheet(report, worksheet, row_number, width)
+			number += 1
+			worksheet = start_sheet(report, name, number, columns)
+			row_number = 0
+		row_number += 1
+		for position, value in enumerate(row):
+			if value is None or value == '':
+				continue
+			if position in date_positions or isinstance(value, datetime):
+				timestamp = datetime_from_epoch(value) if isinstance(value, int) else parse_timestamp(value)
+				if timestamp is not None and timestamp.year >= 1900:
+					worksheet.write_datetime(row_number, position + 1, timestamp, date_format)
+					continue
+				if isinstance(value, datetime):
+					value = str(value)
+			worksheet.write(row_number, position + 1, value)
+		total += 1
+	finish_sheet(report, worksheet, row_number, width)
+	return total